@@ -0,0 +1,194 @@
+import json
+import numpy as np
+import os
+
+from crossSection import CrossSection
+from pathlib import Path
+from time import perf_counter
+
+# the file in the checkpoint folder with the inputs and options of the run the checkpoint belongs to
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+# the extension record of a cross section, saved as one column per field
+CHECKPOINT_FIELDS = (("source_height", np.float64), ("source_length", np.float64), ("receiver_height", np.float64),
+                     ("wall_index", np.int64), ("wall_height", np.float64))
+
+class CheckpointManager:
+
+    def __init__(self, folder, run_information, resume=False, metrics=None):
+        """
+        Keeps the results of the receiver batches of a run in a folder, so a run that stops half way can be resumed (see main --resume).
+        A batch is saved twice: its cross sections once they are computed, and its receiver numbers once its xml files are written.
+        A resumed run skips the batches that are written, writes the saved cross sections, and computes the other batches again.
+        """
+        self.folder = folder
+        # gets the time of saving and reading the batches and the number of batches, optional
+        self.metrics = metrics
+        Path(folder).mkdir(parents=True, exist_ok=True)
+
+        # a checkpoint is only used by a run with the same inputs and options, json turns tuples into lists so compare it as json
+        run_information = json.loads(json.dumps(run_information, sort_keys=True))
+        file_path = "{}/{}".format(folder, CHECKPOINT_FILE_NAME)
+        previous = None
+        if resume and os.path.isfile(file_path):
+            with open(file_path) as f:
+                previous = json.load(f)
+
+        if previous != run_information:
+            if resume:
+                print("no checkpoint of this run in {}, starting from the first batch".format(folder))
+            self.remove()
+            with open(file_path + ".tmp", "w") as f:
+                json.dump(run_information, f, indent=4, sort_keys=True)
+                f.write("\n")
+            os.replace(file_path + ".tmp", file_path)
+
+    def get_batch_file_path(self, batch, kind):
+        """
+        Explanation: Returns the path of a file of a batch
+        ---------------
+        Input:
+            batch : integer - the number of the batch
+            kind : string - "sections" for the cross sections, "done" for the receiver numbers
+        ---------------
+        Output:
+            string - the path of the npz file
+        """
+        return "{}/{}_{:06d}.npz".format(self.folder, kind, batch)
+
+    def get_batch_state(self, batch):
+        """
+        Explanation: Returns how far a batch got in the run that is resumed
+        ---------------
+        Input:
+            batch : integer - the number of the batch
+        ---------------
+        Output:
+            string - "done" if its xml files are written, "sections" if only its cross sections are saved, None if it has to be computed
+        """
+        if os.path.isfile(self.get_batch_file_path(batch, "done")):
+            return "done"
+        if os.path.isfile(self.get_batch_file_path(batch, "sections")):
+            return "sections"
+        return None
+
+    def write_sections(self, batch, receiver_cross_sections):
+        """
+        Explanation: Saves the cross sections of a batch. The vertices and material codes of all cross sections are stored one after
+        the other, with the number of vertices per cross section and the number of cross sections per receiver.
+        The sources (the first vertex and the source length) and the reflection points (the wall vertex) are part of these arrays.
+        ---------------
+        Input:
+            batch : integer - the number of the batch
+            receiver_cross_sections : list - (receiver_coords, list of CrossSection) per receiver
+        ---------------
+        Output:
+            void (writes the npz file)
+        """
+        watch = perf_counter()
+        cross_sections = [cross_section for receiver_coords, receiver_sections in receiver_cross_sections for cross_section in receiver_sections]
+        vertices = [cross_section.vertices for cross_section in cross_sections]
+        arrays = {
+            "receiver_coords": np.array([receiver_coords for receiver_coords, receiver_sections in receiver_cross_sections], dtype=np.float64).reshape(-1, 2),
+            "section_counts": np.array([len(receiver_sections) for receiver_coords, receiver_sections in receiver_cross_sections], dtype=np.int64),
+            "vertex_counts": np.array([len(section_vertices) for section_vertices in vertices], dtype=np.int64),
+            "vertices": np.concatenate(vertices) if vertices else np.zeros((0, 3)),
+            "material_codes": np.concatenate([cross_section.material_codes for cross_section in cross_sections]) if cross_sections else np.zeros(0, dtype=np.uint8)
+        }
+        for field, dtype in CHECKPOINT_FIELDS:
+            arrays[field] = np.array([getattr(cross_section, field) for cross_section in cross_sections], dtype=dtype)
+
+        self.write_batch_file(self.get_batch_file_path(batch, "sections"), arrays)
+        if self.metrics is not None:
+            self.metrics.add_time("checkpoint_write", watch)
+
+    def read_sections(self, batch):
+        """
+        Explanation: Reads the cross sections of a batch saved by write_sections
+        ---------------
+        Input:
+            batch : integer - the number of the batch
+        ---------------
+        Output:
+            list - (receiver_coords, list of CrossSection) per receiver
+        """
+        watch = perf_counter()
+        with np.load(self.get_batch_file_path(batch, "sections")) as arrays:
+            vertices = np.split(arrays["vertices"], np.cumsum(arrays["vertex_counts"])[:-1])
+            material_codes = np.split(arrays["material_codes"], np.cumsum(arrays["vertex_counts"])[:-1])
+            fields = [(field, arrays[field].tolist()) for field, dtype in CHECKPOINT_FIELDS]
+            receivers_coords = [tuple(receiver_coords) for receiver_coords in arrays["receiver_coords"].tolist()]
+            section_start = np.concatenate(([0], np.cumsum(arrays["section_counts"]))).tolist()
+
+        cross_sections = []
+        for i in range(section_start[-1]):
+            cross_section = CrossSection(vertices[i], material_codes[i])
+            for field, values in fields:
+                setattr(cross_section, field, values[i])
+            cross_sections.append(cross_section)
+
+        if self.metrics is not None:
+            self.metrics.add_time("checkpoint_read", watch)
+        return [(receiver_coords, cross_sections[section_start[i]:section_start[i + 1]]) for i, receiver_coords in enumerate(receivers_coords)]
+
+    def write_done(self, batch, receivers):
+        """
+        Explanation: Marks a batch as done once its xml files are written, with the number and the number of paths of its receivers
+        ---------------
+        Input:
+            batch : integer - the number of the batch
+            receivers : list - (receiver_coords, number, path_count) per receiver that is written
+        ---------------
+        Output:
+            void (writes the npz file)
+        """
+        self.write_batch_file(self.get_batch_file_path(batch, "done"), {
+            "receiver_coords": np.array([receiver[0] for receiver in receivers], dtype=np.float64).reshape(-1, 2),
+            "receiver_numbers": np.array([receiver[1] for receiver in receivers], dtype=np.int64),
+            "receiver_paths": np.array([receiver[2] for receiver in receivers], dtype=np.int64)
+        })
+        if self.metrics is not None:
+            self.metrics.count("checkpoint_batches_written")
+
+    def read_done(self, batch):
+        """
+        Explanation: Reads the receivers of a batch that is done, see write_done
+        ---------------
+        Input:
+            batch : integer - the number of the batch
+        ---------------
+        Output:
+            list - (receiver_coords, number, path_count) per receiver that is written
+        """
+        with np.load(self.get_batch_file_path(batch, "done")) as arrays:
+            receivers_coords = [tuple(receiver_coords) for receiver_coords in arrays["receiver_coords"].tolist()]
+            return list(zip(receivers_coords, arrays["receiver_numbers"].tolist(), arrays["receiver_paths"].tolist()))
+
+    def write_batch_file(self, file_path, arrays):
+        """
+        Explanation: Writes the arrays of a batch next to the file first and then replaces it, so a run that stops half way
+        never leaves a batch file that is only partly written
+        ---------------
+        Input:
+            file_path : string - the path of the npz file
+            arrays : dictionary - the arrays by name
+        ---------------
+        Output:
+            void (writes the npz file)
+        """
+        with open(file_path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(file_path + ".tmp", file_path)
+
+    def remove(self):
+        """
+        Explanation: Removes the files of the checkpoint, when a new run starts or when the run is complete
+        ---------------
+        Input:
+            void
+        ---------------
+        Output:
+            void (removes the files)
+        """
+        for file_path in Path(self.folder).iterdir():
+            if file_path.name.startswith(("sections_", "done_", CHECKPOINT_FILE_NAME)):
+                file_path.unlink()
@@ -11,7 +11,7 @@ TEST_CNOSSOS_RELEASE_FOLDER=$7
 CODE_FILE_PATH=$8
 OUTPUT_SHAPE_FILE_PATH=$9
 
-CONSTRAINT_TIN_PATH=$OBJP_OUTPUT_FOLDER/constrainted_tin.objp
+CONSTRAINT_TIN_PATH=$OBJP_OUTPUT_FOLDER/constrainted_tin.tinb
 XML_INPUT_FOLDER=$OUTPUT_FOLDER/xml
 XML_OUTPUT_FOLDER=$OUTPUT_FOLDER/xml_output
 RECEIVER_DICT=$OUTPUT_FOLDER/receiver_dict.txt
@@ -1,97 +1,303 @@
 import json
+import numpy as np
+import re
 import sys
 
+from groundTin import grow_array, write_binary_tin
 from pathlib import Path
 
+# the number of characters read from the json file at once, memory is bounded by this and the triangle arrays
+JSON_CHUNK_CHARS = 16 * 1024 * 1024
+# the number of vertices, triangles or attributes written to the text files at once
+TEXT_CHUNK_ROWS = 100000
+# the neighbour slot of the edges (v0, v1), (v1, v2) and (v0, v2) of a triangle -> [v0, v1, v2, n0, n1, n2]
+EDGE_NEIGHBOUR_SLOTS = np.array([5, 3, 4])
+
+JSON_DECODER = json.JSONDecoder()
+WHITESPACE = re.compile(r"\s*")
+# the closing bracket of the last vertex followed by the closing bracket of the vertices array
+VERTICES_END = re.compile(r"\]\s*\]")
+VERTEX_SEPARATORS = str.maketrans("[],", "   ")
+
+def create_adjacency(faces, n_vts):
+    """
+    Explination: Finds the neighbours of all triangles by sorting their edges, triangles that share an edge are neighbours.
+    Like the edge dictionary this replaces, the first triangle on an edge is matched with every later triangle on it.
+    ---------------
+    Input:
+        faces : np.ndarray (n, 3) - The vertex ids of the triangles.
+        n_vts : integer - The number of vertices.
+    ---------------
+    Output:
+        trs : np.ndarray (n, 6) - The triangles, three vertex ids followed by three neighbour ids (-1 if there is none).
+    """
+    trs = np.full((len(faces), 6), -1, dtype=np.int32)
+    trs[:, :3] = faces
+    if len(faces) == 0:
+        return trs
+
+    # edge i of triangle t is entry 3 * t + i
+    edges = faces[:, [0, 1, 1, 2, 0, 2]].reshape(-1, 2).astype(np.int64)
+    edges.sort(axis=1)
+    keys = edges[:, 0] * max(n_vts, 1) + edges[:, 1]
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    run_start = np.maximum.accumulate(np.where(is_first, np.arange(len(order)), 0))
+
+    later_entries = order[~is_first]
+    first_entries = order[run_start[~is_first]]
+
+    # every later triangle on an edge gets the first one, the first one keeps the last one it was matched with
+    trs[later_entries // 3, EDGE_NEIGHBOUR_SLOTS[later_entries % 3]] = first_entries // 3
+    trs[first_entries // 3, EDGE_NEIGHBOUR_SLOTS[first_entries % 3]] = later_entries // 3
+
+    return trs
+
 class json_parse:
 
     def __init__(self):
-        self.vts = []
-        self.trs = []
-        self.attr = []
+        self.vts = np.zeros((0, 3))
+        self.trs = np.zeros((0, 6), dtype=np.int32)
+        self.attribute_codes = np.zeros(0, dtype=np.int32)
+        self.attribute_names = []
+
+        self.n_vts = 0
+        self.n_trs = 0
+        self.attribute_name_to_code = {}
+        self.id_value = None
+
+        self.input_file = None
+        self.buffer = ""
+        self.position = 0
+        self.end_of_file = False
+
+    def fill_buffer(self, size=JSON_CHUNK_CHARS):
+        """
+        Explination: Reads the next chunk of the json file, the part of the buffer that has been read already is dropped.
+        ---------------
+        Input:
+            size : integer - The minimal number of characters to read.
+        ---------------
+        Output:
+            boolean - False if the end of the file has been reached.
+        """
+        chunk = self.input_file.read(max(size, JSON_CHUNK_CHARS))
+        if chunk == "":
+            self.end_of_file = True
+            return False
+
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        """
+        Explination: Skips whitespace and returns the next character in the json file without reading it.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            string - The next character, empty at the end of the file.
+        """
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill_buffer():
+                return ""
 
-        self.edges = {}
+    def expect(self, character):
+        """
+        Explination: Reads the next character in the json file, it has to be the given character.
+        ---------------
+        Input:
+            character : string - The character that is expected.
+        ---------------
+        Output: void
+        """
+        found = self.peek()
+        if found != character:
+            raise ValueError("Invalid json, expected '{}' but found '{}'".format(character, found))
+        self.position += 1
+
+    def read_value(self):
+        """
+        Explination: Reads the next complete json value, more of the file is read until the value fits in the buffer.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            The decoded json value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = JSON_DECODER.raw_decode(self.buffer, self.position)
+                # a number at the end of the buffer could continue in the next chunk
+                if end < len(self.buffer) or self.end_of_file:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.end_of_file:
+                    raise
+            # the unread part is at least doubled, so a large value is decoded a logarithmic number of times
+            self.fill_buffer(len(self.buffer) - self.position)
+
+    def read_members(self):
+        """
+        Explination: Reads a json object one member at a time, the value of every member has to be read before the next key.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            generator of string - The keys of the object.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.position += 1
+            return
+
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            yield key
+
+            separator = self.peek()
+            self.position += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError("Invalid json, expected ',' or '}}' but found '{}'".format(separator))
+
+    def read_vertices(self):
+        """
+        Explination: Reads the vertices array, all complete vertices in the buffer are parsed at once.
+        ---------------
+        Input: void
+        ---------------
+        Output: void (fills self.vts)
+        """
+        self.expect("[")
+        while True:
+            match = VERTICES_END.search(self.buffer, self.position)
+            if match:
+                end = match.start() + 1
+            else:
+                end = self.buffer.rfind("]", self.position) + 1
+
+            if end > self.position:
+                values = np.fromstring(self.buffer[self.position:end].translate(VERTEX_SEPARATORS), sep=' ')
+                if len(values) % 3 != 0:
+                    raise ValueError("Invalid vertices, every vertex should have 3 coordinates")
+                values = values.reshape(-1, 3)
+
+                self.vts = grow_array(self.vts, self.n_vts + len(values))
+                self.vts[self.n_vts:self.n_vts + len(values)] = values
+                self.n_vts += len(values)
+                self.position = end
+
+            if self.peek() == "]":
+                self.position += 1
+                return
+            if not match and not self.fill_buffer():
+                raise ValueError("Invalid json, the vertices array is not closed")
+
+    def add_city_object(self, city_object):
+        """
+        Explination: Adds the triangles of one city object, with its attribute.
+        ---------------
+        Input:
+            city_object : dict - The decoded city object.
+        ---------------
+        Output: void (fills self.trs and self.attribute_codes)
+        """
+        # Get the attributes of this object, if it has none the value of the previous object is used
+        attributes = city_object["attributes"]
+
+        if 'bodemfactor' in attributes.keys():
+            self.id_value = 'g' + attributes["bodemfactor"]
+        elif 'bodemfacto' in attributes.keys():
+            self.id_value = 'g' + attributes["bodemfacto"]
+
+        #Get the identificatie of this object
+        if 'part_id' in attributes.keys():
+            part_id = attributes["part_id"]
+            #If the identificatie is not empty, it is a building and this is the id used to identify the object
+            if part_id != '':
+                self.id_value = 'b' + part_id
+
+        faces = [triangle[:3] for object_geom in city_object['geometry']
+                 for boundary in object_geom['boundaries']
+                 for triangle in boundary]
+        if len(faces) == 0:
+            return
+
+        if self.id_value not in self.attribute_name_to_code:
+            self.attribute_name_to_code[self.id_value] = len(self.attribute_names)
+            self.attribute_names.append(self.id_value)
+
+        n_trs = self.n_trs + len(faces)
+        self.trs = grow_array(self.trs, n_trs)
+        self.trs[self.n_trs:n_trs, :3] = faces
+        self.attribute_codes = grow_array(self.attribute_codes, n_trs)
+        self.attribute_codes[self.n_trs:n_trs] = self.attribute_name_to_code[self.id_value]
+        self.n_trs = n_trs
 
     def read_json(self, file_path):
-                
+        """
+        Explination: Reads a cityjson file in which every boundary is a triangle.
+        The file is read in chunks, only the vertices and city objects are kept, one city object is decoded at a time.
+        ---------------
+        Input:
+            file_path : string - The path to the cityjson file.
+        ---------------
+        Output: void (fills self.vts, self.trs and self.attribute_codes)
+        """
         with open(file_path, 'r') as json_input_file:
-            lines = json_input_file.readlines()
-            #Load the json
-            json_string = lines[0]
-            json_dict = json.loads(json_string)
-
-            #Assign the vertices
-            self.vts = json_dict["vertices"]
-
-            #Run through all the city json objects
-            objects = json_dict["CityObjects"]
-            for uuid in objects:
-                constrained_object = objects[uuid]
-                #print(constrained_object)
-                # Get the attributes of this object
-                attributes = constrained_object["attributes"]
-
-                if 'bodemfactor' in attributes.keys():
-                    id_value = 'g' + attributes["bodemfactor"]
-                elif 'bodemfacto' in attributes.keys():
-                    id_value = 'g' + attributes["bodemfacto"]
-
-                #Get the identificatie of this object
-                if 'part_id' in attributes.keys():
-                    part_id = attributes["part_id"]
-                    #If the identificatie is not empty, it is a building and this is the id used to identify the object
-                    if part_id != '':
-                        id_value = 'b' + part_id
-                
-                object_geoms = constrained_object['geometry']
-                for object_geom in object_geoms:
-                    object_boundaries = object_geom['boundaries']
-
-                    for boundary in object_boundaries:
-                        for triangle in boundary:
-                            v1 = triangle[0]
-                            v2 = triangle[1]
-                            v3 = triangle[2]
-                            face = [v1, v2, v3, -1, -1, -1]
-
-                            #The index this triangle will be at
-                            tri_index = len(self.trs)
-
-                            edge1 = [v1, v2]
-                            edge1.sort()
-                            edge1 = (edge1[0], edge1[1])
-                            
-                            edge2 = [v2, v3]
-                            edge2.sort()
-                            edge2 = (edge2[0], edge2[1])
-
-                            edge3 = [v1, v3]
-                            edge3.sort()
-                            edge3 = (edge3[0], edge3[1])
-
-                            tri_edges = [edge1, edge2, edge3]
-
-                            #Loop through all edges
-                            inc_tri = [5, 3, 4]
-                            count = 0
-                            for tri_edge in tri_edges:
-                                #Check if this edge already exists in the edges dict
-                                if tri_edge in self.edges.keys():
-                                    edge_value = self.edges[tri_edge]
-
-                                    face[inc_tri[count]] = edge_value[0]
-                                    self.trs[edge_value[0]][edge_value[1]] = tri_index
-                                #If this edge was not in the edges yet, add it as one
-                                else:
-                                    self.edges[tri_edge] = [tri_index, inc_tri[count]]
-                                
-                                count = count + 1
-
-                            #Append the face and the attribute of that face
-                            self.trs.append(face)
-                            self.attr.append(id_value)
-
-    def write_to_objp(self, file_path): #, id_to_attr):
+            self.input_file = json_input_file
+            self.buffer = ""
+            self.position = 0
+            self.end_of_file = False
+
+            for key in self.read_members():
+                if key == "vertices":
+                    self.read_vertices()
+                elif key == "CityObjects":
+                    for uuid in self.read_members():
+                        self.add_city_object(self.read_value())
+                else:
+                    self.read_value()
+
+            self.input_file = None
+            self.buffer = ""
+
+        self.vts.resize((self.n_vts, 3), refcheck=False)
+        self.attribute_codes.resize(self.n_trs, refcheck=False)
+        self.trs = create_adjacency(self.trs[:self.n_trs, :3], self.n_vts)
+
+    def write_to_binary(self, file_path):
+        """
+        Explination: Writes out the tin to a binary tin file, which can be read directly by the noise program.
+        ---------------
+        Input:
+            file_path : string - The path to the binary tin file we want to write to.
+        ---------------
+        Output: void
+        """
+        print("=== write to file {} ===".format(file_path))
+
+        if len(self.vts) > 0:
+            bounding_box_3d = list(self.vts.min(axis=0)) + list(self.vts.max(axis=0))
+        else:
+            bounding_box_3d = [0.0] * 6
+        write_binary_tin(file_path, self.vts, self.trs, self.attribute_codes,
+                         np.array(self.attribute_names, dtype=np.bytes_), bounding_box_3d)
+
+    def write_to_objp(self, file_path):
         """
         Explination: Writes out the tin to an objp file.
         ---------------
@@ -103,30 +309,19 @@ class json_parse:
         print("=== write to file {} ===".format(file_path))
 
         with open(file_path, 'w+') as output_file:
-            for vertex in self.vts:
-                vertex_str = "v " + str(vertex[0]) + " " + str(vertex[1]) + " " + str(vertex[2]) + "\n"
-                output_file.write(vertex_str)
-
-            for triangle in self.trs:
-                triangle_str = "f " + str(triangle[0] + 1) + " " + str(triangle[1] + 1) + " " + str(
-                    triangle[2] + 1) + " " + str(triangle[3] + 1) + " " + str(triangle[4] + 1) + " " + str(
-                    triangle[5] + 1) + "\n"
-                output_file.write(triangle_str)
-
-            for attribute in self.attr:
-                attribute_str = "a " + attribute + "\n"
-                output_file.write(attribute_str)
-                
-                #if attribute[0] != 0.0:
-                #    attribute_str = "a " + id_to_attr[int(attribute[0])] + "\n"
-                #    output_file.write(attribute_str)
-                #else:
-                #    attribute_str = "a " + id_to_attr[1001] + "\n"
-                #    output_file.write(attribute_str)
-
-    def write_to_obj(self, file_path): #, id_to_attr):
+            self.write_vertices(output_file)
+
+            for start in range(0, len(self.trs), TEXT_CHUNK_ROWS):
+                triangles = (self.trs[start:start + TEXT_CHUNK_ROWS] + 1).tolist()
+                output_file.write("".join("f {} {} {} {} {} {}\n".format(*triangle) for triangle in triangles))
+
+            for start in range(0, len(self.attribute_codes), TEXT_CHUNK_ROWS):
+                codes = self.attribute_codes[start:start + TEXT_CHUNK_ROWS].tolist()
+                output_file.write("".join("a " + self.attribute_names[code] + "\n" for code in codes))
+
+    def write_to_obj(self, file_path):
         """
-        Explination: Writes out the tin to an objp file.
+        Explination: Writes out the tin to an obj file.
         ---------------
         Input:
             file_path : string - The path to the obj file we want to write to.
@@ -136,25 +331,46 @@ class json_parse:
         print("=== write to file {} ===".format(file_path))
 
         with open(file_path, 'w+') as output_file:
-            for vertex in self.vts:
-                vertex_str = "v " + str(vertex[0]) + " " + str(vertex[1]) + " " + str(vertex[2]) + "\n"
-                output_file.write(vertex_str)
+            self.write_vertices(output_file)
 
-            for triangle in self.trs:
-                triangle_str = "f " + str(triangle[0] + 1) + " " + str(triangle[1] + 1) + " " + str(
-                    triangle[2] + 1) + "\n"
-                output_file.write(triangle_str)
+            for start in range(0, len(self.trs), TEXT_CHUNK_ROWS):
+                triangles = (self.trs[start:start + TEXT_CHUNK_ROWS, :3] + 1).tolist()
+                output_file.write("".join("f {} {} {}\n".format(*triangle) for triangle in triangles))
+
+    def write_vertices(self, output_file):
+        """
+        Explination: Writes the vertex lines of an obj or objp file.
+        ---------------
+        Input:
+            output_file : file - The opened obj or objp file.
+        ---------------
+        Output: void
+        """
+        for start in range(0, len(self.vts), TEXT_CHUNK_ROWS):
+            vertices = self.vts[start:start + TEXT_CHUNK_ROWS].tolist()
+            output_file.write("".join("v {} {} {}\n".format(*vertex) for vertex in vertices))
+
+# python create_objp.py json_file_path output_folder [--objp] [--obj]
+# the binary tin is always written, the text objp and obj files only when asked for.
+arguments = [argument for argument in sys.argv[1:] if not argument.startswith("--")]
+options = [argument for argument in sys.argv[1:] if argument.startswith("--")]
 
 jp = json_parse()
 
-json_file_path = sys.argv[1]
+json_file_path = arguments[0]
 jp.read_json(json_file_path)
 
-output_file_path = sys.argv[2]
+output_file_path = arguments[1]
 Path(output_file_path).mkdir(parents=True, exist_ok=True)
 
-objp_output_file = output_file_path + "/constrainted_tin.objp"
-jp.write_to_objp(objp_output_file)
+if "--objp" in options:
+    objp_output_file = output_file_path + "/constrainted_tin.objp"
+    jp.write_to_objp(objp_output_file)
+
+if "--obj" in options:
+    obj_output_file = output_file_path + "/constrainted_tin.obj"
+    jp.write_to_obj(obj_output_file)
 
-obj_output_file = output_file_path + "/constrainted_tin.obj"
-jp.write_to_obj(obj_output_file)
\ No newline at end of file
+# written last, so it is never older than the objp file it would otherwise be rebuilt from
+binary_output_file = output_file_path + "/constrainted_tin.tinb"
+jp.write_to_binary(binary_output_file)
@@ -2,18 +2,24 @@ import misc
 import numpy as np
 
 from pprint import pprint
+from walkEngine import walk_segment
 
 class CrossSection:
 
-    def __init__(self, points_to_source, receiver, source, reflection_heights):
-        self.points_to_source = points_to_source
-        self.reflection_heights = reflection_heights
-        self.receiver = receiver
-        self.source = source
-        
-        self.vertices = []
-        self.materials = []
-        self.extension = {}
+    # a cross section only stores its arrays and extension record, not the objects it was made from
+    __slots__ = ("vertices", "material_codes", "source_height", "source_length", "receiver_height", "wall_index", "wall_height")
+
+    def __init__(self, vertices=None, material_codes=None):
+        # the path from source to receiver, (n, 3) float64 vertices and a misc.MATERIAL_NAMES code per vertex
+        self.vertices = np.zeros((0, 3)) if vertices is None else np.asarray(vertices, dtype=np.float64)
+        self.material_codes = np.zeros(0, dtype=np.uint8) if material_codes is None else np.asarray(material_codes, dtype=np.uint8)
+
+        # the extension record: the source is the first vertex, the receiver the last and the wall (reflection) is optional.
+        self.source_height = 0.0
+        self.source_length = 0.0
+        self.receiver_height = 0.0
+        self.wall_index = -1
+        self.wall_height = 0.0
 
     def get_next_edge(self, ground_tin, tr, origin, destination):
         """
@@ -44,7 +50,7 @@ class CrossSection:
    
     def get_material(self, tin, buildings_manager, ground_type_manager, tr):
         """
-        Explanation: Returns the material and attribute id of the triangle
+        Explanation: Returns the material code and attribute id of the triangle
         ---------------
         Input:
             tin : ground_Tin object - stores the whole tin
@@ -53,19 +59,30 @@ class CrossSection:
             tr : interger - id of triangle
         ---------------
         Output:
-            string - material type
-            integer - attribute id of the building, or -1 if it is ground
+            integer - material code, see misc.MATERIAL_NAMES
+            integer - index of the building in the tin, or -1 if it is ground
         """
-        if tin.attributes[tr][0] == 'b':
-            building_id = tin.attributes[tr]
-            return "A0", building_id
-        elif tin.attributes[tr][0] == 'g':
-            if(tin.attributes[tr][1] == "0"):
-                return "G", -1
-            else:
-                return "C", -1
+        return int(tin.material_codes[tr]), int(tin.building_index[tr])
 
-    def get_cross_section(self, current_triangle, ground_tin, ground_type_manager, building_manager, source_height, receiver_height):
+    def get_extension(self):
+        """
+        Explanation: Returns the extension record as a dictionary, with the vertex index as key, in the order source, receiver, wall
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            dictionary - the extensions of the path, for example {0: ["source", h, length], n - 1: ["receiver", h]}
+        """
+        extension = {
+            0: ["source", self.source_height, self.source_length],
+            len(self.vertices) - 1: ["receiver", self.receiver_height]
+        }
+        if self.wall_index != -1:
+            extension[self.wall_index] = ["wall", self.wall_height, misc.MATERIAL_NAMES[misc.MATERIAL_A0]]
+        return extension
+
+    def get_cross_section(self, current_triangle, ground_tin, ground_type_manager, building_manager, source_height, receiver_height,
+                          points_to_source, receiver, source_length, reflection_heights, receiver_height_ground=None, walk=None):
         """
         Explanation: Finds cross-section while walking to the source point
         ---------------
@@ -74,55 +91,61 @@ class CrossSection:
             ground_tin : GroundTin object - stores the DTM in a triangle datastructure
             ground_type_manager : GroundTypeManager object - stores all the groundtype objects
             building_manager : BuildingManager object - stores all the building objects
+            source_height : float - height of the source above the ground
+            receiver_height : float - height of the receiver above the ground
+            points_to_source : list of (x,y) - the points to walk to, the reflection point(s) and the source
+            receiver : (x,y) - the receiver we walk from
+            source_length : float - the length of road the source stands for
+            reflection_heights : list - the heights of the reflecting walls
+            receiver_height_ground : float - the height of the tin at the receiver, it is interpolated if it is not given
+            walk : tuple - the walk to the first point, as returned by walk_segment (see walkEngine.walk_fan), it is walked here if not given
         ---------------
         Output:
-            void (saves the DSM, materials and extension in the class)
+            integer - the number of triangles walked (saves the vertices, material codes and extension in the class)
         """
         #print("=== cross_section ===")
         # define the neighbour ids
         nbs = [5, 3, 4] # -> [v0, v1, v2, n0, n1, n2]
 
-        # initialize extension, holds information about receiver, reflections and source.
-        extension = {}
+        # holds the location of the reflection, to store the extension at the end.
         reflection_point_id_inversed = 0
 
         # the first vertex is the receiver projected into its triangle
-        receiver_height_ground = ground_tin.interpolate_triangle(current_triangle, self.receiver)
+        if receiver_height_ground is None:
+            receiver_height_ground = ground_tin.interpolate_triangle(current_triangle, receiver)
 
         # get the material of the current triangle
         material_triangle, material_id = self.get_material(ground_tin, building_manager, ground_type_manager, current_triangle)
-        cross_section_vertices = [(self.receiver[0], self.receiver[1], receiver_height_ground)]
+        cross_section_vertices = [(receiver[0], receiver[1], receiver_height_ground)]
         material = [material_triangle]
         
         # Boolean to check if the path is on top of a building, or not. receiver is never in building
         in_building = False
-        origin = self.receiver
+        origin = receiver
+        triangles_walked = 0
 
-        for destination_id, destination in enumerate(self.points_to_source):
-            # keep going untill the source triangle has been found.
-            while not ground_tin.point_in_triangle(destination, current_triangle):
-                # Make sure that we have not gotten of the TIN
-                assert (current_triangle != -1)
-
-                # Get the outgoing edge of the triangle
-                edge_id, edge = self.get_next_edge(ground_tin, current_triangle, origin, destination)
-
-                # get intersection point between edge and receiver-source segment
-                interpolated_point = ground_tin.intersection_point(edge, destination, origin)
-                
-                current_material, current_building_id = self.get_material(ground_tin, building_manager, ground_type_manager,
-                                                                        current_triangle)
-
-                # move triangle to the next triangle in the path
-                current_triangle = ground_tin.trs[current_triangle][nbs[edge_id]]
-
-                # Get the material and building_id of next building
-                next_material, next_building_id = self.get_material(ground_tin, building_manager, ground_type_manager,
-                                                                    current_triangle)
+        for destination_id, destination in enumerate(points_to_source):
+            # walk to the destination in one go, then go over all edges the path crosses.
+            if destination_id == 0 and walk is not None:
+                crossing_points, edge_parameters, triangles, edges = walk
+            else:
+                crossing_points, edge_parameters, triangles, edges = walk_segment(ground_tin.vts, ground_tin.trs, current_triangle, origin, destination)
+            triangle_materials = ground_tin.material_codes[triangles].tolist()
+            triangle_building_ids = ground_tin.building_index[triangles].tolist()
+            current_triangle = int(triangles[-1])
+            triangles_walked += len(triangles)
+
+            for crossing_id, interpolated_point in enumerate(crossing_points.tolist()):
+                # the material and building_id of this and the next triangle
+                current_material = triangle_materials[crossing_id]
+                current_building_id = triangle_building_ids[crossing_id]
+                next_material = triangle_materials[crossing_id + 1]
+                next_building_id = triangle_building_ids[crossing_id + 1]
 
                 # Check if the new calculated point is not too close to the previously added point, in MH distance
-                
-                if np.sum(abs(np.array(cross_section_vertices[-1]) - interpolated_point)) <= 0.1:
+                last_vertex = cross_section_vertices[-1]
+                if (abs(last_vertex[0] - interpolated_point[0]) + abs(last_vertex[1] - interpolated_point[1]) +
+                        abs(last_vertex[2] - interpolated_point[2])) <= 0.1:
                     #print("points are too close, material: {} -> {}".format(current_material, next_material))
                     if current_material == next_material:
                         continue
@@ -147,7 +170,7 @@ class CrossSection:
                     # We are not in building, but are going up
                     if not in_building:
                         # Get height of building
-                        next_height_building = building_manager.buildings[next_building_id].roof_level
+                        next_height_building = ground_tin.building_roof_levels[next_building_id]
 
                         # if the next building is higher than the interpolated point (dtm level), we need to add the rising edge
                         if next_height_building > interpolated_point[2]:
@@ -161,14 +184,14 @@ class CrossSection:
 
                         else:
                             print("Roof height in building dataset is lower than ground height in TIN, for building ",
-                                  next_building_id)
+                                  ground_tin.building_names[next_building_id])
 
                     else:
                         if(current_building_id == -1):
                             # TODO maybe remove this part?
-                            print("segemt: {} tr: {} next attrib: {} inbuilding?: {} last point: {}".format(destination_id, current_triangle, next_building_id, in_building, cross_section_vertices[-1]))
+                            print("segemt: {} tr: {} next attrib: {} inbuilding?: {} last point: {}".format(destination_id, triangles[crossing_id + 1], next_building_id, in_building, cross_section_vertices[-1]))
                         
-                        current_height_building = building_manager.buildings[current_building_id].roof_level
+                        current_height_building = ground_tin.building_roof_levels[current_building_id]
 
                         '''# Check if building is underground, go down from building
                         if next_building_id != -1 and building_manager.buildings[next_building_id].underground:
@@ -194,7 +217,7 @@ class CrossSection:
                         # We will stay in Building, check if building is higher than the ground (negative buildings considered)
                         if current_height_building > interpolated_point[2] and next_building_id != -1:
 
-                            next_height_building = building_manager.buildings[next_building_id].roof_level
+                            next_height_building = ground_tin.building_roof_levels[next_building_id]
 
                             # no collinear vertical points, so we are going from one building to another building with a different height
                             if current_material != next_material or abs(current_height_building - next_height_building) > 0.1:
@@ -209,7 +232,9 @@ class CrossSection:
                         # Will go down from building again
                         elif current_height_building > interpolated_point[2] and next_building_id == -1:
                             # Check if the ray only crosses the corner of the building, then ignore
-                            if np.sum(abs(cross_section_vertices[-2][0] - interpolated_point)) <= 0.1:
+                            corner_x = cross_section_vertices[-2][0]
+                            if (abs(corner_x - interpolated_point[0]) + abs(corner_x - interpolated_point[1]) +
+                                    abs(corner_x - interpolated_point[2])) <= 0.1:
                                 cross_section_vertices = cross_section_vertices[:-2]
                                 material = material[:-2]
 
@@ -227,11 +252,11 @@ class CrossSection:
 
                         else:
                             print("Roof height in building dataset is lower than ground height in TIN, for building ",
-                                  next_building_id)
+                                  ground_tin.building_names[next_building_id])
 
                 
             # When destination has been reached, check if that is the source.
-            if(destination_id != len(self.points_to_source)-1):
+            if(destination_id != len(points_to_source)-1):
                 # set the reflection point to the origin
                 origin = destination
                 # get the height of the tin at the reflection point
@@ -239,7 +264,7 @@ class CrossSection:
                 reflection_ground_material, building_id = self.get_material(ground_tin, building_manager, ground_type_manager, current_triangle)
 
                 if(building_id != -1):
-                    reflection_height_ground = building_manager.buildings[next_building_id].roof_level
+                    reflection_height_ground = ground_tin.building_roof_levels[building_id]
                 else:
                     reflection_height_ground = ground_tin.interpolate_triangle(current_triangle, destination)
 
@@ -259,16 +284,17 @@ class CrossSection:
         #
         # Invert the path to go from source to receiver (materials are taken care of.)
         cross_section_vertices.reverse()
-        source_length = self.source.left_length + self.source.right_length
+        self.vertices = np.array(cross_section_vertices, dtype=np.float64)
+        self.material_codes = np.array(material, dtype=np.uint8)
+
         # add source and receiver points. source is always 0.05 meter above terrain, receiver always at 2 meters.
-        extension[0] = ["source", source_height, source_length]
-        extension[len(cross_section_vertices) - 1] = ["receiver", receiver_height]
+        self.source_height = source_height
+        self.source_length = source_length
+        self.receiver_height = receiver_height
 
         # Add the reflection (path is inversed, so also the location of the extension needs to be inversed.)
         if(reflection_point_id_inversed != 0):
-            reflection_vertex = len(cross_section_vertices) - 1 - reflection_point_id_inversed
-            extension[reflection_vertex] = ["wall", self.reflection_heights[0] - cross_section_vertices[reflection_vertex][2], "A0"]
+            self.wall_index = len(cross_section_vertices) - 1 - reflection_point_id_inversed
+            self.wall_height = reflection_heights[0] - cross_section_vertices[self.wall_index][2]
 
-        self.vertices = cross_section_vertices
-        self.materials = material
-        self.extension = extension
+        return triangles_walked
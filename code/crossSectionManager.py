@@ -1,77 +1,99 @@
-import bisect
 import numpy as np
 
 from crossSection import CrossSection
-from misc import interpolate_edge, reverse_bisect_left
+from crossSectionView import CrossSectionView
+from walkEngine import walk_fan
 
 class CrossSectionManager:
 
-    def __init__(self, source_default_height, receiver_default_height):
+    def __init__(self, source_default_height, receiver_default_height, metrics=None):
         self.cross_sections = {}
-        self.receiver_triangles = {}
+        # counts the cross sections and the triangles walked, optional
+        self.metrics = metrics
 
         self.source_default_height = source_default_height
         self.receiver_default_height = receiver_default_height
     
-    def get_cross_section(self, receiver_coords, source, path, tin, ground_type_manager, building_manager, source_height, receiver_height, reflection_heights=0):
-        #Find the triangle of the tin in which the receiver is located.
-        if receiver_coords in self.receiver_triangles.keys():
-            receiver_triangle = self.receiver_triangles[receiver_coords]
-        else:
-            init_tr = tin.find_vts_near_pt(receiver_coords)
-            receiver_triangle = tin.find_receiver_triangle(init_tr, receiver_coords)
-            # Make sure the receiver triangle is not in a building, this is not valid. if so, exclude it
-            if(tin.attributes[receiver_triangle][0] == 'b'):
-                return 
-            self.receiver_triangles[receiver_coords] = receiver_triangle
-
-        cross_section = CrossSection(path, receiver_coords, source, reflection_heights)
+    def get_cross_section(self, receiver, source_length, path, tin, ground_type_manager, building_manager, source_height, receiver_height, reflection_heights=0, walk=None):
+        # The receiver is already located in the tin, by ReceiverManager.locate_receivers
+        receiver_coords = receiver.receiver_coords
+
+        cross_section = CrossSection()
         #Create the cross section from the receiver to the source point        
-        cross_section.get_cross_section(receiver_triangle, tin, ground_type_manager, building_manager, source_height, receiver_height)
+        triangles_walked = cross_section.get_cross_section(receiver.triangle, tin, ground_type_manager, building_manager, source_height, receiver_height,
+                                        path, receiver_coords, source_length, reflection_heights, receiver.ground_height, walk)
 
         if receiver_coords not in self.cross_sections.keys():
             self.cross_sections[receiver_coords] = []
         
         self.cross_sections[receiver_coords].append(cross_section)
+
+        if self.metrics is not None:
+            self.metrics.count("triangles_walked", triangles_walked)
         
         return cross_section
     
-    def get_intermediate_cross_section_collinear_source(self, source_point, cross_section, source_height, receiver_height, receiver):
-
-        # find where the intermediate sources lie in the 'complete' cross-section
-
-        source_coords = source_point.source_coords
-
-        # check if the cross section is going in the positive or negative direction
-        if cross_section.vertices[-1][0] - cross_section.vertices[0][0] < 0:
-            split_idx = reverse_bisect_left(cross_section.vertices, source_coords)
-
-        # if the path is parallel with the x axis, check if the y axis is in negative direction.
-        elif cross_section.vertices[-1][0] - cross_section.vertices[0][0] == 0 and cross_section.vertices[-1][1] - cross_section.vertices[0][1] < 0:
-            split_idx = reverse_bisect_left(cross_section.vertices, source_coords)
+    def get_intermediate_cross_sections_collinear_sources(self, source_coords, source_lengths, cross_section, source_height, receiver_height, receiver):
+        """
+        Explanation: Creates the cross sections of the intermediate sources of a ray, as views on the cross section to the furthest source.
+        Where the sources lie on the cross section is found for all of them at once, from the planar distance to its first vertex.
+        The ground height of a source is interpolated on the cross section, so a source on a building gets the roof level of the path.
+        ---------------
+        Input:
+            source_coords : np.ndarray (k, 2) - the intermediate sources of the ray, between the receiver and the furthest source
+            source_lengths : np.ndarray (k,) - the length of road every intermediate source stands for
+            cross_section : CrossSection - the cross section from the furthest source to the receiver
+            source_height : float - height above ground for the source
+            receiver_height : float - height above ground for the receiver
+            receiver : (x,y) - the receiver
+        ---------------
+        Output:
+            void (adds a CrossSectionView per source to self.cross_sections[receiver])
+        """
+        vertices = cross_section.vertices
+
+        # the vertices are on a line from the furthest source, so their distance to it does not decrease along the path
+        vertex_distances = np.hypot(vertices[:, 0] - vertices[0, 0], vertices[:, 1] - vertices[0, 1])
+        source_distances = np.hypot(source_coords[:, 0] - vertices[0, 0], source_coords[:, 1] - vertices[0, 1])
+        # the first vertex at or after each source
+        split_indices = np.clip(np.searchsorted(vertex_distances, source_distances, side="left"), 1, len(vertices) - 1)
+
+        # interpolate the ground height on the edge before the split, along x or y as misc.interpolate_edge
+        edge_0 = vertices[split_indices - 1]
+        edge_1 = vertices[split_indices]
+        delta_x = np.abs(edge_0[:, 0] - source_coords[:, 0])
+        delta_y = np.abs(edge_0[:, 1] - source_coords[:, 1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            w0 = np.where(delta_x > delta_y, delta_x / np.abs(edge_0[:, 0] - edge_1[:, 0]), delta_y / np.abs(edge_0[:, 1] - edge_1[:, 1]))
+        interpolated_heights = (1 - w0) * edge_0[:, 2] + w0 * edge_1[:, 2]
+
+        for (source_x, source_y), source_length, split_idx, source_ground_height in zip(source_coords.tolist(), source_lengths.tolist(),
+                                                                                      split_indices.tolist(), interpolated_heights.tolist()):
+            cross_section_collinear_point = CrossSectionView(cross_section, split_idx,
+                                                             (source_x, source_y, source_ground_height))
+            cross_section_collinear_point.source_height = source_height
+            cross_section_collinear_point.source_length = source_length
+            cross_section_collinear_point.receiver_height = receiver_height
+
+            # Key must already exist, so no need to check.
+            self.cross_sections[receiver].append(cross_section_collinear_point)
+
+    def walk_rays(self, receiver, tin):
+        """
+        Explanation: Walks the rays of a receiver through the tin, from the receiver triangle to the furthest source of every ray, as one fan.
+        ---------------
+        Input:
+            receiver : ReceiverPoint - the located receiver, with its source points per ray
+            tin : GroundTin object - stores the DTM in a triangle datastructure
+        ---------------
+        Output:
+            list - the walk of every ray with sources, in the order of receiver.sources, see walkEngine.walk_fan
+        """
+        if len(receiver.sources) == 0:
+            return []
+        destinations = receiver.sources.coords[receiver.sources.get_furthest_sources()]
+        return walk_fan(tin.vts, tin.trs, receiver.triangle, receiver.receiver_coords, destinations)
 
-        # the x direction is positive, or y is in positive direction
-        else:
-            split_idx = bisect.bisect_left(cross_section.vertices, source_coords)
-
-        part_path_direct = cross_section.vertices[split_idx:]
-        source_ground_height = interpolate_edge(cross_section.vertices[split_idx - 1], cross_section.vertices[split_idx], source_coords)
-        part_path_direct = [(source_coords[0], source_coords[1], source_ground_height)] + part_path_direct
-
-        cross_section_collinear_point = CrossSection([source_coords], receiver, source_point, 0)
-        cross_section_collinear_point.vertices = part_path_direct
-        source_length = source_point.left_length + source_point.right_length
-        cross_section_collinear_point.extension = {
-            0: ["source", source_height, source_length],
-            len(cross_section_collinear_point.vertices) - 1 : ["receiver", receiver_height]
-        }
-        part_path_direct_material = [cross_section.materials[split_idx]] + cross_section.materials[split_idx:]
-        cross_section_collinear_point.materials = part_path_direct_material
-        
-        # Key must already exist, so no need to check.
-        self.cross_sections[receiver].append(cross_section_collinear_point)
-        return
-    
     def get_cross_sections_direct(self, receiver_points, tin, ground_type_manager, building_manager, source_height, receiver_height):
         """
         Explanation: Finds cross sections for all propagation paths, both direct. and saves them in a dicitonary with cross_sections objects.
@@ -89,34 +111,32 @@ class CrossSectionManager:
             void (fills self.cross_section_manager for each receiver with a list of paths)
         """
 
-        #
+        # the receivers are located, and the receivers in buildings removed, by ReceiverManager.locate_receivers
         for receiver_coords, receiver in receiver_points.items():  
-            #print(i, receiver.receiver_coords)
+            sources = receiver.sources
+
+            # walk all rays of the receiver to their furthest source together, the rays share the triangles near the receiver
+            walks = self.walk_rays(receiver, tin)
+
             #For each ray, grab all the source points between the receiver and the ray_end
-            for ray_end, source_points in receiver.source_points.items():
+            for walk, first_source_id, furthest_source_id in zip(walks, sources.ray_start[:-1].tolist(), sources.get_furthest_sources().tolist()):
                 #Create cross section for the furthest away point
-                furthest_source_point = source_points[-1]
+                furthest_source_coords = tuple(sources.coords[furthest_source_id].tolist())
 
-                # find the receiver triangle. If this triangle is in a building, than it is not valid and should not be included.
-                # This is done here, since there is no need for the collinear paths to be checked in this case. 
-                init_tr = tin.find_vts_near_pt(receiver_coords)
-                receiver_triangle = tin.find_receiver_triangle(init_tr, receiver_coords)
-                if(tin.attributes[receiver_triangle][0] == 'b'):
-                    continue
-                self.receiver_triangles[receiver_coords] = receiver_triangle
-                cross_section = self.get_cross_section(receiver_coords, furthest_source_point, [furthest_source_point.source_coords], tin, ground_type_manager, building_manager, source_height, receiver_height)
+                cross_section = self.get_cross_section(receiver, float(sources.lengths[furthest_source_id]), [furthest_source_coords], tin, ground_type_manager, building_manager, source_height, receiver_height, walk=walk)
 
                 # create cross sections for intermediate source points, if available
-                for source_point in source_points[:-1]:
-                    self.get_intermediate_cross_section_collinear_source(
-                        source_point, 
-                        cross_section, 
-                        source_height, 
-                        receiver_height, 
+                if furthest_source_id > first_source_id:
+                    self.get_intermediate_cross_sections_collinear_sources(
+                        sources.coords[first_source_id:furthest_source_id],
+                        sources.lengths[first_source_id:furthest_source_id],
+                        cross_section,
+                        source_height,
+                        receiver_height,
                         receiver_coords
                         )
 
-    def get_cross_sections_reflection(self, reflection_path, tin, ground_type_manager, building_manager, source_height, receiver_height):
+    def get_cross_sections_reflection(self, reflection_path, receiver, source_id, tin, ground_type_manager, building_manager, source_height, receiver_height):
 
         # can work with single and multi order reflection.
         # for each reflection
@@ -124,16 +144,17 @@ class CrossSectionManager:
             #take the heights
             reflection_heights = reflection_path.reflection_heights[i]
             path = reflection_points_list
-            path.append(reflection_path.source.source_coords)
+            path.append(reflection_path.source_coords)
 
-            self.get_cross_section(reflection_path.receiver, reflection_path.source, path, tin, ground_type_manager, building_manager, source_height, receiver_height, reflection_heights)
+            self.get_cross_section(receiver, float(receiver.sources.lengths[source_id]), path, tin, ground_type_manager, building_manager, source_height, receiver_height, reflection_heights)
     
-    def write_obj(self, output_path, individual_bool): 
+    def write_obj(self, output_path, individual_bool, file_name="cross_sections.obj"): 
         """
         Explanation: Write the paths of this receiver to an obj file, calls write_cross_section_to_obj
         ---------------
         Input:
             individual_bool : boolean - defines whether the paths shoudl be written per receiver, or all combined.
+            file_name : string - the name of the file with all paths combined
         ---------------
         Output:
             void (writes obj file)
@@ -152,7 +173,7 @@ class CrossSectionManager:
             for receiver, cross_sections in self.cross_sections.items():
                 total_paths.append(cross_sections)
 
-            cross_section_file_path = output_path + "/cross_sections.obj"
+            cross_section_file_path = output_path + "/" + file_name
             with open(cross_section_file_path, 'w') as f_out:
                 base = 0
                 vts_count_lst = [0]
@@ -161,22 +182,16 @@ class CrossSectionManager:
                     #write the vertices
                     for cross_section in cross_section_paths:
                         path = cross_section.vertices
-                        path = np.array(path)
                         counter = counter + len(path)
                         vts_count_lst.append(counter)
-                        for v in path:
-                            f_out.write("v {:.2f} {:.2f} {:.2f}\n".format(v[0], v[1], v[2]))
+                        f_out.write("".join("v {:.2f} {:.2f} {:.2f}\n".format(*v) for v in path.tolist()))
                 #print(vts_count_lst)
                 # write the lines:
                 j = 0
                 for cross_section_paths in total_paths:
                     for i, cross_section in enumerate(cross_section_paths):
-                        path = cross_section.vertices
                         base = vts_count_lst[j]
-                        f_out.write("l")
-                        for i in range(len(path)):
-                            f_out.write(" " + str(base + i + 1))
-                        f_out.write("\n")
+                        f_out.write("l" + "".join(" " + str(base + i + 1) for i in range(len(cross_section.vertices))) + "\n")
                         j += 1
 
     def write_cross_section_to_obj(self, filename, cross_sections):
@@ -188,17 +203,11 @@ class CrossSectionManager:
             counter = 0
             for cross_section in cross_sections:
                 path = cross_section.vertices
-                path = np.array(path)
                 counter = counter + len(path)
                 vts_count_lst.append(counter)
-                for v in path:
-                    f_out.write("v {:.2f} {:.2f} {:.2f}\n".format(v[0], v[1], v[2]))
+                f_out.write("".join("v {:.2f} {:.2f} {:.2f}\n".format(*v) for v in path.tolist()))
             
             #print(vts_count_lst)
             for i, cross_section in enumerate(cross_sections):
-                path = cross_section.vertices
                 base = vts_count_lst[i]
-                f_out.write("l")
-                for i in range(len(path)):
-                    f_out.write(" " + str(base + i + 1))
-                f_out.write("\n")
\ No newline at end of file
+                f_out.write("l" + "".join(" " + str(base + i + 1) for i in range(len(cross_section.vertices))) + "\n")
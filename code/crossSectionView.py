@@ -0,0 +1,59 @@
+import numpy as np
+
+from crossSection import CrossSection
+
+class CrossSectionView(CrossSection):
+
+    # a view stores a reference to the cross section of the ray and where it starts on it, not a copy of its arrays
+    __slots__ = ("parent", "offset", "source_vertex")
+
+    def __init__(self, parent, offset, source_vertex):
+        # the path is the source vertex followed by the vertices of the parent from offset on, the source gets the material of vertex offset
+        self.parent = parent
+        self.offset = offset
+        self.source_vertex = source_vertex
+
+        # the extension record, see CrossSection
+        self.source_height = 0.0
+        self.source_length = 0.0
+        self.receiver_height = 0.0
+        self.wall_index = -1
+        self.wall_height = 0.0
+
+    def __reduce__(self):
+        """
+        Explanation: Pickles the view as its parent, offset and source vertex with its extension record, for the worker processes.
+        The vertices and material codes are properties, so they can not be restored like the slots of a CrossSection.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            tuple - the class, its arguments and the extension record
+        """
+        return (CrossSectionView, (self.parent, self.offset, self.source_vertex),
+                (None, {"source_height": self.source_height, "source_length": self.source_length, "receiver_height": self.receiver_height,
+                        "wall_index": self.wall_index, "wall_height": self.wall_height}))
+
+    @property
+    def vertices(self):
+        """
+        Explanation: Returns the vertices of the path, they are made from the parent on every call
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            np.ndarray (n, 3) - the source vertex followed by the vertices of the parent from offset on
+        """
+        return np.concatenate(([self.source_vertex], self.parent.vertices[self.offset:]))
+
+    @property
+    def material_codes(self):
+        """
+        Explanation: Returns the material code per vertex, they are made from the parent on every call
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            np.ndarray (n,) - the material codes of the parent from offset on, with the code of vertex offset repeated for the source
+        """
+        return np.concatenate((self.parent.material_codes[self.offset:self.offset + 1], self.parent.material_codes[self.offset:]))
@@ -0,0 +1,355 @@
+import hashlib
+import json
+import numpy as np
+import os
+
+from receiverPoint import CNOSSOS_ANGLE, CNOSSOS_RADIUS
+from tiledTin import TILE_CHUNK_SIZE, TILE_WINDOW_MARGIN
+
+# the inputs are hashed per square tile of this size (in meters), on a grid that starts at (0, 0) so it does not move when the inputs grow
+DEPENDENCY_TILE_SIZE = 250.0
+# a tile (column, row) is stored as one integer, (column + offset) * 2 ** 31 + (row + offset)
+TILE_KEY_OFFSET = 2 ** 30
+TILE_KEY_BASE = 2 ** 31
+# the layers of the inputs that the paths of a receiver depend on
+DEPENDENCY_LAYERS = ("roads", "buildings", "tin")
+
+class DependencyManager:
+
+    def __init__(self, settings, reach=CNOSSOS_RADIUS + TILE_WINDOW_MARGIN, tile_size=DEPENDENCY_TILE_SIZE):
+        """
+        Keeps what the paths of the receivers depend on, for the incremental mode of main.
+        Every input layer (roads, buildings, tin) is hashed per tile, the paths of a receiver depend on all tiles within reach of it.
+        A receiver only has to be computed again when one of these tiles changed, or when the settings of the run changed.
+        """
+        self.reach = float(reach)
+        self.tile_size = float(tile_size)
+        # the settings that change the paths (heights, thresholds, noise levels), as a json string
+        self.settings = json.dumps(dict(settings, radius=CNOSSOS_RADIUS, step_angle=CNOSSOS_ANGLE, reach=self.reach, tile_size=self.tile_size), sort_keys=True)
+
+        # per layer the sorted keys of the tiles with content and the hash of each tile
+        self.tile_hashes = {}
+        # the record of every receiver: its xml number (-1 without paths), its number of paths and the range of tiles it depends on
+        self.receivers = {}
+
+    def hash_roads(self, segments):
+        """
+        Explanation: Hashes the road segments per tile, a segment is part of every tile its bounding box overlaps
+        ---------------
+        Input:
+            segments : np.ndarray (m, 2, 2) - the road segments
+        ---------------
+        Output:
+            void (sets the tile hashes of the roads)
+        """
+        segments = np.ascontiguousarray(segments, dtype=np.float64).reshape(-1, 2, 2)
+        row_hashes = hash_rows(segments.reshape(-1, 4).view(np.uint64))
+        row_ids, keys = self.get_tile_entries(segments.min(axis=1), segments.max(axis=1))
+        self.tile_hashes["roads"] = sum_per_tile(keys, row_hashes[row_ids])
+
+    def hash_buildings(self, building_manager):
+        """
+        Explanation: Hashes the buildings per tile, with their id, heights and walls. A building is part of every tile its bounding box overlaps
+        ---------------
+        Input:
+            building_manager : BuildingManager - the buildings
+        ---------------
+        Output:
+            void (sets the tile hashes of the buildings)
+        """
+        buildings = list(building_manager.buildings.values())
+        row_hashes = np.empty(len(buildings), dtype=np.uint64)
+        bounding_boxes = np.empty((len(buildings), 4))
+        for i, building in enumerate(buildings):
+            content = repr((building.id, building.bag_id, building.ground_level, building.roof_level, building.walls))
+            row_hashes[i] = get_text_hash(content)
+            bounding_boxes[i] = building.shape.bounds
+
+        row_ids, keys = self.get_tile_entries(bounding_boxes[:, :2], bounding_boxes[:, 2:])
+        self.tile_hashes["buildings"] = sum_per_tile(keys, row_hashes[row_ids])
+
+    def hash_tin(self, vts, trs, attribute_codes, attribute_names):
+        """
+        Explanation: Hashes the triangles of the tin per tile, with the coordinates of their vertices and their attribute.
+        Only the geometry is used and not the vertex or triangle ids, so the hashes do not change when the tin is stored in another order
+        (like the tiled tin). The triangles are hashed in chunks, so a memory mapped tin is not read at once.
+        ---------------
+        Input:
+            vts : np.ndarray (n, 3) - the vertices
+            trs : np.ndarray (m, 6) - the triangles
+            attribute_codes : np.ndarray (m,) - the attribute of every triangle as index in attribute_names, None without attributes
+            attribute_names : np.ndarray (k,) - the attributes
+        ---------------
+        Output:
+            void (sets the tile hashes of the tin)
+        """
+        name_hashes = np.array([get_text_hash(name) for name in attribute_names], dtype=np.uint64) if attribute_codes is not None else None
+
+        chunk_keys = []
+        chunk_hashes = []
+        for start in range(0, len(trs), TILE_CHUNK_SIZE):
+            end = min(start + TILE_CHUNK_SIZE, len(trs))
+            corners = np.asarray(vts)[np.asarray(trs[start:end, :3])]
+
+            # start every triangle at its lowest corner (by x, then y), keeping the orientation
+            first = np.lexsort((corners[:, :, 1], corners[:, :, 0]))[:, 0]
+            rotation = (first[:, None] + np.arange(3)) % 3
+            corners = np.take_along_axis(corners, rotation[:, :, None], axis=1)
+
+            words = np.empty((end - start, 10), dtype=np.uint64)
+            words[:, :9] = np.ascontiguousarray(corners.reshape(-1, 9)).view(np.uint64)
+            words[:, 9] = name_hashes[np.asarray(attribute_codes[start:end])] if name_hashes is not None else 0
+            row_hashes = hash_rows(words)
+
+            row_ids, keys = self.get_tile_entries(corners[:, :, :2].min(axis=1), corners[:, :, :2].max(axis=1))
+            keys, hashes = sum_per_tile(keys, row_hashes[row_ids])
+            chunk_keys.append(keys)
+            chunk_hashes.append(hashes)
+
+        if len(chunk_keys) == 0:
+            self.tile_hashes["tin"] = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64))
+            return
+        self.tile_hashes["tin"] = sum_per_tile(np.concatenate(chunk_keys), np.concatenate(chunk_hashes))
+
+    def get_tile_entries(self, bounding_box_min, bounding_box_max):
+        """
+        Explanation: Expands rows with a bounding box to one entry per tile the bounding box overlaps
+        ---------------
+        Input:
+            bounding_box_min : np.ndarray (n, 2) - the minimum x and y of every row
+            bounding_box_max : np.ndarray (n, 2) - the maximum x and y of every row
+        ---------------
+        Output:
+            np.ndarray - the row of every entry
+            np.ndarray - the tile key of every entry
+        """
+        tile_min = np.floor(np.asarray(bounding_box_min) / self.tile_size).astype(np.int64).reshape(-1, 2)
+        tile_max = np.floor(np.asarray(bounding_box_max) / self.tile_size).astype(np.int64).reshape(-1, 2)
+        n_x = tile_max[:, 0] - tile_min[:, 0] + 1
+        counts = n_x * (tile_max[:, 1] - tile_min[:, 1] + 1)
+
+        row_ids = np.repeat(np.arange(len(counts)), counts)
+        entry = np.arange(len(row_ids)) - (np.cumsum(counts) - counts)[row_ids]
+        columns = tile_min[row_ids, 0] + entry % n_x[row_ids]
+        rows = tile_min[row_ids, 1] + entry // n_x[row_ids]
+        return row_ids, (columns + TILE_KEY_OFFSET) * TILE_KEY_BASE + (rows + TILE_KEY_OFFSET)
+
+    def get_receiver_tiles(self, receivers_coords):
+        """
+        Explanation: Get the range of tiles that the paths of receivers can depend on, all tiles within reach of the receiver
+        ---------------
+        Input:
+            receivers_coords : list of (x, y) - the receivers
+        ---------------
+        Output:
+            np.ndarray (n, 4) - the first column, first row, last column and last row of the tiles of every receiver
+        """
+        xy = np.asarray(receivers_coords, dtype=np.float64).reshape(-1, 2)
+        return np.concatenate((np.floor((xy - self.reach) / self.tile_size), np.floor((xy + self.reach) / self.tile_size)), axis=1).astype(np.int64)
+
+    def get_changed_tiles(self, previous):
+        """
+        Explanation: Compares the tile hashes with those of a previous run, a tile changed if its hash differs in any layer
+        (a tile that only has content in one of both runs changed as well)
+        ---------------
+        Input:
+            previous : DependencyManager - the dependencies of the previous run
+        ---------------
+        Output:
+            np.ndarray - the keys of the tiles that changed
+        """
+        changed = []
+        for layer in DEPENDENCY_LAYERS:
+            keys, hashes = self.tile_hashes[layer]
+            previous_keys, previous_hashes = previous.tile_hashes[layer]
+            all_keys = np.union1d(keys, previous_keys)
+            changed.append(all_keys[(get_tile_values(keys, hashes, all_keys) != get_tile_values(previous_keys, previous_hashes, all_keys)).any(axis=1)])
+        return np.unique(np.concatenate(changed))
+
+    def get_changed_receivers(self, previous, receivers_coords):
+        """
+        Explanation: Finds the receivers that have to be computed again. These are the receivers that were not computed
+        in the previous run, and the receivers that depend on a tile that changed. All receivers change if there is no previous run
+        or if the settings changed.
+        ---------------
+        Input:
+            previous : DependencyManager - the dependencies of the previous run, None if there is none
+            receivers_coords : list of (x, y) - the receivers of this run
+        ---------------
+        Output:
+            np.ndarray (n,) of booleans - True for the receivers to compute
+        """
+        if previous is None or previous.settings != self.settings:
+            return np.ones(len(receivers_coords), dtype=bool)
+
+        changed = np.array([receiver_coords not in previous.receivers for receiver_coords in receivers_coords], dtype=bool)
+        changed_tiles = self.get_changed_tiles(previous)
+        if len(changed_tiles) == 0 or changed.all():
+            return changed
+
+        # the tiles every receiver depended on in the previous run
+        known = np.nonzero(~changed)[0]
+        receiver_tiles = np.array([previous.receivers[receivers_coords[i]][2] for i in known.tolist()], dtype=np.int64).reshape(-1, 4)
+
+        # count the changed tiles in the range of every receiver with a summed area table of the changed tiles
+        columns = changed_tiles // TILE_KEY_BASE - TILE_KEY_OFFSET
+        rows = changed_tiles % TILE_KEY_BASE - TILE_KEY_OFFSET
+        origin = np.array([columns.min(), rows.min()])
+        shape = np.array([columns.max(), rows.max()]) - origin + 1
+        table = np.zeros((shape[1] + 1, shape[0] + 1), dtype=np.int64)
+        table[rows - origin[1] + 1, columns - origin[0] + 1] = 1
+        table = table.cumsum(axis=0).cumsum(axis=1)
+
+        first = np.clip(receiver_tiles[:, :2] - origin, 0, shape)
+        last = np.clip(receiver_tiles[:, 2:] - origin + 1, 0, shape)
+        counts = table[last[:, 1], last[:, 0]] - table[first[:, 1], last[:, 0]] - table[last[:, 1], first[:, 0]] + table[first[:, 1], first[:, 0]]
+        changed[known] = counts > 0
+        return changed
+
+    def add_receivers(self, receivers_coords, numbers, path_counts, receiver_tiles=None):
+        """
+        Explanation: Adds the records of receivers
+        ---------------
+        Input:
+            receivers_coords : list of (x, y) - the receivers
+            numbers : list - the number of the xml files of every receiver, -1 for a receiver without paths
+            path_counts : list - the number of paths (xml files) of every receiver
+            receiver_tiles : np.ndarray (n, 4) - the range of tiles every receiver depends on, they are computed if not given
+        ---------------
+        Output:
+            void (fills self.receivers)
+        """
+        if receiver_tiles is None:
+            receiver_tiles = self.get_receiver_tiles(receivers_coords)
+        for receiver_coords, number, path_count, tiles in zip(receivers_coords, numbers, path_counts, np.asarray(receiver_tiles).tolist()):
+            self.receivers[receiver_coords] = (number, path_count, tiles)
+
+    def write_state(self, file_path):
+        """
+        Explanation: Writes the settings, the tile hashes and the receiver records, for the next incremental run.
+        The file is written next to the old one first and then replaced, so a run that stops half way keeps the old file.
+        ---------------
+        Input:
+            file_path : string - the path of the npz file
+        ---------------
+        Output:
+            void (writes the npz file)
+        """
+        records = list(self.receivers.items())
+        arrays = {
+            "settings": np.array(self.settings),
+            "receiver_coords": np.array([receiver_coords for receiver_coords, record in records], dtype=np.float64).reshape(-1, 2),
+            "receiver_numbers": np.array([record[0] for receiver_coords, record in records], dtype=np.int64),
+            "receiver_paths": np.array([record[1] for receiver_coords, record in records], dtype=np.int64),
+            "receiver_tiles": np.array([record[2] for receiver_coords, record in records], dtype=np.int64).reshape(-1, 4)
+        }
+        for layer in DEPENDENCY_LAYERS:
+            arrays[layer + "_tiles"], arrays[layer + "_hashes"] = self.tile_hashes[layer]
+
+        with open(file_path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(file_path + ".tmp", file_path)
+
+def read_dependencies(file_path):
+    """
+    Explanation: Reads the dependencies of a previous incremental run
+    ---------------
+    Input:
+        file_path : string - the path of the npz file
+    ---------------
+    Output:
+        DependencyManager - the dependencies of the previous run, None if the file does not exist
+    """
+    if not os.path.isfile(file_path):
+        return None
+
+    with np.load(file_path) as state:
+        dependency_manager = DependencyManager({})
+        dependency_manager.settings = str(state["settings"])
+        for layer in DEPENDENCY_LAYERS:
+            dependency_manager.tile_hashes[layer] = (state[layer + "_tiles"], state[layer + "_hashes"])
+        receivers_coords = [tuple(receiver_coords) for receiver_coords in state["receiver_coords"].tolist()]
+        dependency_manager.add_receivers(receivers_coords, state["receiver_numbers"].tolist(), state["receiver_paths"].tolist(), state["receiver_tiles"])
+    return dependency_manager
+
+def get_text_hash(text):
+    """
+    Explanation: A 64 bit hash of a text, the same in every run (unlike the hash() of python)
+    ---------------
+    Input:
+        text : string - the text
+    ---------------
+    Output:
+        integer - the hash
+    """
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+def mix_hashes(z):
+    """
+    Explanation: The splitmix64 finalizer, it spreads every bit of a 64 bit integer over all bits, for arrays
+    ---------------
+    Input:
+        z : np.ndarray of np.uint64 - the values
+    ---------------
+    Output:
+        np.ndarray of np.uint64 - the mixed values
+    """
+    z = z + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+def hash_rows(words):
+    """
+    Explanation: A 64 bit hash of every row of an array of 64 bit words, for example the bits of the coordinates of a row
+    ---------------
+    Input:
+        words : np.ndarray (n, k) of np.uint64 - the rows
+    ---------------
+    Output:
+        np.ndarray (n,) of np.uint64 - the hash of every row
+    """
+    row_hashes = np.zeros(len(words), dtype=np.uint64)
+    for column in range(words.shape[1]):
+        row_hashes = mix_hashes(row_hashes ^ words[:, column])
+    return row_hashes
+
+def sum_per_tile(keys, hashes):
+    """
+    Explanation: Combines the hashes of all entries of a tile into the hash of the tile, by adding them (modulo 2 ** 64).
+    The sum does not depend on the order of the entries, so it can also combine the sums of chunks.
+    ---------------
+    Input:
+        keys : np.ndarray (n,) - the tile key of every entry
+        hashes : np.ndarray (n,) of np.uint64 - the hash of every entry
+    ---------------
+    Output:
+        np.ndarray - the sorted keys of the tiles
+        np.ndarray of np.uint64 - the hash of every tile
+    """
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+    order = np.argsort(keys, kind="stable")
+    tile_keys, starts = np.unique(keys[order], return_index=True)
+    return tile_keys.astype(np.int64), np.add.reduceat(hashes[order], starts).astype(np.uint64)
+
+def get_tile_values(keys, values, query_keys):
+    """
+    Explanation: Looks up the values of tiles, tiles that are not in keys get 0 and an extra flag
+    ---------------
+    Input:
+        keys : np.ndarray - the sorted keys of the tiles with a value
+        values : np.ndarray of np.uint64 - the value of every tile
+        query_keys : np.ndarray - the keys to look up
+    ---------------
+    Output:
+        np.ndarray (n, 2) of np.uint64 - 1 and the value for the tiles in keys, 0 and 0 for the others
+    """
+    found = np.zeros((len(query_keys), 2), dtype=np.uint64)
+    if len(keys) == 0:
+        return found
+    position = np.minimum(np.searchsorted(keys, query_keys), len(keys) - 1)
+    present = keys[position] == query_keys
+    found[present, 0] = 1
+    found[present, 1] = values[position[present]]
+    return found
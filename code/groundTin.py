@@ -1,5 +1,6 @@
 import misc
 import numpy as np
+import os
 import sys
 import fiona
 
@@ -8,20 +9,303 @@ from shapely.geometry import shape, Polygon, LineString, Point
 from shapely.ops import transform
 from scipy.spatial import KDTree
 from time import time
+from triangleGrid import TriangleGrid
+
+# the objp text file is read in chunks of about this many bytes
+OBJP_CHUNK_BYTES = 16 * 1024 * 1024
+# a rough estimate of the number of bytes per objp record, to size the arrays before reading
+OBJP_BYTES_PER_RECORD = 64
+# the plane coefficients of the triangles are computed per chunk of this many triangles, when the chunk is first needed
+PLANE_CHUNK_SIZE = 65536
+
+BINARY_TIN_EXTENSION = ".tinb"
+BINARY_TIN_MAGIC = b"TINB"
+BINARY_TIN_VERSION = 2
+BINARY_TIN_HEADER = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u4"),
+    ("n_vts", "<u8"),
+    ("n_trs", "<u8"),
+    ("n_attributes", "<u8"),
+    ("n_names", "<u8"),
+    ("name_width", "<u8"),
+    ("n_vertex_offsets", "<u8"),
+    ("n_vertex_triangles", "<u8"),
+    ("bounding_box_3d", "<f8", (6,))
+])
 
 
 class GroundTin:
 
-    def __init__(self, vts, trs, attr = []):
-        self.vts = np.array(vts)
-        self.trs = np.array(trs)
-        self.attributes = np.array(attr)
-        
-        self.kd_vts = KDTree(self.vts[:, [0, 1]])
+    def __init__(self, vts, trs, attr = [], attribute_codes=None, attribute_names=None, vertex_triangle_offsets=None,
+                 vertex_triangles=None):
+        # asarray keeps memory mapped arrays mapped instead of copying them into memory
+        self.vts = np.asarray(vts)
+        self.trs = np.asarray(trs)
+
+        # the semantics of the triangles, see set_attributes
+        self.attribute_names = None
+        self.attribute_codes = None
+        self.material_codes = None
+        self.building_index = None
+        self.building_names = None
+        self.building_name_to_index = {}
+        self.building_triangle_offsets = None
+        self.building_triangles = None
+        self.building_roof_levels = None
+        self.roof_heights = None
+        if attribute_codes is None:
+            attribute_names, attribute_codes = np.unique(np.asarray(attr, dtype=str), return_inverse=True)
+        self.set_attributes(attribute_codes, attribute_names)
+
+        # the kd tree is only built when it is first needed, so loading a tin stays cheap
+        self.kd_vts = None
+
+        # CSR index of the triangles incident to each vertex, a binary tin file has it stored
+        self.vertex_triangle_offsets = vertex_triangle_offsets
+        self.vertex_triangles = vertex_triangles
+        if self.vertex_triangle_offsets is None or self.vertex_triangles is None:
+            self.create_vertex_triangle_index()
+
+        # optional uniform grid of triangles, see create_grid_index
+        self.grid = None
+
+        # plane z = a * (x - x0) + b * (y - y0) + c of every triangle, relative to plane_origin (x0, y0) for precision.
+        # the planes are only computed for the chunks of triangles that are used, see get_plane_chunk
+        self.plane_origin = None
+        self.plane_chunks = {}
 
         self.bounding_box_2d = [100000000, 100000000, -100000000, -100000000]
         self.bounding_box_3d = [100000000, 100000000, 100000000, -100000000, -100000000, -100000000]
 
+    def set_attributes(self, attribute_codes, attribute_names):
+        """
+        Explination: Set the attributes of the triangles and build the integer semantics from them.
+        Attributes are 'b<part_id>' for buildings and 'g<bodemfactor>' for ground, every triangle gets
+        a material code (misc.MATERIAL_NAMES), a building index (-1 for ground) and a roof height (nan for ground).
+        The roof heights are only known after set_roof_heights is called.
+        ---------------
+        Input:
+            attribute_codes : np.ndarray (n,) - For each triangle the index of its attribute in attribute_names.
+            attribute_names : np.ndarray (k,) of strings - The unique attributes.
+        ---------------
+        Output: void (sets the semantic arrays of the tin)
+        """
+        # a tin without attributes is all hard ground
+        if len(attribute_codes) == 0:
+            attribute_codes = np.zeros(len(self.trs), dtype=np.int32)
+            attribute_names = np.array(['g0'])
+        self.attribute_codes = np.asarray(attribute_codes)
+        self.attribute_names = np.asarray(attribute_names, dtype=str)
+
+        # the semantics per unique attribute
+        is_building = np.char.startswith(self.attribute_names, 'b')
+        is_hard_ground = np.char.startswith(self.attribute_names, 'g0')
+        name_materials = np.where(is_building, misc.MATERIAL_A0, np.where(is_hard_ground, misc.MATERIAL_G, misc.MATERIAL_C))
+        name_buildings = np.full(len(self.attribute_names), -1, dtype=np.int32)
+        name_buildings[is_building] = np.arange(np.count_nonzero(is_building))
+
+        self.building_names = self.attribute_names[is_building]
+        self.building_name_to_index = {building_name: i for i, building_name in enumerate(self.building_names)}
+
+        # the semantics per triangle
+        self.material_codes = name_materials.astype(np.uint8)[self.attribute_codes]
+        self.building_index = name_buildings[self.attribute_codes]
+
+        # CSR index of the triangles of each building
+        building_triangles = np.nonzero(self.building_index != -1)[0]
+        order = np.argsort(self.building_index[building_triangles], kind='stable')
+        self.building_triangles = building_triangles[order].astype(np.int32)
+        counts = np.bincount(self.building_index[building_triangles], minlength=len(self.building_names))
+        self.building_triangle_offsets = np.zeros(len(self.building_names) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.building_triangle_offsets[1:])
+
+        self.building_roof_levels = np.full(len(self.building_names), np.nan)
+        self.roof_heights = np.full(len(self.trs), np.nan)
+
+    def set_roof_heights(self, building_manager):
+        """
+        Explination: Take the roof levels of the buildings of the tin from the building manager.
+        Buildings of the tin that are not in the building manager keep a nan roof level.
+        ---------------
+        Input:
+            building_manager : BuildingManager - The manager that holds all the building information.
+        ---------------
+        Output: void (sets self.building_roof_levels and self.roof_heights)
+        """
+        for i, building_name in enumerate(self.building_names):
+            if building_name in building_manager.buildings:
+                self.building_roof_levels[i] = building_manager.buildings[building_name].roof_level
+        building_roof_levels = np.append(self.building_roof_levels, np.nan)
+        # building index -1 (ground) takes the appended nan
+        self.roof_heights = building_roof_levels[self.building_index]
+
+    def get_building_index(self, building_name):
+        """
+        Explination: Get the index of a building in the tin from its name ('b<part_id>').
+        ---------------
+        Input:
+            building_name : string - The building id as used in the building manager.
+        ---------------
+        Output:
+            integer - The building index, -1 if the building is not in the tin.
+        """
+        return self.building_name_to_index.get(building_name, -1)
+
+    def get_building_triangles(self, building):
+        """
+        Explination: Get the triangles of a building.
+        ---------------
+        Input:
+            building : integer - The building index.
+        ---------------
+        Output:
+            np.ndarray - The ids of the triangles of this building.
+        """
+        return self.building_triangles[self.building_triangle_offsets[building]:self.building_triangle_offsets[building + 1]]
+
+    def create_vertex_triangle_index(self):
+        """
+        Explination: Build a CSR style index from every vertex to the triangles that use it.
+        The triangles of vertex v are self.vertex_triangles[self.vertex_triangle_offsets[v]:self.vertex_triangle_offsets[v + 1]],
+        in increasing triangle id order.
+        ---------------
+        Input: void
+        ---------------
+        Output: void (sets self.vertex_triangle_offsets and self.vertex_triangles)
+        """
+        self.vertex_triangle_offsets, self.vertex_triangles = get_vertex_triangle_index(self.trs, len(self.vts))
+
+    def get_vertex_triangles(self, vertex):
+        """
+        Explination: Get the triangles incident to a vertex.
+        ---------------
+        Input:
+            vertex : integer - vertex ID.
+        ---------------
+        Output:
+            np.ndarray - The ids of the triangles that use this vertex.
+        """
+        return self.vertex_triangles[self.vertex_triangle_offsets[vertex]:self.vertex_triangle_offsets[vertex + 1]]
+
+    def get_plane_chunk(self, chunk):
+        """
+        Explination: Get the plane coefficients of a chunk of triangles, they are computed the first time the chunk is needed.
+        Chunk i holds the triangles i * PLANE_CHUNK_SIZE up to (i + 1) * PLANE_CHUNK_SIZE.
+        ---------------
+        Input:
+            chunk : integer - The chunk index.
+        ---------------
+        Output:
+            np.ndarray (n, 3) - a, b and c of every triangle in the chunk, nan for vertical or collapsed triangles.
+        """
+        planes = self.plane_chunks.get(chunk)
+        if planes is not None:
+            return planes
+
+        if self.plane_origin is None:
+            self.plane_origin = np.array(self.vts[:, :2].min(axis=0), dtype=np.float64) if len(self.vts) > 0 else np.zeros(2)
+
+        start = chunk * PLANE_CHUNK_SIZE
+        tr_vts = self.trs[start:start + PLANE_CHUNK_SIZE, :3]
+        v1 = np.array(self.vts[tr_vts[:, 0]], dtype=np.float64)
+        v2 = np.array(self.vts[tr_vts[:, 1]], dtype=np.float64)
+        v3 = np.array(self.vts[tr_vts[:, 2]], dtype=np.float64)
+        for v in (v1, v2, v3):
+            v[:, :2] -= self.plane_origin
+
+        normal = np.cross(v2 - v1, v3 - v1)
+        # vertical or collapsed triangles have no plane, they get nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a = -normal[:, 0] / normal[:, 2]
+            b = -normal[:, 1] / normal[:, 2]
+        planes = np.empty((len(tr_vts), 3), dtype=np.float64)
+        planes[:, 0] = a
+        planes[:, 1] = b
+        planes[:, 2] = v1[:, 2] - a * v1[:, 0] - b * v1[:, 1]
+
+        self.plane_chunks[chunk] = planes
+        return planes
+
+    def get_triangle_planes(self, tr_ids):
+        """
+        Explination: Get the plane coefficients of many triangles, see get_plane_chunk.
+        ---------------
+        Input:
+            tr_ids : np.ndarray (n,) - The triangle ids.
+        ---------------
+        Output:
+            np.ndarray (n, 3) - a, b and c of every triangle.
+        """
+        tr_ids = np.asarray(tr_ids, dtype=np.int64).reshape(-1)
+        chunks = tr_ids // PLANE_CHUNK_SIZE
+        planes = np.empty((len(tr_ids), 3), dtype=np.float64)
+        for chunk in np.unique(chunks):
+            in_chunk = chunks == chunk
+            planes[in_chunk] = self.get_plane_chunk(int(chunk))[tr_ids[in_chunk] - chunk * PLANE_CHUNK_SIZE]
+        return planes
+
+    def sample_heights(self, tr_ids, xy):
+        """
+        Explination: Find the interpolated heights of many points at once.
+        ---------------
+        Input:
+            tr_ids : np.ndarray (n,) - For each point the id of the triangle it is in.
+            xy : np.ndarray (n, 2) - The points, extra columns (z) are ignored.
+        ---------------
+        Output:
+            np.ndarray (n,) - The interpolated heights.
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, np.shape(xy)[-1])
+        if len(xy) == 0:
+            return np.zeros(0)
+        planes = self.get_triangle_planes(tr_ids)
+        return (planes[:, 0] * (xy[:, 0] - self.plane_origin[0]) + planes[:, 1] * (xy[:, 1] - self.plane_origin[1])
+                + planes[:, 2])
+
+    def create_grid_index(self, cell_size=None):
+        """
+        Explination: Build a uniform grid index of the triangles, so every walk can start close to its target.
+        ---------------
+        Input:
+            cell_size : float - Optional, the size of a grid cell. By default about the size of an average triangle.
+        ---------------
+        Output: void (sets self.grid)
+        """
+        self.grid = TriangleGrid(self.vts, self.trs, cell_size)
+
+    def get_start_triangles(self, xy):
+        """
+        Explination: Get a triangle close to each point to start a walk from.
+        The grid index is used when it exists, otherwise (and for empty cells) the triangle near the nearest vertex.
+        ---------------
+        Input:
+            xy : np.ndarray (n, 2) - The points.
+        ---------------
+        Output:
+            np.ndarray (n,) - The triangle ids to start from.
+        """
+        xy = np.asarray(xy, dtype=np.float64)[:, :2]
+        if self.grid is None:
+            return self.find_vts_near_pts(xy)
+        start_triangles = self.grid.get_start_triangles(xy)
+        empty = start_triangles == -1
+        if np.any(empty):
+            start_triangles[empty] = self.find_vts_near_pts(xy[empty])
+        return start_triangles
+
+    def get_start_triangle(self, pt):
+        """
+        Explination: Get a triangle close to a point to start a walk from, see get_start_triangles.
+        ---------------
+        Input:
+            pt : [x,y(,z)] - The point.
+        ---------------
+        Output:
+            integer - The triangle id to start from.
+        """
+        return int(self.get_start_triangles(np.array([pt[:2]]))[0])
+
     def point_in_triangle(self, pt, tr):
         """
         Explanation: Do a side test for all edges with the pt, if they are all positive.
@@ -44,24 +328,110 @@ class GroundTin:
             return False
 
     def find_vts_near_pt(self, p_receiver):
-        nearest_vts = self.kd_vts.query(p_receiver)[1]
-        for i, tr in enumerate(self.trs):
-            if nearest_vts in tr[:3]:
-                return i
+        """
+        Explination: Find a triangle that uses the vertex nearest to a point, to start a walk from.
+        ---------------
+        Input:
+            p_receiver : [x,y(,z)] - The point.
+        ---------------
+        Output:
+            integer - The id of the first triangle incident to the nearest vertex.
+        """
+        if self.kd_vts is None:
+            self.kd_vts = KDTree(self.vts[:, [0, 1]])
+        nearest_vts = self.kd_vts.query(p_receiver[:2])[1]
+        start = self.vertex_triangle_offsets[nearest_vts]
+        if start < self.vertex_triangle_offsets[nearest_vts + 1]:
+            return int(self.vertex_triangles[start])
         return 2
 
+    def find_vts_near_pts(self, xy):
+        """
+        Explination: Vectorised find_vts_near_pt, find a starting triangle for many points at once.
+        ---------------
+        Input:
+            xy : np.ndarray (n, 2) - The points.
+        ---------------
+        Output:
+            np.ndarray (n,) - For each point the id of the first triangle incident to its nearest vertex.
+        """
+        if self.kd_vts is None:
+            self.kd_vts = KDTree(self.vts[:, [0, 1]])
+        nearest_vts = self.kd_vts.query(xy)[1]
+        starts = self.vertex_triangle_offsets[nearest_vts]
+        has_triangle = starts < self.vertex_triangle_offsets[nearest_vts + 1]
+        return np.where(has_triangle, self.vertex_triangles[np.minimum(starts, len(self.vertex_triangles) - 1)], 2)
+
+    def locate_points(self, xy, tr_init=None, max_steps=1000):
+        """
+        Explination: Find the triangles in which many points are located at once.
+        All walks are advanced together, every step does the side tests of all walks that are still going with numpy.
+        The walk of each point is the same walk find_receiver_triangle would do.
+        ---------------
+        Input:
+            xy : np.ndarray (n, 2) - The points to locate, extra columns (z) are ignored.
+            tr_init : np.ndarray (n,) - Optional, the triangle ids to start from, by default get_start_triangles is used.
+            max_steps : integer - The maximum number of triangles to walk per point.
+        ---------------
+        Output:
+            np.ndarray (n,) - For each point the triangle id, or -1 if the walk left the tin or did not finish.
+        """
+        xy = np.asarray(xy, dtype=np.float64)
+        xy = xy.reshape(-1, xy.shape[-1])[:, :2] if xy.size else np.zeros((0, 2))
+        if tr_init is None:
+            trs_current = self.get_start_triangles(xy) if len(xy) else np.zeros(0, dtype=np.int64)
+        else:
+            trs_current = np.array(tr_init, dtype=np.int64).reshape(-1)
+
+        located = np.full(len(xy), -1, dtype=np.int64)
+        active = np.arange(len(xy))
+        nbs = np.array([5, 3, 4])
+
+        for i in range(max_steps):
+            if len(active) == 0:
+                break
+            tr = trs_current[active]
+            tr_vts = self.trs[tr]
+            pt = xy[active].T
+            v0 = self.vts[tr_vts[:, 0]].T
+            v1 = self.vts[tr_vts[:, 1]].T
+            v2 = self.vts[tr_vts[:, 2]].T
+
+            d = np.stack((misc.side_test(v0, v1, pt), misc.side_test(v1, v2, pt), misc.side_test(v2, v0, pt)), axis=1)
+
+            # points that are on the inside (or exactly on an edge) are found
+            inside = np.all(d >= 0, axis=1)
+            located[active[inside]] = tr[inside]
+
+            # the others walk over the edge with the most negative side test
+            walking = ~inside
+            d_min = np.argmin(d[walking], axis=1)
+            tr_next = tr_vts[walking, nbs[d_min]]
+            active = active[walking]
+            trs_current[active] = tr_next
+
+            # a walk that leaves the tin can not find its triangle
+            active = active[tr_next != -1]
+
+        if len(active) > 0:
+            print("no tr found for {} points after {} loops".format(len(active), max_steps))
+
+        return located
+
     def find_receiver_triangle(self, tr_init, p_receiver):
         """
         Explanation: Find the triangle in which the p_source is located, by means of walking from tr_init to the right triangle
         ---------------
         Input:
-            tr_init : integer - An (arbitrary) triangle id to start from.
+            tr_init : integer - An (arbitrary) triangle id to start from, when None the start comes from get_start_triangle.
             p_receiver : [x,y,z] - The receiver point.
         ---------------
         Output:
             integer - triangle id of triangle underneath source point
         """
         #print("=== find_receiver_triangle ===")
+        if tr_init is None:
+            tr_init = self.get_start_triangle(p_receiver)
         tr = tr_init
         for i in range(1000):  # max 1000 triangles to walk.
             # do the side test for all sides, returns the value
@@ -131,17 +501,8 @@ class GroundTin:
         Output:
         interpolated value
         """
-        v1 = self.vts[self.trs[tr][0]]
-        v2 = self.vts[self.trs[tr][1]]
-        v3 = self.vts[self.trs[tr][2]]
-
-        w1 = ((v2[1] - v3[1]) * (pt[0] - v3[0]) + (v3[0] - v2[0]) * (pt[1] - v3[1])) / (
-                (v2[1] - v3[1]) * (v1[0] - v3[0]) + (v3[0] - v2[0]) * (v1[1] - v3[1]))
-        w2 = ((v3[1] - v1[1]) * (pt[0] - v3[0]) + (v1[0] - v3[0]) * (pt[1] - v3[1])) / (
-                (v2[1] - v3[1]) * (v1[0] - v3[0]) + (v3[0] - v2[0]) * (v1[1] - v3[1]))
-        w3 = 1 - w1 - w2
-
-        return w1 * v1[2] + w2 * v2[2] + w3 * v3[2]
+        a, b, c = self.get_plane_chunk(tr // PLANE_CHUNK_SIZE)[tr % PLANE_CHUNK_SIZE]
+        return a * (pt[0] - self.plane_origin[0]) + b * (pt[1] - self.plane_origin[1]) + c
 
     def get_2d_convex_hull(self):
         """
@@ -208,65 +569,351 @@ class GroundTin:
                     triangle[5] + 1) + "\n"
                 output_file.write(triangle_str)
 
-def read_from_objp(file_path):
+    def write_to_binary(self, file_path):
+        """
+        Explination: Writes out the tin to a binary tin file, which can be memory mapped by read_from_binary.
+        ---------------
+        Input:
+            file_path : string - The path to the binary tin file we want to write to.
+        ---------------
+        Output: void
+        """
+        write_binary_tin(file_path, self.vts, self.trs, self.attribute_codes, self.attribute_names.astype(np.bytes_),
+                         self.bounding_box_3d, self.vertex_triangle_offsets, self.vertex_triangles)
+
+def get_vertex_triangle_index(trs, n_vts):
     """
-    Explination: Read an objp file and make a tin from it.
+    Explination: Build a CSR style index from every vertex to the triangles that use it, in increasing triangle id order.
     ---------------
     Input:
-        file_path : string - The path to the obj file.
+        trs : np.ndarray (m, 6) - The triangles, three vertex ids followed by three neighbour ids.
+        n_vts : integer - The number of vertices.
     ---------------
     Output:
-        ground_tin : GroundTin - The tin that was created from the obj file input.
+        vertex_triangle_offsets : np.ndarray (n_vts + 1,) - The triangles of vertex v start at vertex_triangle_offsets[v].
+        vertex_triangles : np.ndarray (3 * m,) - The triangle ids of all vertices one after the other.
     """
+    corners = np.asarray(trs[:, :3]).ravel()
+    # a stable sort keeps the triangles of one vertex in increasing order
+    order = np.argsort(corners, kind='stable')
+    vertex_triangles = (order // 3).astype(np.int32)
 
-    vertices = []
-    triangles = []
-    attributes = []
+    counts = np.bincount(corners, minlength=n_vts)
+    vertex_triangle_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=vertex_triangle_offsets[1:])
+    return vertex_triangle_offsets, vertex_triangles
 
-    min_values = [100000000, 100000000, 100000000]
-    max_values = [-100000000, -100000000, -100000000]
+def get_binary_offsets(header):
+    """
+    Explination: Compute where each array starts in a binary tin file, every array is aligned to 8 bytes.
+    ---------------
+    Input:
+        header : np.ndarray - The header record of the binary tin file.
+    ---------------
+    Output:
+        offsets : list - The byte offsets of the vertices, triangles, attribute codes, attribute names,
+                         vertex triangle offsets and vertex triangles.
+        end : integer - The size of the complete file in bytes.
+    """
+    sizes = [
+        int(header["n_vts"]) * 3 * 8,
+        int(header["n_trs"]) * 6 * 4,
+        int(header["n_attributes"]) * 4,
+        int(header["n_names"]) * int(header["name_width"]),
+        int(header["n_vertex_offsets"]) * 8,
+        int(header["n_vertex_triangles"]) * 4
+    ]
+    offsets = []
+    position = BINARY_TIN_HEADER.itemsize
+    for size in sizes:
+        position += (-position) % 8
+        offsets.append(position)
+        position += size
+    return offsets, position
+
+def get_binary_header(n_vts, n_trs, n_attributes, attribute_names, bounding_box_3d, n_vertex_offsets=0, n_vertex_triangles=0):
+    """
+    Explination: Make the header record of a binary tin file.
+    ---------------
+    Input:
+        n_vts : integer - The number of vertices.
+        n_trs : integer - The number of triangles.
+        n_attributes : integer - The number of attribute codes.
+        attribute_names : np.ndarray (k,) of bytes - The unique attributes of the tin.
+        bounding_box_3d : list - [min_x, min_y, min_z, max_x, max_y, max_z]
+        n_vertex_offsets : integer - The number of vertex triangle offsets, 0 when the file has no vertex triangle index.
+        n_vertex_triangles : integer - The number of vertex triangles.
+    ---------------
+    Output:
+        header : np.ndarray - The header record, an array of one BINARY_TIN_HEADER.
+    """
+    header = np.zeros(1, dtype=BINARY_TIN_HEADER)
+    header["magic"] = BINARY_TIN_MAGIC
+    header["version"] = BINARY_TIN_VERSION
+    header["n_vts"] = n_vts
+    header["n_trs"] = n_trs
+    header["n_attributes"] = n_attributes
+    header["n_names"] = len(attribute_names)
+    header["name_width"] = attribute_names.dtype.itemsize
+    header["n_vertex_offsets"] = n_vertex_offsets
+    header["n_vertex_triangles"] = n_vertex_triangles
+    header["bounding_box_3d"] = bounding_box_3d
+    return header
+
+def write_binary_tin(file_path, vts, trs, attribute_codes, attribute_names, bounding_box_3d, vertex_triangle_offsets=None,
+                     vertex_triangles=None):
+    """
+    Explination: Writes the arrays of a tin to a binary tin file, with the vertex triangle index so it is not built again on every read.
+    The file is first written to a temporary file and then moved, so a crash never leaves a half written cache behind.
+    ---------------
+    Input:
+        file_path : string - The path to the binary tin file.
+        vts : np.ndarray (n, 3) - The vertices.
+        trs : np.ndarray (m, 6) - The triangles, three vertex ids followed by three neighbour ids.
+        attribute_codes : np.ndarray (m,) - For each triangle the index of its attribute in attribute_names.
+        attribute_names : np.ndarray (k,) of bytes - The unique attributes of the tin.
+        bounding_box_3d : list - [min_x, min_y, min_z, max_x, max_y, max_z]
+        vertex_triangle_offsets : np.ndarray (n + 1,) - Optional, the CSR index of the triangles of each vertex,
+                                                        it is built from the triangles when it is not given.
+        vertex_triangles : np.ndarray - Optional, the triangles of the vertices, see get_vertex_triangle_index.
+    ---------------
+    Output: void
+    """
+    vts = np.asarray(vts, dtype="<f8").reshape(-1, 3)
+    trs = np.asarray(trs, dtype="<i4").reshape(-1, 6)
+    attribute_codes = np.asarray(attribute_codes, dtype="<i4")
+    attribute_names = np.asarray(attribute_names, dtype=np.bytes_)
+    if vertex_triangle_offsets is None or vertex_triangles is None:
+        vertex_triangle_offsets, vertex_triangles = get_vertex_triangle_index(trs, len(vts))
+    vertex_triangle_offsets = np.asarray(vertex_triangle_offsets, dtype="<i8")
+    vertex_triangles = np.asarray(vertex_triangles, dtype="<i4")
+
+    header = get_binary_header(len(vts), len(trs), len(attribute_codes), attribute_names, bounding_box_3d,
+                               len(vertex_triangle_offsets), len(vertex_triangles))
+    offsets, end = get_binary_offsets(header[0])
+
+    temp_file_path = file_path + ".tmp"
+    with open(temp_file_path, 'wb') as output_file:
+        header.tofile(output_file)
+        for offset, array in zip(offsets, (vts, trs, attribute_codes, attribute_names, vertex_triangle_offsets, vertex_triangles)):
+            output_file.seek(offset)
+            array.tofile(output_file)
+        output_file.truncate(end)
+    os.replace(temp_file_path, file_path)
+
+def read_binary_header(file_path):
+    """
+    Explination: Read the header of a binary tin file.
+    ---------------
+    Input:
+        file_path : string - The path to the binary tin file.
+    ---------------
+    Output:
+        header : np.ndarray - The header record, or None if the file is not a (complete) binary tin file of this version.
+    """
+    if os.path.getsize(file_path) < BINARY_TIN_HEADER.itemsize:
+        return None
+    header = np.fromfile(file_path, dtype=BINARY_TIN_HEADER, count=1)[0]
+    if header["magic"] != BINARY_TIN_MAGIC or header["version"] != BINARY_TIN_VERSION:
+        return None
+    if os.path.getsize(file_path) != get_binary_offsets(header)[1]:
+        return None
+    return header
+
+def read_binary_arrays(file_path):
+    """
+    Explination: Open the arrays of a binary tin file, the vertices, triangles, attribute codes and vertex triangle index are memory mapped.
+    ---------------
+    Input:
+        file_path : string - The path to the binary tin file.
+    ---------------
+    Output:
+        vts : np.memmap (n, 3) - The vertices.
+        trs : np.memmap (m, 6) - The triangles.
+        attribute_codes : np.memmap (m,) - The attribute code of each triangle, None if the file has no attributes.
+        attribute_names : np.ndarray (k,) of strings - The unique attributes, None if the file has no attributes.
+        vertex_triangle_offsets : np.memmap (n + 1,) - The CSR index of the triangles of each vertex, None if the file has no index.
+        vertex_triangles : np.memmap - The triangles of the vertices, None if the file has no index.
+        bounding_box_3d : list - [min_x, min_y, min_z, max_x, max_y, max_z]
+    """
+    header = read_binary_header(file_path)
+    if header is None:
+        raise ValueError("{} is not a valid binary tin file of version {}".format(file_path, BINARY_TIN_VERSION))
+
+    offsets, end = get_binary_offsets(header)
+    n_vts = int(header["n_vts"])
+    n_trs = int(header["n_trs"])
+    n_attributes = int(header["n_attributes"])
+    n_names = int(header["n_names"])
+
+    vts = np.memmap(file_path, dtype="<f8", mode='r', offset=offsets[0], shape=(n_vts, 3))
+    trs = np.memmap(file_path, dtype="<i4", mode='r', offset=offsets[1], shape=(n_trs, 6))
+
+    attribute_codes = None
+    attribute_names = None
+    if n_attributes > 0 and n_names > 0:
+        attribute_codes = np.memmap(file_path, dtype="<i4", mode='r', offset=offsets[2], shape=(n_attributes,))
+        attribute_names = np.fromfile(file_path, dtype="S{}".format(int(header["name_width"])), count=n_names,
+                                      offset=offsets[3]).astype(str)
+
+    # the tiled tin file has no vertex triangle index, its tins are built from parts of it
+    vertex_triangle_offsets = None
+    vertex_triangles = None
+    n_vertex_offsets = int(header["n_vertex_offsets"])
+    if n_vertex_offsets > 0:
+        vertex_triangle_offsets = np.memmap(file_path, dtype="<i8", mode='r', offset=offsets[4], shape=(n_vertex_offsets,))
+        vertex_triangles = np.memmap(file_path, dtype="<i4", mode='r', offset=offsets[5],
+                                     shape=(int(header["n_vertex_triangles"]),))
+
+    bounding_box_3d = [float(value) for value in header["bounding_box_3d"]]
+
+    return vts, trs, attribute_codes, attribute_names, vertex_triangle_offsets, vertex_triangles, bounding_box_3d
+
+def read_from_binary(file_path):
+    """
+    Explination: Open a binary tin file and make a tin from it, the arrays are memory mapped and not read into memory.
+    ---------------
+    Input:
+        file_path : string - The path to the binary tin file.
+    ---------------
+    Output:
+        ground_tin : GroundTin - The tin that was created from the binary file.
+    """
+    vts, trs, attribute_codes, attribute_names, vertex_triangle_offsets, vertex_triangles, bounding_box_3d = read_binary_arrays(file_path)
 
-    total_list_create_time = 0
-    total_class_create_time = 0
+    ground_tin = GroundTin(vts, trs, attribute_codes=attribute_codes, attribute_names=attribute_names,
+                           vertex_triangle_offsets=vertex_triangle_offsets, vertex_triangles=vertex_triangles)
 
-    # Read the file and store all the vertices and triangles
-    with open(file_path, 'r') as input_file:
+    ground_tin.bounding_box_2d = [bounding_box_3d[0], bounding_box_3d[1], bounding_box_3d[3], bounding_box_3d[4]]
+    ground_tin.bounding_box_3d = bounding_box_3d
+
+    return ground_tin
 
-        lines = input_file.readlines()
-
-        for line in lines:
-            line_elements = line.split(' ')
-            if line_elements[0] == 'v':
-                x = float(line_elements[1])
-                y = float(line_elements[2])
-                z = float(line_elements[3])
-                vertex = [x, y, z]
-                vertices.append(vertex)
-                for i in range(0, 3):
-                    if vertex[i] < min_values[i]:
-                        min_values[i] = vertex[i]
-                    if vertex[i] > max_values[i]:
-                        max_values[i] = vertex[i]
-
-            if line_elements[0] == 'f':
-                v1 = int(line_elements[1]) - 1
-                v2 = int(line_elements[2]) - 1
-                v3 = int(line_elements[3]) - 1
-                a1 = int(line_elements[4]) - 1
-                a2 = int(line_elements[5]) - 1
-                a3 = int(line_elements[6]) - 1
-
-                triangle = [v1, v2, v3, a1, a2, a3]
-                triangles.append(triangle)
-            
-            if line_elements[0] == 'a':
-                attribute = line_elements[1].rstrip("\n")
-
-                attributes.append(attribute)
-    
-    ground_tin = GroundTin(vertices, triangles, attributes)
-    ground_tin.bounding_box_2d = [min_values[0], min_values[1], max_values[0], max_values[1]]
-    ground_tin.bounding_box_3d = [min_values[0], min_values[1], min_values[2], max_values[0], max_values[1],
-                                    max_values[2]]
+def grow_array(array, size):
+    """
+    Explination: Make sure an array has room for at least size rows, it grows geometrically (at least doubling).
+    ---------------
+    Input:
+        array : np.ndarray - The array to grow, it must not be referenced anywhere else.
+        size : integer - The number of rows that are needed.
+    ---------------
+    Output:
+        array : np.ndarray - The array with room for at least size rows.
+    """
+    if size > len(array):
+        array.resize((max(size, 2 * len(array)),) + array.shape[1:], refcheck=False)
+    return array
+
+def parse_objp_records(lines, columns, dtype):
+    """
+    Explination: Parse the values of a list of objp records of one type (the record type already removed).
+    ---------------
+    Input:
+        lines : list of strings - The records, eg. "x y z\n" for vertices.
+        columns : integer - The number of values per record.
+        dtype : numpy dtype - The type of the values.
+    ---------------
+    Output:
+        np.ndarray (len(lines), columns) - The parsed values.
+    """
+    try:
+        values = np.fromstring(''.join(lines), sep=' ')
+    except ValueError:
+        values = None
+    if values is None or len(values) != len(lines) * columns:
+        # some records have extra values, only take the first columns of every record
+        values = np.array([line.split()[:columns] for line in lines], dtype=np.float64)
+    return values.reshape(len(lines), columns).astype(dtype)
+
+def get_binary_cache_path(file_path):
+    """
+    Explination: Get the path of the binary cache that belongs to an objp file, it is stored next to the objp file.
+    ---------------
+    Input:
+        file_path : string - The path to the objp file.
+    ---------------
+    Output:
+        string - The path to the binary tin file.
+    """
+    return os.path.splitext(file_path)[0] + BINARY_TIN_EXTENSION
+
+def read_from_objp(file_path, use_cache=True):
+    """
+    Explination: Read an objp file and make a tin from it.
+    When a binary cache of the objp file exists that is newer than the objp file, the tin is opened from the cache instead.
+    Otherwise the objp file is parsed and the cache is (re)written for the next run.
+    ---------------
+    Input:
+        file_path : string - The path to the obj file.
+        use_cache : boolean - Whether the binary cache should be used and written.
+    ---------------
+    Output:
+        ground_tin : GroundTin - The tin that was created from the obj file input.
+    """
+    cache_path = get_binary_cache_path(file_path)
+    if use_cache and os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(file_path):
+        if read_binary_header(cache_path) is not None:
+            return read_from_binary(cache_path)
+
+    # start with room for an estimated number of records, the arrays grow geometrically when needed
+    estimated_size = max(os.path.getsize(file_path) // OBJP_BYTES_PER_RECORD, 16)
+    vertices = np.empty((estimated_size, 3), dtype=np.float64)
+    triangles = np.empty((estimated_size, 6), dtype=np.int32)
+    attribute_codes = np.empty(estimated_size, dtype=np.int32)
+    attribute_name_to_code = {}
+    n_vts = 0
+    n_trs = 0
+    n_attributes = 0
+
+    # Read the file in chunks of lines and store the vertices, triangles and attributes of each chunk
+    with open(file_path, 'r') as input_file:
+        while True:
+            lines = input_file.readlines(OBJP_CHUNK_BYTES)
+            if len(lines) == 0:
+                break
+
+            vertex_lines = [line[2:] for line in lines if line.startswith('v ')]
+            triangle_lines = [line[2:] for line in lines if line.startswith('f ')]
+            attribute_lines = [line[2:].rstrip("\n") for line in lines if line.startswith('a ')]
+
+            if len(vertex_lines) > 0:
+                chunk = parse_objp_records(vertex_lines, 3, np.float64)
+                vertices = grow_array(vertices, n_vts + len(chunk))
+                vertices[n_vts:n_vts + len(chunk)] = chunk
+                n_vts += len(chunk)
+
+            if len(triangle_lines) > 0:
+                chunk = parse_objp_records(triangle_lines, 6, np.int64) - 1
+                triangles = grow_array(triangles, n_trs + len(chunk))
+                triangles[n_trs:n_trs + len(chunk)] = chunk
+                n_trs += len(chunk)
+
+            if len(attribute_lines) > 0:
+                chunk_names, chunk_codes = np.unique(np.array(attribute_lines), return_inverse=True)
+                name_codes = np.empty(len(chunk_names), dtype=np.int32)
+                for i, attribute in enumerate(chunk_names):
+                    name_codes[i] = attribute_name_to_code.setdefault(str(attribute), len(attribute_name_to_code))
+                attribute_codes = grow_array(attribute_codes, n_attributes + len(chunk_codes))
+                attribute_codes[n_attributes:n_attributes + len(chunk_codes)] = name_codes[chunk_codes]
+                n_attributes += len(chunk_codes)
+
+    # shrink the arrays to their final size
+    vertices.resize((n_vts, 3), refcheck=False)
+    triangles.resize((n_trs, 6), refcheck=False)
+    attribute_codes.resize((n_attributes,), refcheck=False)
+
+    ground_tin = GroundTin(vertices, triangles, attribute_codes=attribute_codes,
+                           attribute_names=np.array(list(attribute_name_to_code.keys()), dtype=str))
+    if n_vts > 0:
+        min_values = vertices.min(axis=0)
+        max_values = vertices.max(axis=0)
+        ground_tin.bounding_box_2d = [float(min_values[0]), float(min_values[1]), float(max_values[0]), float(max_values[1])]
+        ground_tin.bounding_box_3d = [float(value) for value in min_values] + [float(value) for value in max_values]
+
+    if use_cache:
+        try:
+            ground_tin.write_to_binary(cache_path)
+        except OSError as error:
+            print("could not write binary tin cache {}: {}".format(cache_path, error))
 
     return ground_tin
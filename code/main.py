@@ -2,63 +2,96 @@ import fiona
 import groundTin as TIN
 import misc
 import numpy as np
+import os
 import sys
 import xml.etree.cElementTree as ET
 
 from buildingManager import BuildingManager
+from checkpointManager import CheckpointManager
 from crossSectionManager import CrossSectionManager
+from dependencyManager import DependencyManager, read_dependencies
 from groundTypeManager import GroundTypeManager
+from metricsManager import MetricsManager
 from receiverManager import ReceiverManager
-from receiverPoint import ReceiverPoint
+from receiverPoint import CNOSSOS_SECTOR_ANGLE, ReceiverPoint
 from reflectionManager import ReflectionManager
 from reflectionPath import ReflectionPath
+from roadIndex import RoadIndex
+from sourceTable import SourceTable
 from xmlParserManager import XmlParserManager
 
+from multiprocessing import Pool
 from pathlib import Path
-from shapely.geometry import Polygon, LineString, Point
-from shapely.strtree import STRtree
-from time import time
+from shapely.geometry import Polygon, Point
+from tiledTin import read_tiled_tin
+from time import perf_counter, time
+
+# set variables to play with
+SOURCE_HEIGHT = 0.05
+RECEIVER_HEIGHT = 2.0
+MINIMAL_BUILDING_HEIGHT_THRESHOLD = 1.0 # this is the minimal height difference for a building to be reflective
+SIMPLIFY_THRESHOLD = 0.1 # the default Douglas Peucker threshold of --simplify, in meters
+DEFAULT_NOISE_LEVELS = {
+    "sourceType"         : "LineSource",
+    "measurementType"    : "OmniDirectionnal",
+    "frequencyWeighting" : "LIN",
+    "power"              : np.array([78.2, 74.1, 71.6, 74.2, 78, 73.8, 69, 55.9])
+}
+
+# the road segments array starts with room for this many segments, it grows while the roads are read
+ROAD_SEGMENTS_INITIAL_SIZE = 1024
+# the timers and counters of a run are written to this file in the output folder
+METRICS_FILE_NAME = "metrics.json"
+# with --incremental, what the paths of every receiver depend on is kept in this file in the output folder
+DEPENDENCIES_FILE_NAME = "dependencies.npz"
+# the folder in the output folder with the checkpoint of --checkpoint and --resume, and the number of receivers per checkpoint batch
+CHECKPOINT_FOLDER_NAME = "checkpoint"
+CHECKPOINT_BATCH_SIZE = 256
+# the receivers of a batch are split into this many chunks per worker, so a slow chunk does not keep the other workers idle
+WORKER_CHUNKS_PER_WORKER = 4
+# the tin, buildings and roads of a worker process, set by init_worker
+WORKER_STATE = {}
 
 def return_segments_source(path):
     """
-    Explanation: Changes the data structure of the coordinates from strings to floats in tuples
+    Explanation: Reads the coordinates of the road lines in a GML file as line segments, with every next point in a line.
+    The file is parsed as a stream, every element is cleared once it is read, so only the segments are kept in memory.
     ---------------
     Input:
-    path : string - the path of the XML file
+    path : string - the path of the GML file
     ---------------
     Output:
-    list : list - a list of all the coordinates are saved as (x, y), line segments with every next point in list
-    """
-    count = 0
-    sets = []
-    line_string = []
-    line_float = []
-    line_segments = []
-
-    tree = ET.parse(path)
-    root = tree.getroot()
-    for child in root.iter():
-        if "coordinates" in child.tag:
-            coordinates = child.text
-            line_string = coordinates.split()
-            if len(line_string) > 1:
-                for point in line_string:
-                    coord = point.split(',')
-                    sets.append((float(coord[0]), float(coord[1])))
-                    count += 1
-                if len(line_string) == count:
-                    line_float.append(sets)
-                    count = 0
-                    sets = []
-    for elem in line_float:
-        if len(elem) == 2:
-            line_segments.append(LineString((elem[0], elem[1])))
-        if len(elem) > 2:
-            for i in range(len(elem) - 1):
-                first_el = elem[i]
-                next_el = elem[i + 1]
-                line_segments.append(LineString((first_el, next_el)))
-    return line_segments
+    np.ndarray (m, 2, 2) : the line segments, (x, y) of their first and second point
+    """
+    segments = np.zeros((ROAD_SEGMENTS_INITIAL_SIZE, 2, 2))
+    n_segments = 0
+
+    root = None
+    depth = 0
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+
+        if "coordinates" in element.tag and element.text is not None:
+            points = element.text.split()
+            if len(points) > 1:
+                # the points are 'x,y' (or 'x,y,z'), only x and y are used
+                coordinates = np.array(element.text.replace(",", " ").split(), dtype=np.float64).reshape(len(points), -1)[:, :2]
+                segments = TIN.grow_array(segments, n_segments + len(points) - 1)
+                segments[n_segments:n_segments + len(points) - 1, 0] = coordinates[:-1]
+                segments[n_segments:n_segments + len(points) - 1, 1] = coordinates[1:]
+                n_segments += len(points) - 1
+            element.clear()
+
+        # a child of the root (a feature) is done, remove it from the tree
+        if depth == 1:
+            root.clear()
+
+    return segments[:n_segments].copy()
 
 def read_building_and_ground(file_path, building_manager, ground_type_manager):
     
@@ -85,8 +118,303 @@ def read_building_and_ground(file_path, building_manager, ground_type_manager):
                         roof_level = record['properties']['h_dak']
                         building_manager.add_building(part_id, bag_id, geometry, ground_level, roof_level)
 
+def parse_arguments(sys_args):
+    """
+    Explanation: Splits the command line into the positional arguments and the options.
+    The options come after the positional arguments, as '--name value', or as '--name' for a switch.
+    ---------------
+    Input:
+    sys_args : list - the command line arguments
+    ---------------
+    Output:
+    list : the positional arguments, starting with the program name
+    dictionary : the value of every option, True for a switch
+    """
+    arguments = []
+    options = {}
+    i = 0
+    while i < len(sys_args):
+        if sys_args[i].startswith("--"):
+            name = sys_args[i][2:]
+            if i + 1 < len(sys_args) and not sys_args[i + 1].startswith("--"):
+                options[name] = sys_args[i + 1]
+                i += 1
+            else:
+                options[name] = True
+        else:
+            arguments.append(sys_args[i])
+        i += 1
+    return arguments, options
+
+def read_tin(file_path):
+    """
+    Explanation: Reads the constrained tin, a binary tin (as written by create_objp.py) is opened directly.
+    ---------------
+    Input:
+    file_path : string - the path of the binary tin or objp file
+    ---------------
+    Output:
+    GroundTin : the tin
+    """
+    if file_path.endswith(TIN.BINARY_TIN_EXTENSION):
+        return TIN.read_from_binary(file_path)
+    return TIN.read_from_objp(file_path)
+
+def stream_cross_sections(receiver_manager, tin, ground_type_manager, building_manager, road_index, metrics):
+    """
+    Explanation: Computes the cross sections of a batch of receivers one receiver at a time, and yields them as soon as they are done.
+    For every receiver its sources are found, then its direct and its reflected cross sections are made. Only the cross sections
+    of the current receiver are kept, so the memory is bounded by one receiver and a writer can consume them while the next one is computed.
+    ---------------
+    Input:
+    receiver_manager : ReceiverManager - holds the receivers of this batch
+    tin : GroundTin - the tin around the receivers (the whole tin, or the window of a tile)
+    ground_type_manager : GroundTypeManager - stores all the ground types
+    building_manager : BuildingManager - stores all the buildings
+    road_index : RoadIndex - the road segments
+    metrics : MetricsManager - gets the time of every stage and the counters
+    ---------------
+    Output:
+    generator : (receiver_coords, list of CrossSection) for every receiver with at least one cross section, in the order of the receivers
+    """
+    watch = perf_counter()
+
+    # Locate all receivers in the tin once, receivers in a building are removed before any rays are cast
+    n_receivers = len(receiver_manager.receiver_points)
+    receiver_manager.locate_receivers(tin)
+    metrics.count("receivers_removed", n_receivers - len(receiver_manager.receiver_points))
+    metrics.add_time("receiver_location", watch)
+
+    cross_section_manager = CrossSectionManager(SOURCE_HEIGHT, RECEIVER_HEIGHT, metrics)
+    reflection_manager = ReflectionManager()
+
+    for receiver_coords, receiver in receiver_manager.receiver_points.items():
+        watch = perf_counter()
+
+        #Get the source points of the receiver
+        metrics.count("rays_cast", receiver.find_intersection_points(road_index))
+        metrics.count("rays_with_sources", receiver.sources.get_ray_count())
+        metrics.count("sources_found", len(receiver.sources))
+        watch = metrics.add_time("source_finding", watch)
+
+        #Create the cross sections for the direct paths
+        cross_section_manager.get_cross_sections_direct({receiver_coords: receiver}, tin, ground_type_manager, building_manager, SOURCE_HEIGHT, RECEIVER_HEIGHT)
+        n_direct = len(cross_section_manager.cross_sections.get(receiver_coords, []))
+        watch = metrics.add_time("direct_sections", watch)
+
+        # Get first order reflections, and their cross sections
+        reflection_manager.get_reflection_path(receiver_coords, receiver.sources, building_manager, tin, MINIMAL_BUILDING_HEIGHT_THRESHOLD, metrics)
+        watch = metrics.add_time("reflection_search", watch)
+        for source_id, reflection_path in reflection_manager.reflection_paths.pop(receiver_coords, {}).items():
+            cross_section_manager.get_cross_sections_reflection(reflection_path, receiver, source_id, tin, ground_type_manager, building_manager, SOURCE_HEIGHT, RECEIVER_HEIGHT)
+        metrics.add_time("reflected_sections", watch)
+
+        # the sources are not needed anymore once the cross sections are made
+        receiver.sources = SourceTable(receiver_coords)
+
+        cross_sections = cross_section_manager.cross_sections.pop(receiver_coords, None)
+        metrics.count("receivers_processed")
+        if cross_sections:
+            metrics.count("direct_cross_sections", n_direct)
+            metrics.count("reflected_cross_sections", len(cross_sections) - n_direct)
+            yield receiver_coords, cross_sections
+
+def init_worker(constraint_tin_file_path, building_and_ground_file_path, road_lines_file_path, tile_size, sector_angle):
+    """
+    Explanation: Sets up a worker process, it reads the tin, the buildings and the roads once and keeps them in WORKER_STATE.
+    A binary tin (or the binary cache of an objp file) is memory mapped, so the workers share it through the page cache.
+    ---------------
+    Input:
+    constraint_tin_file_path : string - the path of the constrained tin
+    building_and_ground_file_path : string - the path of the semantics
+    road_lines_file_path : string - the path of the roads
+    tile_size : float - the tile size of the tiled tin, None to use the whole tin
+    sector_angle : float - the size of the coarsest sectors of the adaptive rays, None to cast every ray
+    ---------------
+    Output:
+    void (fills WORKER_STATE)
+    """
+    ground_type_manager = GroundTypeManager()
+    building_manager = BuildingManager()
+    read_building_and_ground(building_and_ground_file_path, building_manager, ground_type_manager)
+    building_manager.create_rtree()
+
+    WORKER_STATE["ground_type_manager"] = ground_type_manager
+    WORKER_STATE["building_manager"] = building_manager
+    WORKER_STATE["road_index"] = RoadIndex(return_segments_source(road_lines_file_path))
+    WORKER_STATE["cell"] = None
+    WORKER_STATE["sector_angle"] = sector_angle
+
+    if tile_size is not None:
+        WORKER_STATE["tiled_tin"] = read_tiled_tin(constraint_tin_file_path, tile_size)
+    else:
+        tin = read_tin(constraint_tin_file_path)
+        tin.create_grid_index()
+        tin.set_roof_heights(building_manager)
+        WORKER_STATE["tin"] = tin
+
+def run_worker_task(task):
+    """
+    Explanation: Computes the cross sections of a chunk of receivers in a worker process.
+    ---------------
+    Input:
+    task : tuple - the tile cell of the receivers (None for the whole tin) and the coordinates of the receivers
+    ---------------
+    Output:
+    list : (receiver_coords, list of CrossSection) per receiver, see stream_cross_sections
+    MetricsManager : the timers and counters of the task
+    """
+    cell, receivers_coords = task
+    metrics = MetricsManager()
+
+    # the window of a tile is kept, the next chunk of receivers is most likely in the same tile
+    if cell is not None and WORKER_STATE["cell"] != cell:
+        watch = perf_counter()
+        tin = WORKER_STATE["tiled_tin"].get_tile_window(cell)
+        if tin is not None:
+            tin.create_grid_index()
+            tin.set_roof_heights(WORKER_STATE["building_manager"])
+        WORKER_STATE["tin"] = tin
+        WORKER_STATE["cell"] = cell
+        metrics.add_time("tile_load", watch)
+
+    if WORKER_STATE["tin"] is None:
+        return [], metrics
+
+    receiver_manager = ReceiverManager()
+    for receiver_coords in receivers_coords:
+        receiver_manager.receiver_points[receiver_coords] = ReceiverPoint(receiver_coords, sector_angle=WORKER_STATE["sector_angle"])
+
+    receiver_cross_sections = list(stream_cross_sections(receiver_manager, WORKER_STATE["tin"], WORKER_STATE["ground_type_manager"],
+                                                         WORKER_STATE["building_manager"], WORKER_STATE["road_index"], metrics))
+    return receiver_cross_sections, metrics
+
+def stream_cross_sections_parallel(pool, n_workers, cell, receivers_coords, metrics):
+    """
+    Explanation: Computes the cross sections of a batch of receivers with a pool of worker processes.
+    The receivers are split into chunks, the cross sections of a chunk are yielded as soon as the chunk
+    and all chunks before it are done, so they come in the order of the receivers.
+    ---------------
+    Input:
+    pool : multiprocessing.Pool - the worker processes, set up with init_worker
+    n_workers : integer - the number of worker processes
+    cell : (integer, integer) - the tile cell of the receivers, None for the whole tin
+    receivers_coords : list of (x,y) - the receivers
+    metrics : MetricsManager - gets the timers and counters of the workers, the times are summed over the workers
+    ---------------
+    Output:
+    generator : (receiver_coords, list of CrossSection) per receiver, see stream_cross_sections
+    """
+    # a batch without receivers (like an empty receiver set) has no chunks
+    if len(receivers_coords) == 0:
+        return
+
+    n_chunks = min(len(receivers_coords), n_workers * WORKER_CHUNKS_PER_WORKER)
+    tasks = [(cell, [receivers_coords[i] for i in chunk]) for chunk in np.array_split(np.arange(len(receivers_coords)), n_chunks)]
+
+    for receiver_cross_sections, worker_metrics in pool.imap(run_worker_task, tasks):
+        metrics.merge(worker_metrics)
+        yield from receiver_cross_sections
+
+def select_changed_receivers(dependency_manager, previous, receivers_coords, xml_manager, output_folders):
+    """
+    Explanation: Finds the receivers of an incremental run that have to be computed, see DependencyManager.get_changed_receivers.
+    The other receivers keep their record and their xml files. A receiver that is computed again keeps its number, its old xml files
+    are only removed when it is written again (or at the end of the run if it has no paths anymore), so the run can be resumed.
+    The xml files of receivers that are not in the receivers anymore are removed right away.
+    ---------------
+    Input:
+    dependency_manager : DependencyManager - the dependencies of this run, it gets the records of the receivers that are kept
+    previous : DependencyManager - the dependencies of the previous run, None if there is none
+    receivers_coords : list of (x,y) - the receivers of this run
+    xml_manager : XmlParserManager - gets the numbers of the receivers of the previous run
+    output_folders : tuple - the output folder and the xml output folder
+    ---------------
+    Output:
+    list : the coordinates of the receivers to compute
+    """
+    changed = dependency_manager.get_changed_receivers(previous, receivers_coords)
+    if previous is None:
+        return receivers_coords
+
+    # new receivers get a number after all numbers of the previous run
+    for number, path_count, tiles in previous.receivers.values():
+        xml_manager.receiver_count = max(xml_manager.receiver_count, number + 1)
+
+    for receiver_coords, is_changed in zip(receivers_coords, changed.tolist()):
+        if receiver_coords not in previous.receivers:
+            continue
+        number, path_count, tiles = previous.receivers[receiver_coords]
+        if is_changed:
+            if number != -1:
+                xml_manager.receiver_numbers[receiver_coords] = (number, path_count)
+        else:
+            dependency_manager.receivers[receiver_coords] = previous.receivers[receiver_coords]
+            if number != -1:
+                xml_manager.receivers[receiver_coords] = (number, path_count)
+
+    current_receivers = set(receivers_coords)
+    for receiver_coords, (number, path_count, tiles) in previous.receivers.items():
+        if receiver_coords not in current_receivers and number != -1:
+            xml_manager.remove_receiver_xml_files(number, path_count, output_folders)
+
+    return [receiver_coords for receiver_coords, is_changed in zip(receivers_coords, changed.tolist()) if is_changed]
+
+def write_cross_sections(receiver_cross_sections, xml_manager, output_folders, metrics, cross_sections_file_name=None):
+    """
+    Explanation: Writes the cross sections of a batch of receivers to the xml files while they are computed.
+    Only when an obj file with the cross sections is asked for, all cross sections of the batch are collected first.
+    ---------------
+    Input:
+    receiver_cross_sections : iterable - (receiver_coords, list of CrossSection) per receiver
+    xml_manager : XmlParserManager - writes the xml files, it numbers the receivers over all batches
+    output_folders : tuple - the output folder and the xml output folder
+    metrics : MetricsManager - gets the time of writing the obj file
+    cross_sections_file_name : string - the name of the obj file with the cross sections of this batch, None to not write it
+    ---------------
+    Output:
+    integer : the number of receivers with cross sections (writes the xml files, and optionally the obj file, of the batch)
+    """
+    receiver_count = len(xml_manager.receivers)
+
+    if cross_sections_file_name is None:
+        xml_manager.write_xml_stream(receiver_cross_sections, DEFAULT_NOISE_LEVELS, output_folders)
+        return len(xml_manager.receivers) - receiver_count
+
+    cross_section_manager = write_cross_sections_obj(receiver_cross_sections, output_folders[0], metrics, cross_sections_file_name)
+
+    xml_manager.write_xml_files(cross_section_manager, DEFAULT_NOISE_LEVELS, output_folders)
+    return len(xml_manager.receivers) - receiver_count
+
+def write_cross_sections_obj(receiver_cross_sections, output_folder, metrics, cross_sections_file_name):
+    """
+    Explanation: Writes the cross sections of a batch of receivers to one obj file, for debugging.
+    ---------------
+    Input:
+    receiver_cross_sections : iterable - (receiver_coords, list of CrossSection) per receiver
+    output_folder : string - the folder of the obj file
+    metrics : MetricsManager - gets the time of writing the obj file
+    cross_sections_file_name : string - the name of the obj file
+    ---------------
+    Output:
+    CrossSectionManager : holds all cross sections of the batch (writes the obj file)
+    """
+    cross_section_manager = CrossSectionManager(SOURCE_HEIGHT, RECEIVER_HEIGHT)
+    cross_section_manager.cross_sections.update(receiver_cross_sections)
+
+    #Optionally write an obj with all the cross sections
+    watch = perf_counter()
+    write_obj_paths_per_receiver = False
+    cross_section_manager.write_obj(output_folder, write_obj_paths_per_receiver, cross_sections_file_name)
+    metrics.add_time("obj_write", watch)
+    metrics.count("obj_files_written")
+    return cross_section_manager
+
 def main(sys_args):
     start = time()
+    metrics = MetricsManager()
+    watch_stage = perf_counter()
+    sys_args, options = parse_arguments(sys_args)
     print("Running {}".format(sys_args[0]))
     
     #Input files
@@ -104,86 +432,231 @@ def main(sys_args):
     output_folder_xml = output_folder + "/xml"
     Path(output_folder_xml).mkdir(parents=True, exist_ok=True)
 
-    tin = TIN.read_from_objp(constraint_tin_file_path)
+    # With --workers the receivers are divided over a pool of processes, each with its own tin, buildings and roads.
+    n_workers = int(options.get("workers", 1))
+
+    # With --obj all cross sections of a batch are kept, to also write them to an obj file. Otherwise they are streamed to the xml files.
+    write_obj = "obj" in options
+    # an incremental run only has the cross sections of the receivers it computes again, so it can not write the obj file of all receivers
+    if write_obj and "incremental" in options:
+        raise ValueError("--obj can not be used with --incremental, the obj file would only have the receivers that changed")
+
+    # With --adaptive-rays only the rays in sectors around a receiver with roads are cast, '--adaptive-rays 90' sets the coarsest sectors.
+    sector_angle = None
+    if "adaptive-rays" in options:
+        sector_angle = CNOSSOS_SECTOR_ANGLE if options["adaptive-rays"] is True else float(options["adaptive-rays"])
+        if not (np.isfinite(sector_angle) and sector_angle > 0):
+            raise ValueError("--adaptive-rays needs a sector angle larger than 0 degrees, not {}".format(options["adaptive-rays"]))
+
+    # With --tile-size the tin is split into tiles and only the tiles around the receivers that are processed are loaded.
+    tile_size = float(options["tile-size"]) if "tile-size" in options else None
+    tiled_tin = None
+    if tile_size is not None:
+        tiled_tin = read_tiled_tin(constraint_tin_file_path, tile_size)
+    else:
+        # this also creates the binary cache of an objp file, which the workers then memory map
+        tin = read_tin(constraint_tin_file_path)
+        tin.create_grid_index()
 
     print("read dtm in {:.2f} seconds".format(time() - start))
     watch = time()
+    watch_stage = metrics.add_time("tin_load", watch_stage)
 
     ground_type_manager = GroundTypeManager()
     building_manager = BuildingManager()
 
     read_building_and_ground(building_and_ground_file_path, building_manager, ground_type_manager)
     building_manager.create_rtree()
+    if tiled_tin is None:
+        tin.set_roof_heights(building_manager)
     
     print("read {} buildings in: {:.2f} seconds".format(len(building_manager.buildings), time() - watch))
     watch = time()
+    watch_stage = metrics.add_time("building_load", watch_stage)
     
     receiver_manager = ReceiverManager()
-    receiver_manager.read_receiver_points(receiver_point_file_path)
+    receiver_manager.read_receiver_points(receiver_point_file_path, sector_angle)
 
-    road_lines = [] #COS: Find a better place for this?
-    road_lines = return_segments_source(road_lines_file_path) #Read in the roads
-    tree_roads = STRtree(road_lines) # create a tree for roads
+    road_segments = return_segments_source(road_lines_file_path) #Read in the roads
+    road_index = RoadIndex(road_segments) # create an index for roads
 
     print("read receiver points in: {:.2f}\nFind sources for each receiver...".format(time() - watch))
-    watch = time()
+    metrics.add_time("receiver_load", watch_stage)
+    metrics.count("receivers_read", len(receiver_manager.receiver_points))
 
-    #Get the source points for each receiver
-    receiver_manager.determine_source_points(tree_roads)   
-    
-    print("found sources in {:.2f} seconds \nGet direct cross sections...".format(time() - watch))
-    watch = time()
+    # With --simplify the paths are simplified with Douglas Peucker before they are written, '--simplify 0.2' sets the threshold.
+    simplify_threshold = None
+    if "simplify" in options:
+        simplify_threshold = SIMPLIFY_THRESHOLD if options["simplify"] is True else float(options["simplify"])
 
-    # set variables to play with
-    source_height = 0.05
-    receiver_height = 2.0
-    minimal_building_height_threshold = 1.0 # this is the minimal height difference for a building to be reflective
-    default_noise_levels = {
-        "sourceType"         : "LineSource",
-        "measurementType"    : "OmniDirectionnal",
-        "frequencyWeighting" : "LIN",
-        "power"              : np.array([78.2, 74.1, 71.6, 74.2, 78, 73.8, 69, 55.9])
-    }
-
-    #Create the cross sections for all the direct paths
-    cross_section_manager = CrossSectionManager(source_height, receiver_height)
-    #print("=== get direct cross sections ===")
-    cross_section_manager.get_cross_sections_direct(receiver_manager.receiver_points, tin, ground_type_manager, building_manager, source_height, receiver_height)
-    
-    print("ran direct cross_sections in: {:.2f} seconds\nGet reflected paths...".format(time() - watch))
-    watch = time()
+    xml_manager = XmlParserManager(simplify_threshold, metrics)
+    output_folders = (output_folder, output_folder_xml)
 
-    # Get first order reflections   
-    reflection_manager = ReflectionManager()
-    reflection_manager.get_reflection_paths(receiver_manager.receiver_points, building_manager, tin, minimal_building_height_threshold)
-    
-    print("ran reflected paths in: {:.2f} seconds\nGet reflected cross sections...".format(time() - watch))
-    watch = time()
+    # the receivers are processed in batches, all at once or tile by tile. Each batch is written before the next one starts.
+    receivers_coords = list(receiver_manager.receiver_points.keys())
 
-    #Loop through all the reflection paths
-    for receiver_coords, ray_paths in reflection_manager.reflection_paths.items():
-        for ray_end, source_paths in ray_paths.items():
-            for source, reflection_path in source_paths.items():
-                cross_section_manager.get_cross_sections_reflection(reflection_path, tin, ground_type_manager, building_manager, source_height, receiver_height)
+    # With --incremental only the receivers of which the roads, buildings or tin within reach changed since the previous run are computed.
+    dependency_manager = None
+    if "incremental" in options:
+        watch_stage = perf_counter()
+        dependency_manager = DependencyManager({
+            "source_height": SOURCE_HEIGHT,
+            "receiver_height": RECEIVER_HEIGHT,
+            "minimal_building_height": MINIMAL_BUILDING_HEIGHT_THRESHOLD,
+            "simplify": simplify_threshold,
+            "noise_levels": {name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in DEFAULT_NOISE_LEVELS.items()}
+        })
+        dependency_manager.hash_roads(road_segments)
+        dependency_manager.hash_buildings(building_manager)
+        tin_arrays = tiled_tin if tiled_tin is not None else tin
+        dependency_manager.hash_tin(tin_arrays.vts, tin_arrays.trs, tin_arrays.attribute_codes, tin_arrays.attribute_names)
 
-    print("ran reflected cross sections in: {:.2f}".format(time() - watch))
-    watch = time()
+        previous = read_dependencies("{}/{}".format(output_folder, DEPENDENCIES_FILE_NAME))
+        all_receivers_coords = receivers_coords
+        receivers_coords = select_changed_receivers(dependency_manager, previous, receivers_coords, xml_manager, output_folders)
+        print("{} of {} receivers changed since the previous run".format(len(receivers_coords), len(all_receivers_coords)))
+        metrics.count("receivers_unchanged", len(all_receivers_coords) - len(receivers_coords))
+        metrics.add_time("dependency_check", watch_stage)
 
-    #Optionally write an obj with all the cross sections
-    write_obj_paths_per_receiver = False
-    cross_section_manager.write_obj(output_folder, write_obj_paths_per_receiver)
-   
-    print("wrote cross sections in: {:.2f} seconds\nWrite xml files...".format(time() - watch))
-    watch = time()
+    # With --checkpoint the batches are split into checkpoint batches, each is saved once it is computed and once it is written.
+    # '--checkpoint folder' sets the folder of the checkpoint. With --resume a run that stopped half way goes on from its checkpoint.
+    checkpoint_manager = None
+    if "checkpoint" in options or "resume" in options:
+        checkpoint_folder = options["checkpoint"] if isinstance(options.get("checkpoint"), str) else "{}/{}".format(output_folder, CHECKPOINT_FOLDER_NAME)
+        input_files = [constraint_tin_file_path, building_and_ground_file_path, receiver_point_file_path, road_lines_file_path]
+        checkpoint_manager = CheckpointManager(checkpoint_folder, {
+            "inputs": {file_path: [os.stat(file_path).st_size, os.stat(file_path).st_mtime_ns] for file_path in input_files},
+            "options": {name: value for name, value in options.items() if name not in ("checkpoint", "resume")},
+            "batch_size": CHECKPOINT_BATCH_SIZE
+        }, "resume" in options, metrics)
 
-    xml_manager = XmlParserManager()
-    xml_manager.write_xml_files(cross_section_manager, default_noise_levels, (output_folder, output_folder_xml))
+    pool = None
+    if n_workers > 1:
+        pool = Pool(n_workers, initializer=init_worker,
+                    initargs=(constraint_tin_file_path, building_and_ground_file_path, road_lines_file_path, tile_size, sector_angle))
 
-    print("wrote xml files in: {:.2f} seconds".format(time() - watch))
-    watch = time()
+    if tiled_tin is None:
+        batches = [(None, np.arange(len(receivers_coords)))]
+    else:
+        batches = tiled_tin.group_points(np.array(receivers_coords))
+
+    checkpoint_batch = 0
+    for i, (cell, receiver_indices) in enumerate(batches):
+        batch_coords = [receivers_coords[receiver_index] for receiver_index in receiver_indices]
+
+        if cell is not None:
+            # only the tin within reach of the tile is in memory
+            print("=== tile {} ({}/{}), {} receivers ===".format(cell, i + 1, len(batches), len(receiver_indices)))
+            cross_sections_file_name = "cross_sections_{}_{}.obj".format(cell[0], cell[1])
+        else:
+            cross_sections_file_name = "cross_sections.obj"
+        watch = time()
+
+        # the checkpoint batches of this batch, the numbers of the checkpoint batches go on over all batches
+        if checkpoint_manager is None:
+            parts = [(None, batch_coords)]
+        else:
+            parts = [(checkpoint_batch + j, batch_coords[first:first + CHECKPOINT_BATCH_SIZE]) for j, first in enumerate(range(0, len(batch_coords), CHECKPOINT_BATCH_SIZE))]
+            checkpoint_batch += len(parts)
+
+        n_written = 0
+        n_skipped = 0
+        tile_loaded = False
+        empty_tile = False
+        for batch, part_coords in parts:
+            state = None if checkpoint_manager is None else checkpoint_manager.get_batch_state(batch)
+
+            if state == "done":
+                # the receivers of a checkpoint batch that is written keep their numbers, the next receivers are numbered after them
+                for receiver_coords, number, path_count in checkpoint_manager.read_done(batch):
+                    xml_manager.receivers[receiver_coords] = (number, path_count)
+                    xml_manager.receiver_count = max(xml_manager.receiver_count, number + 1)
+                metrics.count("checkpoint_batches_skipped")
+                n_skipped += 1
+                continue
+
+            if state == "sections":
+                receiver_cross_sections = checkpoint_manager.read_sections(batch)
+                metrics.count("checkpoint_batches_read")
+            elif pool is not None:
+                receiver_cross_sections = stream_cross_sections_parallel(pool, n_workers, cell, part_coords, metrics)
+            else:
+                # the window of the tile is only loaded when a part of the tile has to be computed
+                if cell is not None and not tile_loaded:
+                    watch_stage = perf_counter()
+                    tin = tiled_tin.get_tile_window(cell)
+                    if tin is not None:
+                        tin.create_grid_index()
+                        tin.set_roof_heights(building_manager)
+                    tile_loaded = True
+                    empty_tile = tin is None
+                    metrics.add_time("tile_load", watch_stage)
+                if empty_tile:
+                    receiver_cross_sections = []
+                else:
+                    batch_receiver_manager = ReceiverManager()
+                    for receiver_coords in part_coords:
+                        batch_receiver_manager.receiver_points[receiver_coords] = receiver_manager.receiver_points[receiver_coords]
+                    receiver_cross_sections = stream_cross_sections(batch_receiver_manager, tin, ground_type_manager, building_manager, road_index, metrics)
+
+            # with a checkpoint the cross sections are saved before they are written, a run that stops while writing does not compute them again
+            if checkpoint_manager is not None and state is None:
+                receiver_cross_sections = list(receiver_cross_sections)
+                checkpoint_manager.write_sections(batch, receiver_cross_sections)
+
+            # without a checkpoint the cross sections are computed while they are written
+            write_batch_obj = write_obj and checkpoint_manager is None and not empty_tile
+            n_written += write_cross_sections(receiver_cross_sections, xml_manager, output_folders, metrics, cross_sections_file_name if write_batch_obj else None)
+
+            if checkpoint_manager is not None:
+                checkpoint_manager.write_done(batch, [(receiver_coords,) + xml_manager.receivers[receiver_coords] for receiver_coords, cross_sections in receiver_cross_sections])
+
+        # with a checkpoint the obj file of the batch is written once all its checkpoint batches are done, from their saved cross sections
+        if write_obj and checkpoint_manager is not None and not empty_tile:
+            write_cross_sections_obj([receiver for batch, part_coords in parts for receiver in checkpoint_manager.read_sections(batch)],
+                                     output_folder, metrics, cross_sections_file_name)
+
+        if n_skipped > 0:
+            print("skipped {} of {} checkpoint batches that were written before".format(n_skipped, len(parts)))
+        print("ran and wrote cross sections of {} receivers in: {:.2f} seconds".format(n_written, time() - watch))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    # the changed receivers of an incremental run that have no paths anymore, their paths of the previous run are removed
+    for receiver_coords, (number, path_count) in xml_manager.receiver_numbers.items():
+        if receiver_coords not in xml_manager.receivers:
+            xml_manager.remove_receiver_xml_files(number, path_count, output_folders)
+
+    # write the receivers to a text file so the receiver location can be retrieved after analyzing the xml file.
+    xml_manager.write_receiver_dict(output_folder)
+
+    # keep the records of the computed receivers for the next incremental run, a receiver without paths gets number -1
+    if dependency_manager is not None:
+        records = [xml_manager.receivers.get(receiver_coords, (-1, 0)) for receiver_coords in receivers_coords]
+        dependency_manager.add_receivers(receivers_coords, [number for number, path_count in records], [path_count for number, path_count in records])
+        dependency_manager.write_state("{}/{}".format(output_folder, DEPENDENCIES_FILE_NAME))
+
+    # the run is complete, its checkpoint is not needed anymore
+    if checkpoint_manager is not None:
+        checkpoint_manager.remove()
+        if not os.listdir(checkpoint_manager.folder):
+            os.rmdir(checkpoint_manager.folder)
+
+    # write the time of every stage and the counters next to the outputs, the stage times of workers are summed over the workers
+    metrics.timers["total"] = time() - start
+    metrics.write_json("{}/{}".format(output_folder, METRICS_FILE_NAME), {
+        "constrained_tin": constraint_tin_file_path,
+        "semantics": building_and_ground_file_path,
+        "receivers": receiver_point_file_path,
+        "sources": road_lines_file_path,
+        "options": options,
+        "workers": n_workers
+    })
     
     print("total runtime in: {}".format(time() - start))
 
 
 if __name__ == "__main__":
-    main(sys.argv)
\ No newline at end of file
+    main(sys.argv)
@@ -0,0 +1,73 @@
+import json
+
+from time import perf_counter
+
+class MetricsManager:
+
+    def __init__(self):
+        # the seconds spent per stage and the counters, both are summed over batches (and over workers)
+        self.timers = {}
+        self.counters = {}
+
+    def add_time(self, stage, watch):
+        """
+        Explanation: Adds the time since watch to a stage, and returns the current time so the next stage can start from it
+        ---------------
+        Input:
+            stage : string - the name of the stage
+            watch : float - the perf_counter() value at the start of the stage
+        ---------------
+        Output:
+            float - perf_counter() at the end of the stage
+        """
+        now = perf_counter()
+        self.timers[stage] = self.timers.get(stage, 0.0) + (now - watch)
+        return now
+
+    def count(self, counter, number=1):
+        """
+        Explanation: Adds a number to a counter
+        ---------------
+        Input:
+            counter : string - the name of the counter
+            number : integer - the number to add
+        ---------------
+        Output:
+            void
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + number
+
+    def merge(self, metrics):
+        """
+        Explanation: Adds the timers and counters of another MetricsManager, for example of a worker process
+        ---------------
+        Input:
+            metrics : MetricsManager - the metrics to add
+        ---------------
+        Output:
+            void
+        """
+        for stage, seconds in metrics.timers.items():
+            self.timers[stage] = self.timers.get(stage, 0.0) + seconds
+        for counter, number in metrics.counters.items():
+            self.count(counter, number)
+
+    def write_json(self, file_path, run_information):
+        """
+        Explanation: Writes the timers and counters to a json file
+        ---------------
+        Input:
+            file_path : string - the path of the json file
+            run_information : dictionary - extra information about the run, like the input files and options
+        ---------------
+        Output:
+            void (writes the json file)
+        """
+        report = {
+            "run": run_information,
+            "timers": {stage: round(seconds, 6) for stage, seconds in self.timers.items()},
+            "counters": self.counters
+        }
+        with open(file_path, "w") as f:
+            json.dump(report, f, indent=4)
+            f.write("\n")
@@ -3,6 +3,12 @@ import math
 import numpy as np
 import xml.etree.cElementTree as ET
 
+# materials of the cross sections, the codes index MATERIAL_NAMES
+MATERIAL_NAMES = ["G", "C", "A0"]
+MATERIAL_G = 0
+MATERIAL_C = 1
+MATERIAL_A0 = 2
+
 def normal_of_triangle(triangle):
 
     x0, y0, z0 = triangle[0]
@@ -107,6 +113,28 @@ def x_line_intersect(line1, line2):
                 line2[0][0] - line2[1][0])
     return [num_x / denom, num_y / denom]
 
+def x_line_intersect_array(point, line_ends, segments):
+    """
+    Explanation: x_line_intersect for many lines at once, the lines from one point to each line end are intersected with the segments.
+    The same arithmetic is used, so the points are the same as those of x_line_intersect.
+    ---------------
+    Input:
+    point : (x(float), y(float)) - the start of all lines
+    line_ends : np.ndarray (n, 2) - the end of each line
+    segments : np.ndarray (n, 2, 2) - the segment to intersect each line with
+    ---------------
+    Output:
+    np.ndarray (n, 2) - the intersection points
+    """
+    x0, y0 = point[0], point[1]
+    x1, y1 = line_ends[:, 0], line_ends[:, 1]
+    u0, v0, u1, v1 = segments[:, 0, 0], segments[:, 0, 1], segments[:, 1, 0], segments[:, 1, 1]
+    num_x = (x0 * y1 - y0 * x1) * (u0 - u1) - (x0 - x1) * (u0 * v1 - v0 * u1)
+    num_y = (x0 * y1 - y0 * x1) * (v0 - v1) - (y0 - y1) * (u0 * v1 - v0 * u1)
+    denom = (x0 - x1) * (v0 - v1) - (y0 - y1) * (u0 - u1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.stack((num_x / denom, num_y / denom), axis=1)
+
 def get_rotated_point(p1, p2, angle):
     """
     Explanation: A function that reads point p1 (centre), p2, and an angle and returns p2', i.e. the rotated point.
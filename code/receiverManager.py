@@ -1,4 +1,5 @@
 import fiona
+import numpy as np
 
 from receiverPoint import ReceiverPoint
 
@@ -7,15 +8,48 @@ class ReceiverManager:
     def __init__(self):
         self.receiver_points = {}
 
-    def read_receiver_points(self, file_path):
+    def read_receiver_points(self, file_path, sector_angle=None):
         with fiona.open(file_path) as shape: #Open the receiver points shapefile
             for elem in shape:
                 geometry = elem["geometry"]
                 rec_pt_coords = geometry["coordinates"]
                 rec_pt_coords = (rec_pt_coords[0], rec_pt_coords[1]) #Only take the first 2 coords. Needs to be 2d.
-                rec_pt = ReceiverPoint(rec_pt_coords)
+                rec_pt = ReceiverPoint(rec_pt_coords, sector_angle=sector_angle)
                 self.receiver_points[rec_pt_coords] = rec_pt
 
+    def locate_receivers(self, tin):
+        """
+        Explanation: Finds the triangle and ground height of all receivers at once, before any rays are cast.
+        Receivers inside a building, or outside the tin, are not valid and are removed.
+        ---------------
+        Input:
+            tin : GroundTin object - stores the DTM in a triangle datastructure
+        ---------------
+        Output:
+            void (sets the triangle and ground_height of the receivers, removes the invalid receivers)
+        """
+        if len(self.receiver_points) == 0:
+            return
+        receivers_coords = list(self.receiver_points.keys())
+        xy = np.array(receivers_coords)
+        triangles = tin.locate_points(xy)
+
+        valid = triangles != -1
+        valid[valid] = tin.building_index[triangles[valid]] == -1
+        heights = np.full(len(triangles), np.nan)
+        heights[valid] = tin.sample_heights(triangles[valid], xy[valid])
+
+        for receiver_coords, triangle, height, is_valid in zip(receivers_coords, triangles.tolist(), heights.tolist(), valid.tolist()):
+            if not is_valid:
+                del self.receiver_points[receiver_coords]
+                continue
+            rec_pt = self.receiver_points[receiver_coords]
+            rec_pt.triangle = triangle
+            rec_pt.ground_height = height
+
+        if not valid.all():
+            print("removed {} receivers that are in a building or outside the tin".format(np.count_nonzero(~valid)))
+
     def determine_source_points(self, source_lines):
         #Go through all the receiver points and get their possible source points
         for rec_pt_coords in self.receiver_points.keys():
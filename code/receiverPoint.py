@@ -2,24 +2,36 @@ import fiona
 import math
 import numpy as np
 import xml.etree.cElementTree as ET
-from misc import get_rotated_point, x_line_intersect
+from misc import get_rotated_point, x_line_intersect_array
 
-from sourcePoint import SourcePoint
+from sourceTable import SourceTable
 
-from shapely.geometry import Polygon, LineString, Point
+from shapely.geometry import Polygon, Point
 
 CNOSSOS_RADIUS = 2000.0
 CNOSSOS_ANGLE = 2.0
+# the angular interval of a road segment is widened by this (in radians) before the rays in it are taken, for the rounding of the angles
+RAY_ANGLE_MARGIN = 10 ** (-7)
+# a road segment with an end point this close to the receiver is intersected with all rays
+RAY_ORIGIN_DISTANCE = 10 ** (-3)
+# the size (in degrees) of the coarsest sectors of the adaptive mode, sectors with roads are split in half down to the step angle
+CNOSSOS_SECTOR_ANGLE = 45.0
 
 class ReceiverPoint:
 
-    def __init__(self, receiver_coords, radius = CNOSSOS_RADIUS, step_angle = CNOSSOS_ANGLE):
+    def __init__(self, receiver_coords, radius = CNOSSOS_RADIUS, step_angle = CNOSSOS_ANGLE, sector_angle = None):
         self.receiver_coords = receiver_coords
         
         self.radius = radius
         self.step_angle = step_angle
+        # None casts every ray, otherwise only the rays in sectors with roads are cast (see get_rays_in_sectors)
+        self.sector_angle = sector_angle
 
-        self.source_points = {} #Source points per ray cast
+        self.sources = SourceTable(receiver_coords) #Source points of all rays cast, see SourceTable
+
+        # set by ReceiverManager.locate_receivers, the triangle of the tin the receiver is in and the height of the tin there
+        self.triangle = -1
+        self.ground_height = None
         
     def return_points_circle(self, radians):
         """
@@ -35,61 +47,156 @@ class ReceiverPoint:
         y_next = self.receiver_coords[1] + self.radius * math.sin(radians)
         return (x_next, y_next)
 
-    def find_intersection_points(self, road_lines):
+    def get_segment_intervals(self, segments):
+        """
+        Explanation: turns every road segment into the interval of angles it covers as seen from the receiver.
+        The interval goes from the start over the shortest arc and is widened by RAY_ANGLE_MARGIN, for the rounding of the angles.
+        It can end past 2 pi, a segment that passes through the receiver covers all angles.
+        ---------------
+        Input:
+        segments : np.ndarray (k, 2, 2) - the road segments
+        ---------------
+        Output:
+        np.ndarray (k,) - the lowest angle of every segment
+        np.ndarray (k,) - the highest angle of every segment
+        np.ndarray (k,) - True for the segments that pass through the receiver
+        """
+        delta_x = segments[:, :, 0] - self.receiver_coords[0]
+        delta_y = segments[:, :, 1] - self.receiver_coords[1]
+
+        # the angles of both end points, the interval goes from the start over the shortest arc
+        end_angles = np.mod(np.arctan2(delta_y, delta_x), 2.0 * math.pi)
+        span = np.mod(end_angles[:, 1] - end_angles[:, 0], 2.0 * math.pi)
+        start = np.where(span <= math.pi, end_angles[:, 0], end_angles[:, 1])
+        span = np.where(span <= math.pi, span, 2.0 * math.pi - span)
+
+        through_receiver = (span > math.pi - RAY_ANGLE_MARGIN) | (np.hypot(delta_x, delta_y).min(axis=1) < RAY_ORIGIN_DISTANCE)
+        return start - RAY_ANGLE_MARGIN, start + span + RAY_ANGLE_MARGIN, through_receiver
+
+    def get_ray_segment_pairs(self, angles, segments):
+        """
+        Explanation: the angular interval sweep, finds for every road segment the rays that can cross it.
+        Every segment is turned into the interval of angles it covers as seen from the receiver (see get_segment_intervals),
+        and the sorted ray angles that fall into this interval are taken. A segment that passes through the receiver covers all rays.
+        ---------------
+        Input:
+        angles : np.ndarray (r,) - the sorted angles of the rays, in [0, 2 pi)
+        segments : np.ndarray (k, 2, 2) - the road segments
+        ---------------
+        Output:
+        np.ndarray (n,) - the ray of every pair
+        np.ndarray (n,) - the segment (index in segments) of every pair, the pairs are sorted per ray and then per segment
+        """
+        n_rays = len(angles)
+        low, high, through_receiver = self.get_segment_intervals(segments)
+
+        # the rays in each interval, the ray angles are repeated one turn before and after so the intervals do not wrap around
+        extended_angles = np.concatenate((angles - 2.0 * math.pi, angles, angles + 2.0 * math.pi))
+        first = np.searchsorted(extended_angles, low, side="left")
+        last = np.searchsorted(extended_angles, high, side="right")
+
+        first[through_receiver] = n_rays
+        last[through_receiver] = 2 * n_rays
+
+        # expand the intervals to (ray, segment) pairs, sorted per ray
+        counts = last - first
+        pair_segments = np.repeat(np.arange(len(segments)), counts)
+        pair_rays = (np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())) % n_rays
+        order = np.lexsort((pair_segments, pair_rays))
+        return pair_rays[order], pair_segments[order]
+
+    def get_rays_in_sectors(self, angles, segments):
         """
-        Explanation: for every line segment of the receiver an intersection per line segment of the source is checked
+        Explanation: the hierarchical refinement of the adaptive mode, finds the rays that point at a road segment.
+        The rays are split into sectors of about sector_angle degrees. A sector that no segment interval overlaps is skipped
+        with all its rays, a sector with roads is split in half, until the sectors are single rays.
+        The overlap test of a single ray is the same as the one of get_ray_segment_pairs, so no ray that can cross a road is skipped.
         ---------------
         Input:
-        void
+        angles : np.ndarray (r,) - the sorted angles of the rays, in [0, 2 pi)
+        segments : np.ndarray (k, 2, 2) - the road segments
         ---------------
         Output:
-        dictionary : a list of source points (intersection points) are saved as a value to the receiver point as a key
-        in a dictionary
+        np.ndarray - the indices of the rays (in angles) in the sectors with roads, sorted
         """
+        n_rays = len(angles)
+        low, high, through_receiver = self.get_segment_intervals(segments)
+        if len(segments) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if through_receiver.any():
+            return np.arange(n_rays)
+        low = np.sort(low)
+        high = np.sort(high)
+
+        # the sectors are ranges of rays [first, last), so the rays stay on the angles of the fixed step
+        n_sectors = min(n_rays, int(math.ceil(360.0 / self.sector_angle)))
+        bounds = np.linspace(0, n_rays, n_sectors + 1).round().astype(np.int64)
+        first, last = bounds[:-1], bounds[1:]
+        rays = []
+
+        while len(first) > 0:
+            # an interval overlaps [a, b] if it starts before b and does not end before a, also checked one turn later
+            sector_low = angles[first]
+            sector_high = angles[last - 1]
+            overlaps = np.zeros(len(first), dtype=bool)
+            for turn in (0.0, 2.0 * math.pi):
+                overlaps |= np.searchsorted(low, sector_high + turn, side="right") > np.searchsorted(high, sector_low + turn, side="left")
+            first, last = first[overlaps], last[overlaps]
+
+            single = (last - first) == 1
+            rays.append(first[single])
+            first, last = first[~single], last[~single]
+
+            # split the other sectors in half
+            middle = (first + last) // 2
+            first, last = np.concatenate((first, middle)), np.concatenate((middle, last))
 
-        #for rcvr in self.receiver_points:
+        return np.sort(np.concatenate(rays))
+
+    def find_intersection_points(self, road_index):
+        """
+        Explanation: for every line segment of the receiver an intersection per line segment of the source is checked.
+        The road segments within the radius are taken once, and only the rays within the angles of each segment are intersected with it,
+        see get_ray_segment_pairs and RoadIndex.intersect_pairs. In the adaptive mode (sector_angle is set) the empty sectors around
+        the receiver are skipped first. The rays that are cast keep the step angle, so the left and right lengths of the sources do not change.
+        ---------------
+        Input:
+        road_index : RoadIndex - the road segments
+        ---------------
+        Output:
+        integer : the number of rays cast (the source points (intersection points) of all rays are saved in self.sources)
+        """
         step_angle_radians = math.radians(self.step_angle)
-        for angle in np.arange(0, (2.0 * math.pi), step_angle_radians):
-            #Get the end point of the line at this angle from the receiver to the edge of the receiver's area
-            following = self.return_points_circle(angle)
-
-            #Create a line from receiver to end point
-            current_receiver_line = LineString((self.receiver_coords, following))
-
-            # Find roads within a certain buffer from ray
-            query_geom = current_receiver_line.buffer(1)  # 1 m buffer around ray
-            chosen_roads = road_lines.query(query_geom)
-            
-            list_intersection_per_ray = []
-            #Check all line segments for intersection points from this angle
-            for struct_line in chosen_roads:
-                if current_receiver_line.intersects(struct_line):
-                    point_intersection = current_receiver_line.intersection(struct_line)
-                    source_coords = list(point_intersection.coords)[0]
-                    source_pt = SourcePoint(source_coords)
-                    list_intersection_per_ray.append(source_pt)
-                    
-                    #Calculate the left and right segment length
-                    # find the point on the radius circle for 1 degree left and right ( can be optimized more)
-                    point_left = self.return_points_circle(angle + (step_angle_radians / 2.0))
-                    point_right = self.return_points_circle(angle - (step_angle_radians / 2.0))
-
-                    # make a (virtual) intersection with the same road element on both sides
-                    point_left = np.array(x_line_intersect([self.receiver_coords, point_left], struct_line.coords))
-                    point_right = np.array(x_line_intersect([self.receiver_coords, point_right], struct_line.coords))
-
-                    # Get the vector (length) of the line between the left and right point
-                    vector = point_left - point_right
-                    segment_length = (vector[0] ** 2 + vector[1] ** 2) ** 0.5
-
-                    #Set the segment lengths
-                    source_pt.left_length = segment_length / 2
-                    source_pt.right_length = segment_length / 2
-            
-            #If at least 1 intersection point was found, store it.
-            if len(list_intersection_per_ray) >= 1:
-                #Sort the interection points based on how far they are from the receiver point
-                sorted_list_intersection = sorted(list_intersection_per_ray, key=lambda point: (
-                                            (point.source_coords[0] - self.receiver_coords[0]) ** 2 + (point.source_coords[1] - self.receiver_coords[1]) ** 2) ** 0.5)
-
-                self.source_points[following] = sorted_list_intersection
+        angles = np.arange(0, (2.0 * math.pi), step_angle_radians)
+        ray_ids = np.arange(len(angles))
+
+        segment_ids = road_index.get_segments_near(self.receiver_coords, self.radius)
+        segments = road_index.segments[segment_ids].reshape(-1, 2, 2)
+        if self.sector_angle is not None:
+            ray_ids = self.get_rays_in_sectors(angles, segments)
+            angles = angles[ray_ids]
+
+        #Get the end point of the line at each angle from the receiver to the edge of the receiver's area,
+        # and the points on the radius circle half a step left and right of it
+        ray_ends = np.array([self.return_points_circle(angle) for angle in angles]).reshape(-1, 2)
+        left_ends = np.array([self.return_points_circle(angle + (step_angle_radians / 2.0)) for angle in angles]).reshape(-1, 2)
+        right_ends = np.array([self.return_points_circle(angle - (step_angle_radians / 2.0)) for angle in angles]).reshape(-1, 2)
+
+        #Check the line segments within reach for intersection points with the rays that point at them
+        pair_rays, pair_segments = self.get_ray_segment_pairs(angles, segments)
+        hit, pair_points = road_index.intersect_pairs(self.receiver_coords, ray_ends[pair_rays], segment_ids[pair_segments])
+        rays = pair_rays[hit]
+        intersection_points = pair_points[hit]
+
+        # make a (virtual) intersection with the same road element on both sides (misc.x_line_intersect for all intersections)
+        road_segments = segments[pair_segments[hit]]
+        point_left = x_line_intersect_array(self.receiver_coords, left_ends[rays], road_segments)
+        point_right = x_line_intersect_array(self.receiver_coords, right_ends[rays], road_segments)
+
+        # the length of road a source stands for, half of it on each side of the ray
+        vectors = point_left - point_right
+        segment_lengths = np.sqrt(vectors[:, 0] ** 2 + vectors[:, 1] ** 2)
+
+        self.sources = SourceTable(self.receiver_coords, intersection_points, ray_ids[rays], segment_lengths)
+
+        return len(angles)
@@ -6,36 +6,33 @@ class ReflectionManager:
     def __init__(self):
         self.reflection_paths = {}
     
-    def get_reflection_path(self, receiver_coords, source_list_per_ray, building_manager, tin, minimal_height_difference):
+    def get_reflection_path(self, receiver_coords, sources, building_manager, tin, minimal_height_difference, metrics=None):
         """
-        Explanation: Finds cross-sections between the receiver and all source points in the source_list_per_ray dictionary.
+        Explanation: Finds cross-sections between the receiver and all source points in the source table.
         ---------------
         Input:
             receiver_coords : (x,y,z) - the receiver point we walk from
-            source_list_per_ray : {(ray_end): [source_points]} - A dictionary where all the source points are listed per outgoing ray from the receiver
+            sources : SourceTable - the source points of all outgoing rays from the receiver
             building_manager : BuildingManager - The manager that holds all the building information
+            metrics : MetricsManager - counts the accepted and rejected reflections, optional
         ---------------
         Output:
-            void (fills self.reflection_paths with a list of paths)
+            void (fills self.reflection_paths[receiver_coords] with the path of every source id with a reflection)
         """
 
-        # Loop through all the source po ints from all outgoing rays from the receiver
-        for ray_end_point, source_point_list in source_list_per_ray.items():
-            # Loop through all the source points from one outoing ray from the receiver
-            for source_point in source_point_list:
+        # Loop through all the source points from all outgoing rays from the receiver
+        for source_id, source_coords in enumerate(sources.coords.tolist()):
 
-                # Create a reflection path from source to receiver and get all possible reflections
-                reflection_object = ReflectionPath(source_point, receiver_coords)
-                at_least_one_reflection = reflection_object.get_first_order_reflection(building_manager, tin, minimal_height_difference)
+            # Create a reflection path from source to receiver and get all possible reflections
+            reflection_object = ReflectionPath(tuple(source_coords), receiver_coords)
+            at_least_one_reflection = reflection_object.get_first_order_reflection(building_manager, tin, minimal_height_difference, metrics=metrics)
 
-                # If at least 1 reflection was found, store it
-                if at_least_one_reflection:
-                    if receiver_coords not in self.reflection_paths.keys():
-                        self.reflection_paths[receiver_coords] = {}
-                    if ray_end_point not in self.reflection_paths[receiver_coords].keys():
-                        self.reflection_paths[receiver_coords][ray_end_point] = {}
+            # If at least 1 reflection was found, store it
+            if at_least_one_reflection:
+                if receiver_coords not in self.reflection_paths.keys():
+                    self.reflection_paths[receiver_coords] = {}
 
-                    self.reflection_paths[receiver_coords][ray_end_point][source_point.source_coords] = reflection_object
+                self.reflection_paths[receiver_coords][source_id] = reflection_object
     
     def get_reflection_paths(self, source_receivers_dict, building_manager, tin, minimal_height_difference):
         """
@@ -51,5 +48,5 @@ class ReflectionManager:
             void (fills self.paths with a list of paths)
         """
         for receiver_coords, receiver in source_receivers_dict.items():
-            self.get_reflection_path(receiver_coords, receiver.source_points, building_manager, tin, minimal_height_difference)
+            self.get_reflection_path(receiver_coords, receiver.sources, building_manager, tin, minimal_height_difference)
 
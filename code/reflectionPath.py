@@ -8,8 +8,8 @@ from shapely.geometry import shape, Point
 
 class ReflectionPath:
 
-    def __init__(self, source, receiver):
-        self.source = source #A SourcePoint instance
+    def __init__(self, source_coords, receiver):
+        self.source_coords = source_coords #Source coordinates
         self.receiver = receiver #Receiver coordinates
 
         # now storing this here.
@@ -18,7 +18,7 @@ class ReflectionPath:
 
     def get_mirror_point(self, line_parameters, point=False):
         """
-        Explanation: A function that reads the self.source point and the parameters of a line and returns the mirror point of p1 regarding this line.
+        Explanation: A function that reads the self.source_coords point and the parameters of a line and returns the mirror point of p1 regarding this line.
         ---------------
         Input:
         parameters: [a_norm(float),b_norm(float),c_norm(float)] - The a,b,c parameters of the normalised line equation.
@@ -27,7 +27,7 @@ class ReflectionPath:
         p_mirror: [x(float),y(float)] - The image (virtual) point.
         """
         if point == False:
-            point = self.source.source_coords
+            point = self.source_coords
 
         # THE SIGNED DISTANCE D FROM P1 TO THE LINE L, I.E. THE ONE WITH THE PARAMETERS.
         d = line_parameters[0] * point[0] + line_parameters[1] * point[1] + line_parameters[2]
@@ -35,17 +35,30 @@ class ReflectionPath:
         p_mirror_y = point[1] - 2 * line_parameters[1] * d
         return [p_mirror_x, p_mirror_y]
 
-    def check_validity(self, building_id, building_manager, tin, reflection_point, building_height, minimal_height_difference):
-        triangle_index_building = np.where(tin.attributes == building_id)
-        triangle_index_building = triangle_index_building[0][0]
-        #print("random tr index of building: {}".format(triangle_index_building))
-        # find the triangle where the reflection point is in (it is on the line though.)
-        reflection_triangle = tin.find_receiver_triangle(triangle_index_building, reflection_point)
-        #print("correct tr of building: {}".format(tin.attributes[reflection_triangle]))
+    def locate_reflection_points(self, candidates, tin):
+        """
+        Explanation: Finds the triangles of all candidate reflection points at once.
+        Each walk starts from the grid index of the tin, or without one from a triangle of the building the reflection point lies on.
+        ---------------
+        Input:
+        candidates : list of (building_id, building, reflection_point) - the candidate reflections
+        tin : GroundTin object - stores the DTM in a triangle datastructure
+        ---------------
+        Output:
+        np.ndarray - for each candidate the triangle id, -1 if it could not be found
+        """
+        reflection_points = np.array([reflection_point for building_id, building, reflection_point in candidates])
+        if tin.grid is not None:
+            return tin.locate_points(reflection_points)
+        start_triangles = [tin.get_building_triangles(tin.get_building_index(building_id))[0] for building_id, building, reflection_point in candidates]
+        return tin.locate_points(reflection_points, start_triangles)
+
+    def check_validity(self, building_id, building_manager, tin, reflection_point, reflection_triangle, building_height, minimal_height_difference):
+        # reflection_triangle is the triangle where the reflection point is in (it is on the line though.)
 
         # can be either on the building side, or on the outerside
         # If the triangle is on the inside, get the triangle on the outside
-        if(tin.attributes[reflection_triangle] == building_id):
+        if(tin.building_index[reflection_triangle] == tin.get_building_index(building_id)):
             #print("triangle is on inside")
             # the triangle is on the inside of the building
             # now get neighbor
@@ -63,12 +76,12 @@ class ReflectionPath:
             nbs = [5, 3, 4]
             reflection_triangle = tin.trs[reflection_triangle][nbs[neighbor]]
 
-        #print("triangle type on outside: {}".format(tin.attributes[reflection_triangle]))
+        #print("triangle type on outside: {}".format(tin.material_codes[reflection_triangle]))
         # we should have the correct triangle at hand
-        if(tin.attributes[reflection_triangle][0] == 'b'):
+        if(tin.building_index[reflection_triangle] != -1):
             #print("other triangle is building")
             # it is a building
-            outside_building_height = building_manager.buildings[tin.attributes[reflection_triangle]].roof_level
+            outside_building_height = tin.roof_heights[reflection_triangle]
             if(building_height - outside_building_height > minimal_height_difference):
                 # building is atleast 20 centimeters higher then
                 return True
@@ -86,13 +99,14 @@ class ReflectionPath:
                 return True
         return False
 
-    def get_first_order_reflection(self, building_manager, tin, minimal_height_difference, radius_buffer=2000):
+    def get_first_order_reflection(self, building_manager, tin, minimal_height_difference, radius_buffer=2000, metrics=None):
         """
         Explanation: A function that reads a buildings_dict and computes all possible first-ORDER reflection paths,
         according to the receivers and sources that are provided from main.py
         ---------------
         Input:
         buildings_dict : BuildingManager object - stores all the building objects
+        metrics : MetricsManager - counts the accepted reflections and the rejected ones per test, optional
         ---------------
         Output:
         Stores reflection points, and their corresponding heights in the class.
@@ -100,6 +114,9 @@ class ReflectionPath:
         """
         query_geom = Point(self.receiver).buffer(radius_buffer)  # 2000 m buffer around receiver
         chosen_buildings = building_manager.buildings_tree.query(query_geom)
+        candidates = []
+        # the number of walls rejected by each test, added to the metrics at the end
+        rejected_side = rejected_intersection = rejected_distance = rejected_size = rejected_outside_tin = rejected_validity = 0
         for chosen_building in chosen_buildings:
             building_id = building_manager.polygon_id_to_building_id[id(chosen_building)]
             building = building_manager.buildings[building_id]
@@ -111,7 +128,7 @@ class ReflectionPath:
             
             for wall_id, wall in enumerate(building.walls):
                 test_r = misc.side_test(wall[0], wall[1], self.receiver)
-                test_s = misc.side_test(wall[0], wall[1], self.source.source_coords)
+                test_s = misc.side_test(wall[0], wall[1], self.source_coords)
 
                 # COS: Not sure if this is actually true!!!!
                 if test_r > 0 and test_s > 0:  # This statement guarantees that the source and receiver are both on the outer side of the wall
@@ -144,11 +161,41 @@ class ReflectionPath:
                                 is_right_valid = self.check_relative_size(wall_adjusted_order_right, building, right_point)
 
                                 if is_right_valid:
-                                    # Check if reflection is valid, ie if there is no other taller building in front.
-                                    if(self.check_validity(building_id, building_manager, tin, reflection_point, building.roof_level, minimal_height_difference)):
-                                        # If the reflection object is of sufficient size, and the reflection is valid, store it
-                                        self.reflection_points.append([reflection_point])
-                                        self.reflection_heights.append([building.roof_level])
+                                    # The reflection object is of sufficient size, check its validity for all candidates at once
+                                    candidates.append((building_id, building, reflection_point))
+                                else:
+                                    rejected_size += 1
+                            else:
+                                rejected_size += 1
+                        else:
+                            rejected_distance += 1
+                    else:
+                        rejected_intersection += 1
+                else:
+                    rejected_side += 1
+
+        if len(candidates) > 0:
+            reflection_triangles = self.locate_reflection_points(candidates, tin)
+            for (building_id, building, reflection_point), reflection_triangle in zip(candidates, reflection_triangles):
+                if reflection_triangle == -1:
+                    rejected_outside_tin += 1
+                    continue
+                # Check if reflection is valid, ie if there is no other taller building in front.
+                if(self.check_validity(building_id, building_manager, tin, reflection_point, reflection_triangle, building.roof_level, minimal_height_difference)):
+                    # If the reflection is valid, store it
+                    self.reflection_points.append([reflection_point])
+                    self.reflection_heights.append([building.roof_level])
+                else:
+                    rejected_validity += 1
+
+        if metrics is not None:
+            metrics.count("reflections_accepted", len(self.reflection_points))
+            metrics.count("reflections_rejected_side", rejected_side)
+            metrics.count("reflections_rejected_intersection", rejected_intersection)
+            metrics.count("reflections_rejected_distance", rejected_distance)
+            metrics.count("reflections_rejected_size", rejected_size)
+            metrics.count("reflections_rejected_outside_tin", rejected_outside_tin)
+            metrics.count("reflections_rejected_validity", rejected_validity)
 
         if len(self.reflection_points) > 0:
             return True
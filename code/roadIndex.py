@@ -0,0 +1,163 @@
+import numpy as np
+
+from shapely.geometry import LineString
+
+# an orientation is only trusted if the determinant is larger than this part of its terms, as the filter of GEOS
+ORIENTATION_ERROR_BOUND = 10 ** (-14)
+# the default size of the grid cells the road segments are binned into, in meters
+ROAD_CELL_SIZE = 250.0
+
+class RoadIndex:
+
+    def __init__(self, segments, cell_size=ROAD_CELL_SIZE):
+        """
+        Stores the road segments as an (m, 2, 2) array, and bins their bounding boxes into a uniform grid.
+        The segments of each cell are stored one cell after the other (row by row), so a query reads one slice per grid row.
+        """
+        self.segments = np.asarray(segments, dtype=np.float64).reshape(-1, 2, 2)
+        self.bounding_box_min = self.segments.min(axis=1)
+        self.bounding_box_max = self.segments.max(axis=1)
+
+        self.cell_size = float(cell_size)
+        self.origin = self.bounding_box_min.min(axis=0) if len(self.segments) else np.zeros(2)
+        extent = self.bounding_box_max.max(axis=0) - self.origin if len(self.segments) else np.zeros(2)
+        self.shape = np.floor(extent / self.cell_size).astype(np.int64) + 1
+
+        # expand every segment into one entry per overlapped cell, then sort the entries per cell
+        cell_min = self.get_cells(self.bounding_box_min)
+        cell_max = self.get_cells(self.bounding_box_max)
+        n_x = cell_max[:, 0] - cell_min[:, 0] + 1
+        counts = n_x * (cell_max[:, 1] - cell_min[:, 1] + 1)
+        segment_index = np.repeat(np.arange(len(self.segments)), counts)
+        entry = np.arange(len(segment_index)) - (np.cumsum(counts) - counts)[segment_index]
+        cells = (cell_min[segment_index, 1] + entry // n_x[segment_index]) * self.shape[0] + cell_min[segment_index, 0] + entry % n_x[segment_index]
+
+        order = np.argsort(cells, kind="stable")
+        self.cell_segments = segment_index[order].astype(np.int64)
+        self.cell_start = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=int(self.shape[0] * self.shape[1])))))
+
+    def get_cells(self, xy):
+        """
+        Explanation: Get the (clipped) cell column and row of points.
+        ---------------
+        Input:
+            xy : np.ndarray (n, 2) - the points
+        ---------------
+        Output:
+            np.ndarray (n, 2) of integers - the column and row of the cell of each point
+        """
+        cells = np.floor((np.asarray(xy, dtype=np.float64) - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, self.shape - 1)
+
+    def get_segments_near(self, point, radius):
+        """
+        Explanation: Finds the road segments whose bounding box overlaps a square around a point
+        ---------------
+        Input:
+            point : (x, y) - the centre of the square
+            radius : float - half the size of the square
+        ---------------
+        Output:
+            np.ndarray - the ids of the segments, in the order they were read
+        """
+        query_min = np.array([point[0] - radius, point[1] - radius])
+        query_max = np.array([point[0] + radius, point[1] + radius])
+        if len(self.segments) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        (column_min, row_min), (column_max, row_max) = self.get_cells(np.array([query_min, query_max]))
+        rows = np.arange(row_min, row_max + 1) * self.shape[0]
+        candidates = np.unique(np.concatenate([self.cell_segments[self.cell_start[row + column_min]:self.cell_start[row + column_max + 1]] for row in rows]))
+
+        overlap = ((self.bounding_box_min[candidates] <= query_max) & (self.bounding_box_max[candidates] >= query_min)).all(axis=1)
+        return candidates[overlap]
+
+    def intersect_pairs(self, origin, ray_ends, segment_ids):
+        """
+        Explanation: Intersects pairs of a ray from an origin and a road segment at once.
+        A ray and a segment intersect if both end points of each are strictly on different sides of the other. The intersection
+        point is computed the same way as GEOS (shapely) does, relative to the middle of the overlap of both bounding boxes.
+        Pairs that touch, are collinear, or whose side tests are too close to 0 to be sure are intersected with shapely instead.
+        ---------------
+        Input:
+            origin : (x, y) - the start of all rays
+            ray_ends : np.ndarray (n, 2) - the end of the ray of each pair
+            segment_ids : np.ndarray (n,) - the segment of each pair
+        ---------------
+        Output:
+            np.ndarray (n,) - True where the ray and segment intersect
+            np.ndarray (n, 2) - the intersection points, only valid where they intersect
+        """
+        ray_ends = np.asarray(ray_ends, dtype=np.float64).reshape(-1, 2)
+        p1x, p1y = float(origin[0]), float(origin[1])
+        p2x, p2y = ray_ends[:, 0], ray_ends[:, 1]
+        segments = self.segments[segment_ids]
+        q1x, q1y = segments[:, 0, 0], segments[:, 0, 1]
+        q2x, q2y = segments[:, 1, 0], segments[:, 1, 1]
+
+        # the side of the segment end points relative to the ray, and of the ray end points relative to the segment
+        pq1, pq1_sure = get_orientation(p1x, p1y, p2x, p2y, q1x, q1y)
+        pq2, pq2_sure = get_orientation(p1x, p1y, p2x, p2y, q2x, q2y)
+        qp1, qp1_sure = get_orientation(q1x, q1y, q2x, q2y, p1x, p1y)
+        qp2, qp2_sure = get_orientation(q1x, q1y, q2x, q2y, p2x, p2y)
+
+        crossing = (pq1 * pq2 < 0) & (qp1 * qp2 < 0)
+        sure = pq1_sure & pq2_sure & qp1_sure & qp2_sure
+        # a side test that is surely positive (or negative) for both end points means the pair surely does not intersect
+        apart = ((pq1 * pq2 > 0) & pq1_sure & pq2_sure) | ((qp1 * qp2 > 0) & qp1_sure & qp2_sure)
+
+        # the intersection of the lines, as GEOS Intersection::intersection, conditioned by the middle of the overlapping boxes
+        min_x = np.maximum(np.minimum(p1x, p2x), np.minimum(q1x, q2x))
+        max_x = np.minimum(np.maximum(p1x, p2x), np.maximum(q1x, q2x))
+        min_y = np.maximum(np.minimum(p1y, p2y), np.minimum(q1y, q2y))
+        max_y = np.minimum(np.maximum(p1y, p2y), np.maximum(q1y, q2y))
+        mid_x = (min_x + max_x) / 2.0
+        mid_y = (min_y + max_y) / 2.0
+        a1x, a1y, a2x, a2y = p1x - mid_x, p1y - mid_y, p2x - mid_x, p2y - mid_y
+        b1x, b1y, b2x, b2y = q1x - mid_x, q1y - mid_y, q2x - mid_x, q2y - mid_y
+        px = a1y - a2y
+        py = a2x - a1x
+        pw = a1x * a2y - a2x * a1y
+        qx = b1y - b2y
+        qy = b2x - b1x
+        qw = b1x * b2y - b2x * b1y
+        with np.errstate(divide="ignore", invalid="ignore"):
+            w = px * qy - qx * py
+            x = (py * qw - qy * pw) / w + mid_x
+            y = (qx * pw - px * qw) / w + mid_y
+
+        # GEOS falls back to an end point if the point is outside the boxes, leave those to shapely as well
+        hit = crossing & sure
+        inside = (x >= np.minimum(p1x, p2x)) & (x <= np.maximum(p1x, p2x)) & (y >= np.minimum(p1y, p2y)) & (y <= np.maximum(p1y, p2y)) & \
+                 (x >= np.minimum(q1x, q2x)) & (x <= np.maximum(q1x, q2x)) & (y >= np.minimum(q1y, q2y)) & (y <= np.maximum(q1y, q2y))
+        unsure = ~(hit & inside) & ~apart
+        hit &= inside
+
+        # the pairs that can not be decided here
+        for pair in np.nonzero(unsure)[0].tolist():
+            ray_line = LineString(((p1x, p1y), tuple(ray_ends[pair])))
+            road_line = LineString(self.segments[segment_ids[pair]])
+            if ray_line.intersects(road_line):
+                point_intersection = ray_line.intersection(road_line)
+                hit[pair] = True
+                x[pair], y[pair] = list(point_intersection.coords)[0][:2]
+
+        return hit, np.stack((x, y), axis=1)
+
+def get_orientation(pax, pay, pbx, pby, pcx, pcy):
+    """
+    Explanation: The side of point c relative to the line from a to b, for arrays of points. As the orientation filter of GEOS,
+    the sign is only sure if the determinant is clearly larger than the rounding error of its terms.
+    ---------------
+    Input:
+        pax, pay, pbx, pby, pcx, pcy : np.ndarray or float - the coordinates of a, b and c
+    ---------------
+    Output:
+        np.ndarray - 1 if c is left of a -> b, -1 if it is right, 0 if it is on the line
+        np.ndarray - True where the sign is sure
+    """
+    det_left = (pax - pcx) * (pby - pcy)
+    det_right = (pay - pcy) * (pbx - pcx)
+    det = det_left - det_right
+    sure = np.abs(det) > ORIENTATION_ERROR_BOUND * (np.abs(det_left) + np.abs(det_right))
+    return np.sign(det), sure
@@ -1,9 +0,0 @@
-
-
-class SourcePoint:
-
-    def __init__(self, source_coords):
-        self.source_coords = source_coords
-
-        self.left_length = 0
-        self.right_length = 0
\ No newline at end of file
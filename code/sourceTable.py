@@ -0,0 +1,52 @@
+import numpy as np
+
+class SourceTable:
+
+    def __init__(self, receiver_coords, coords=(), rays=(), lengths=()):
+        """
+        Stores the sources (intersections of the rays with the roads) of a receiver as columns, one row per source.
+        The rows are sorted per ray and then by the distance to the receiver, a source is referred to by its row, the source id.
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        rays = np.asarray(rays, dtype=np.int32).reshape(-1)
+        lengths = np.asarray(lengths, dtype=np.float64).reshape(-1)
+        distances = np.sqrt((coords[:, 0] - receiver_coords[0]) ** 2 + (coords[:, 1] - receiver_coords[1]) ** 2)
+
+        # the sort is stable, sources at the same distance on a ray keep the order they were found in
+        order = np.lexsort((distances, rays))
+        self.coords = coords[order] # the (x, y) of every source
+        self.rays = rays[order] # the ray (index of its angle, a multiple of the step angle) every source is on
+        self.distances = distances[order] # the distance of every source to the receiver
+        self.lengths = lengths[order] # the length of road every source stands for, the left and right length together
+
+        # the sources of the i-th ray with sources are the rows ray_start[i] to ray_start[i + 1]
+        new_ray = np.ones(len(self.rays), dtype=bool)
+        new_ray[1:] = self.rays[1:] != self.rays[:-1]
+        self.ray_start = np.append(np.nonzero(new_ray)[0], len(self.rays))
+
+    def __len__(self):
+        return len(self.rays)
+
+    def get_ray_count(self):
+        """
+        Explanation: Returns the number of rays with at least one source
+        ---------------
+        Input:
+            void
+        ---------------
+        Output:
+            integer - the number of rays with sources
+        """
+        return len(self.ray_start) - 1
+
+    def get_furthest_sources(self):
+        """
+        Explanation: Returns the furthest source of every ray, the direct cross section of a ray is walked to this source
+        ---------------
+        Input:
+            void
+        ---------------
+        Output:
+            np.ndarray - the source id of the furthest source per ray, in the order of the rays
+        """
+        return self.ray_start[1:] - 1
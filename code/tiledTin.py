@@ -0,0 +1,359 @@
+import numpy as np
+import os
+
+from collections import OrderedDict
+from groundTin import GroundTin, BINARY_TIN_EXTENSION, get_binary_cache_path, get_binary_header, get_binary_offsets, read_binary_arrays, read_binary_header, read_from_objp
+from receiverPoint import CNOSSOS_RADIUS
+
+DEFAULT_TILE_SIZE = 2000.0
+# extra distance around the cnossos radius that is loaded, reflection points on walls can lie just outside the radius
+TILE_WINDOW_MARGIN = 250.0
+TILED_TIN_SUFFIX = "_tiled"
+TILE_TABLE_EXTENSION = ".tiles.npz"
+# the number of triangles handled at once while computing the tiles, this bounds the temporary memory
+TILE_CHUNK_SIZE = 1000000
+
+
+class TiledTin:
+
+    def __init__(self, file_path, reach=CNOSSOS_RADIUS + TILE_WINDOW_MARGIN, max_resident_tiles=None):
+        """
+        A tin that is split into square tiles, stored in a tile ordered binary tin file and a tile table.
+        The arrays are memory mapped, only the tiles around the receivers that are processed are read.
+        For a tile of receivers a window is made: a GroundTin of all tiles within reach, with the adjacency between them intact.
+        """
+        self.file_path = file_path
+        # the tiled file has no vertex triangle index, every window builds its own
+        self.vts, self.trs, self.attribute_codes, self.attribute_names, vertex_triangle_offsets, vertex_triangles, self.bounding_box_3d = \
+            read_binary_arrays(file_path)
+
+        with np.load(get_tile_table_path(file_path)) as tile_table:
+            self.tile_size = float(tile_table["tile_size"])
+            self.origin = tile_table["origin"]
+            self.shape = tile_table["shape"]
+            self.tile_cells = tile_table["tile_cells"]
+            self.tile_offsets = tile_table["tile_offsets"]
+            self.tile_bounding_boxes = tile_table["tile_bounding_boxes"]
+
+        self.reach = reach
+
+        # by default the tiles of two neighbouring windows fit, so moving to the next tile only reads one new row of tiles
+        if max_resident_tiles is None:
+            window_tiles = int(np.ceil(2 * reach / self.tile_size)) + 2
+            max_resident_tiles = window_tiles * (window_tiles + 1)
+        self.max_resident_tiles = max_resident_tiles
+        self.resident_tiles = OrderedDict()
+
+    def get_tile(self, tile):
+        """
+        Explanation: Get the triangles and vertices of a tile, read from the file if the tile is not resident.
+        The least recently used tile is dropped when there are too many resident tiles.
+        ---------------
+        Input:
+            tile : integer - the index of the tile in the tile table
+        ---------------
+        Output:
+            trs : np.ndarray (n, 6) - the triangles of the tile, with global vertex and neighbour ids
+            attribute_codes : np.ndarray (n,) - the attribute codes of the triangles, None if the tin has no attributes
+            vertex_ids : np.ndarray (m,) - the sorted global ids of the vertices of the tile
+            vts : np.ndarray (m, 3) - the vertices of the tile
+        """
+        if tile in self.resident_tiles:
+            self.resident_tiles.move_to_end(tile)
+            return self.resident_tiles[tile]
+
+        start, end = self.tile_offsets[tile], self.tile_offsets[tile + 1]
+        trs = np.array(self.trs[start:end])
+        attribute_codes = np.array(self.attribute_codes[start:end]) if self.attribute_codes is not None else None
+        vertex_ids = np.unique(trs[:, :3])
+        vts = np.array(self.vts[vertex_ids])
+
+        self.resident_tiles[tile] = (trs, attribute_codes, vertex_ids, vts)
+        while len(self.resident_tiles) > self.max_resident_tiles:
+            self.resident_tiles.popitem(last=False)
+
+        return self.resident_tiles[tile]
+
+    def get_window(self, bounding_box):
+        """
+        Explanation: Make a GroundTin of all tiles that overlap a bounding box.
+        The triangles and vertices get local ids, neighbours outside of the window become -1 (the border of the window).
+        ---------------
+        Input:
+            bounding_box : list - [min_x, min_y, max_x, max_y]
+        ---------------
+        Output:
+            GroundTin - the tin of the window, None if there are no triangles in the bounding box
+        """
+        boxes = self.tile_bounding_boxes
+        selected = np.nonzero((boxes[:, 0] <= bounding_box[2]) & (boxes[:, 2] >= bounding_box[0]) &
+                              (boxes[:, 1] <= bounding_box[3]) & (boxes[:, 3] >= bounding_box[1]))[0]
+        if len(selected) == 0:
+            return None
+
+        tiles = [self.get_tile(tile) for tile in selected]
+
+        # the tiles are stored in order, so the global triangle ids of the window are sorted
+        triangle_ids = np.concatenate([np.arange(self.tile_offsets[tile], self.tile_offsets[tile + 1]) for tile in selected])
+        trs = np.concatenate([tile[0] for tile in tiles])
+        vertex_ids, first = np.unique(np.concatenate([tile[2] for tile in tiles]), return_index=True)
+        vts = np.concatenate([tile[3] for tile in tiles])[first]
+
+        local_trs = np.empty(trs.shape, dtype=np.int32)
+        local_trs[:, :3] = np.searchsorted(vertex_ids, trs[:, :3])
+        neighbours = trs[:, 3:]
+        position = np.minimum(np.searchsorted(triangle_ids, neighbours), len(triangle_ids) - 1)
+        inside = (neighbours != -1) & (triangle_ids[position] == neighbours)
+        local_trs[:, 3:] = np.where(inside, position, -1)
+
+        attribute_codes = np.concatenate([tile[1] for tile in tiles]) if self.attribute_codes is not None else None
+        ground_tin = GroundTin(vts, local_trs, attribute_codes=attribute_codes, attribute_names=self.attribute_names)
+
+        ground_tin.bounding_box_3d = list(vts.min(axis=0)) + list(vts.max(axis=0))
+        ground_tin.bounding_box_2d = [ground_tin.bounding_box_3d[0], ground_tin.bounding_box_3d[1],
+                                      ground_tin.bounding_box_3d[3], ground_tin.bounding_box_3d[4]]
+
+        return ground_tin
+
+    def get_tile_window(self, cell):
+        """
+        Explanation: Make a GroundTin of a tile cell and everything within reach of it.
+        ---------------
+        Input:
+            cell : (integer, integer) - the column and row of the tile
+        ---------------
+        Output:
+            GroundTin - the tin of the window, None if there are no triangles within reach
+        """
+        tile_min = self.origin + np.array(cell) * self.tile_size
+        return self.get_window([tile_min[0] - self.reach, tile_min[1] - self.reach,
+                                tile_min[0] + self.tile_size + self.reach, tile_min[1] + self.tile_size + self.reach])
+
+    def group_points(self, xy):
+        """
+        Explanation: Group points by the tile they lie in, points outside the tin are put in the closest tile.
+        The tiles are ordered row by row, in alternating direction, so the next window overlaps most of the previous one.
+        ---------------
+        Input:
+            xy : np.ndarray (n, 2) - the points
+        ---------------
+        Output:
+            list of ((integer, integer), np.ndarray) - for every tile with points the cell and the indices of its points
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        if len(xy) == 0:
+            return []
+        cells = np.clip(np.floor((xy - self.origin) / self.tile_size).astype(np.int64), 0, self.shape - 1)
+        columns = np.where(cells[:, 1] % 2 == 0, cells[:, 0], self.shape[0] - 1 - cells[:, 0])
+        keys = cells[:, 1] * self.shape[0] + columns
+
+        order = np.argsort(keys, kind='stable')
+        starts = np.nonzero(np.r_[True, keys[order][1:] != keys[order][:-1]])[0]
+        groups = np.split(order, starts[1:])
+
+        return [((int(cells[group[0], 0]), int(cells[group[0], 1])), group) for group in groups]
+
+def get_tiled_tin_path(file_path):
+    """
+    Explination: The path of the tiled version of a tin file.
+    ---------------
+    Input:
+        file_path : string - The path to the objp or binary tin file.
+    ---------------
+    Output:
+        string - The path to the tiled binary tin file.
+    """
+    return os.path.splitext(file_path)[0] + TILED_TIN_SUFFIX + BINARY_TIN_EXTENSION
+
+def get_tile_table_path(file_path):
+    """
+    Explination: The path of the tile table that belongs to a tiled binary tin file.
+    ---------------
+    Input:
+        file_path : string - The path to the tiled binary tin file.
+    ---------------
+    Output:
+        string - The path to the tile table.
+    """
+    return os.path.splitext(file_path)[0] + TILE_TABLE_EXTENSION
+
+def get_triangle_tiles(vts, trs, origin, shape, tile_size):
+    """
+    Explination: Get the tile of the centroid of triangles, and the corners of the triangles.
+    ---------------
+    Input:
+        vts : np.ndarray (n, 3) - The vertices, it can be a memory map.
+        trs : np.ndarray (m, 6) - A chunk of the triangles.
+        origin : np.ndarray (2,) - The lower left corner of the tile grid.
+        shape : np.ndarray (2,) - The number of tile columns and rows.
+        tile_size : float - The size of the square tiles.
+    ---------------
+    Output:
+        keys : np.ndarray (m,) - The tile of each triangle, as row * columns + column.
+        corners : np.ndarray (m, 3, 2) - The (x, y) of the corners of each triangle.
+    """
+    corners = vts[np.asarray(trs[:, :3])][:, :, :2]
+    cells = np.clip(np.floor((corners.mean(axis=1) - origin) / tile_size).astype(np.int64), 0, shape - 1)
+    return cells[:, 1] * shape[0] + cells[:, 0], corners
+
+def write_tiled_tin(file_path, vts, trs, attribute_codes, attribute_names, tile_size):
+    """
+    Explination: Writes a tin as a tiled binary tin file and its tile table.
+    Every triangle belongs to the tile of its centroid, the triangles are sorted by tile and the vertices by first use,
+    so a tile is (almost) one contiguous block of the file. The neighbour ids are renumbered to the new order.
+    The tin is handled in chunks of TILE_CHUNK_SIZE triangles (or vertices): the triangles are counted per tile first, and then
+    scattered into the memory mapped output file. The new ids of the triangles and vertices are kept in temporary memory mapped
+    files, so only the chunks and the arrays per tile are in memory, also when the tin itself is memory mapped.
+    ---------------
+    Input:
+        file_path : string - The path to the tiled binary tin file.
+        vts : np.ndarray (n, 3) - The vertices.
+        trs : np.ndarray (m, 6) - The triangles, three vertex ids followed by three neighbour ids.
+        attribute_codes : np.ndarray (m,) - For each triangle the index of its attribute in attribute_names, or None.
+        attribute_names : np.ndarray (k,) of strings - The unique attributes of the tin, or None.
+        tile_size : float - The size of the square tiles.
+    ---------------
+    Output: void
+    """
+    n_vts = len(vts)
+    n_trs = len(trs)
+    if attribute_codes is None:
+        attribute_codes = np.zeros(0, dtype=np.int32)
+    if attribute_names is None:
+        attribute_names = np.zeros(0, dtype=str)
+    attribute_names = np.asarray(attribute_names, dtype=np.bytes_)
+
+    # the 3d bounding box of the vertices, it also sets the tile grid
+    bounding_box_min = np.full(3, np.inf)
+    bounding_box_max = np.full(3, -np.inf)
+    for start in range(0, n_vts, TILE_CHUNK_SIZE):
+        chunk = np.asarray(vts[start:start + TILE_CHUNK_SIZE])
+        bounding_box_min = np.minimum(bounding_box_min, chunk.min(axis=0))
+        bounding_box_max = np.maximum(bounding_box_max, chunk.max(axis=0))
+    bounding_box_3d = list(bounding_box_min) + list(bounding_box_max) if n_vts > 0 else [0.0] * 6
+
+    origin = bounding_box_min[:2] if n_vts > 0 else np.zeros(2)
+    extent = bounding_box_max[:2] - origin if n_vts > 0 else np.zeros(2)
+    shape = np.floor(extent / tile_size).astype(np.int64) + 1
+    n_tiles = int(shape[0] * shape[1])
+
+    # first pass: the number of triangles and the bounding box of every tile
+    tile_counts = np.zeros(n_tiles, dtype=np.int64)
+    tile_bounding_boxes = np.empty((n_tiles, 4))
+    tile_bounding_boxes[:, :2] = np.inf
+    tile_bounding_boxes[:, 2:] = -np.inf
+    for start in range(0, n_trs, TILE_CHUNK_SIZE):
+        keys, corners = get_triangle_tiles(vts, trs[start:start + TILE_CHUNK_SIZE], origin, shape, tile_size)
+        order = np.argsort(keys, kind='stable')
+        chunk_keys, chunk_starts = np.unique(keys[order], return_index=True)
+        tile_counts += np.bincount(keys, minlength=n_tiles)
+        tile_bounding_boxes[chunk_keys, :2] = np.minimum(tile_bounding_boxes[chunk_keys, :2], np.minimum.reduceat(corners.min(axis=1)[order], chunk_starts, axis=0))
+        tile_bounding_boxes[chunk_keys, 2:] = np.maximum(tile_bounding_boxes[chunk_keys, 2:], np.maximum.reduceat(corners.max(axis=1)[order], chunk_starts, axis=0))
+    tile_starts = np.concatenate(([0], np.cumsum(tile_counts)))
+
+    # the output file is made at its full size, and its arrays are filled through memory maps
+    header = get_binary_header(n_vts, n_trs, len(attribute_codes), attribute_names, bounding_box_3d)
+    offsets, end = get_binary_offsets(header[0])
+    temp_file_path = file_path + ".tmp"
+    with open(temp_file_path, 'wb') as output_file:
+        header.tofile(output_file)
+        output_file.seek(offsets[3])
+        attribute_names.tofile(output_file)
+        output_file.truncate(end)
+    tiled_vts = np.memmap(temp_file_path, dtype="<f8", mode='r+', offset=offsets[0], shape=(n_vts, 3))
+    tiled_trs = np.memmap(temp_file_path, dtype="<i4", mode='r+', offset=offsets[1], shape=(n_trs, 6))
+    tiled_attribute_codes = np.memmap(temp_file_path, dtype="<i4", mode='r+', offset=offsets[2], shape=(len(attribute_codes),))
+    new_triangle_ids = np.memmap(file_path + ".triangle_ids.tmp", dtype=np.int64, mode='w+', shape=(n_trs,))
+    new_vertex_ids = np.memmap(file_path + ".vertex_ids.tmp", dtype=np.int64, mode='w+', shape=(n_vts,))
+
+    # second pass: the triangles of a tile are stored after each other, in the order they had
+    tile_fill = tile_starts[:-1].copy()
+    for start in range(0, n_trs, TILE_CHUNK_SIZE):
+        end = min(start + TILE_CHUNK_SIZE, n_trs)
+        keys, corners = get_triangle_tiles(vts, trs[start:end], origin, shape, tile_size)
+        order = np.argsort(keys, kind='stable')
+        chunk_keys, chunk_starts, chunk_counts = np.unique(keys[order], return_index=True, return_counts=True)
+        triangle_ids = np.empty(end - start, dtype=np.int64)
+        triangle_ids[order] = np.repeat(tile_fill[chunk_keys] - chunk_starts, chunk_counts) + np.arange(end - start)
+        tile_fill[chunk_keys] += chunk_counts
+
+        new_triangle_ids[start:end] = triangle_ids
+        tiled_trs[triangle_ids] = trs[start:end]
+        if len(attribute_codes) > 0:
+            tiled_attribute_codes[triangle_ids] = attribute_codes[start:end]
+
+    # third pass: renumber the neighbours, and number the vertices in order of first use
+    n_used = 0
+    new_vertex_ids[:] = -1
+    for start in range(0, n_trs, TILE_CHUNK_SIZE):
+        chunk = np.array(tiled_trs[start:start + TILE_CHUNK_SIZE], dtype=np.int64)
+        neighbours = chunk[:, 3:]
+        chunk[:, 3:] = np.where(neighbours != -1, new_triangle_ids[neighbours], -1)
+
+        corners = chunk[:, :3].ravel()
+        unseen, first_use = np.unique(corners[new_vertex_ids[corners] == -1], return_index=True)
+        new_vertex_ids[unseen[np.argsort(first_use)]] = np.arange(n_used, n_used + len(unseen))
+        n_used += len(unseen)
+        chunk[:, :3] = new_vertex_ids[chunk[:, :3]]
+        tiled_trs[start:start + TILE_CHUNK_SIZE] = chunk
+
+    # unused vertices at the end, then the vertices are moved to their new ids
+    for start in range(0, n_vts, TILE_CHUNK_SIZE):
+        vertex_ids = np.array(new_vertex_ids[start:start + TILE_CHUNK_SIZE])
+        unused = vertex_ids == -1
+        vertex_ids[unused] = np.arange(n_used, n_used + np.count_nonzero(unused))
+        n_used += np.count_nonzero(unused)
+        new_vertex_ids[start:start + TILE_CHUNK_SIZE] = vertex_ids
+        tiled_vts[vertex_ids] = vts[start:start + TILE_CHUNK_SIZE]
+
+    for array in (tiled_vts, tiled_trs, tiled_attribute_codes):
+        array.flush()
+    del tiled_vts, tiled_trs, tiled_attribute_codes, new_triangle_ids, new_vertex_ids
+    os.remove(file_path + ".triangle_ids.tmp")
+    os.remove(file_path + ".vertex_ids.tmp")
+    os.replace(temp_file_path, file_path)
+
+    # the tile table, only tiles with triangles are stored
+    tile_keys = np.nonzero(tile_counts)[0]
+    tile_cells = np.stack((tile_keys % shape[0], tile_keys // shape[0]), axis=1)
+    with open(get_tile_table_path(file_path), 'wb') as tile_table_file:
+        np.savez(tile_table_file, tile_size=tile_size, origin=origin, shape=shape, tile_cells=tile_cells,
+                 tile_offsets=np.append(tile_starts[tile_keys], n_trs), tile_bounding_boxes=tile_bounding_boxes[tile_keys])
+
+def read_tiled_tin(file_path, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Explination: Open the tiled version of a tin file, it is created first if it does not exist yet,
+    if it is older than the tin file, or if it has a different tile size.
+    The tin is tiled from the memory map of a binary tin file. An objp file is parsed (in memory) into its binary cache first,
+    see read_from_objp, and then tiled from the memory map of the cache (or from the parsed arrays if the cache can not be written).
+    ---------------
+    Input:
+        file_path : string - The path to the objp or binary tin file.
+        tile_size : float - The size of the square tiles.
+    ---------------
+    Output:
+        TiledTin - The tiled tin.
+    """
+    tiled_file_path = get_tiled_tin_path(file_path)
+    tile_table_path = get_tile_table_path(tiled_file_path)
+
+    if os.path.exists(tiled_file_path) and os.path.exists(tile_table_path) and \
+            os.path.getmtime(tiled_file_path) >= os.path.getmtime(file_path) and read_binary_header(tiled_file_path) is not None:
+        with np.load(tile_table_path) as tile_table:
+            if float(tile_table["tile_size"]) == float(tile_size):
+                return TiledTin(tiled_file_path)
+
+    print("=== tiling {} in tiles of {} m ===".format(file_path, tile_size))
+    if file_path.endswith(BINARY_TIN_EXTENSION):
+        vts, trs, attribute_codes, attribute_names, vertex_triangle_offsets, vertex_triangles, bounding_box_3d = read_binary_arrays(file_path)
+    else:
+        ground_tin = read_from_objp(file_path)
+        vts, trs = ground_tin.vts, ground_tin.trs
+        attribute_codes, attribute_names = ground_tin.attribute_codes, ground_tin.attribute_names
+        # the parsed arrays are only used if the binary cache could not be written
+        if os.path.isfile(get_binary_cache_path(file_path)):
+            del ground_tin, vts, trs, attribute_codes, attribute_names
+            vts, trs, attribute_codes, attribute_names, vertex_triangle_offsets, vertex_triangles, bounding_box_3d = read_binary_arrays(get_binary_cache_path(file_path))
+
+    write_tiled_tin(tiled_file_path, vts, trs, attribute_codes, attribute_names, tile_size)
+    return TiledTin(tiled_file_path)
@@ -0,0 +1,84 @@
+import numpy as np
+
+# the number of triangles handled at once while binning, this bounds the temporary memory
+GRID_CHUNK_SIZE = 1000000
+
+
+class TriangleGrid:
+
+    def __init__(self, vts, trs, cell_size=None):
+        """
+        Bins the 2d bounding boxes of all triangles into a uniform grid.
+        Every cell stores one triangle that overlaps it, which is a good triangle to start a walk from for any point in that cell.
+        """
+        corners_x = vts[:, 0][trs[:, :3]]
+        corners_y = vts[:, 1][trs[:, :3]]
+        self.origin = np.array([corners_x.min(), corners_y.min()]) if len(trs) else np.zeros(2)
+        extent = np.array([corners_x.max(), corners_y.max()]) - self.origin if len(trs) else np.ones(2)
+
+        # by default a cell holds about four average triangles, so a triangle bounding box overlaps only a few cells
+        if cell_size is None:
+            cell_size = max(2.0 * (extent[0] * extent[1] / max(len(trs), 1)) ** 0.5, 1e-6)
+        self.cell_size = float(cell_size)
+        self.shape = (np.floor(extent / self.cell_size).astype(np.int64) + 1)
+
+        self.cell_triangles = np.full(int(self.shape[0] * self.shape[1]), -1, dtype=np.int32)
+
+        for start in range(0, len(trs), GRID_CHUNK_SIZE):
+            end = min(start + GRID_CHUNK_SIZE, len(trs))
+            bounding_box_min = np.stack((corners_x[start:end].min(axis=1), corners_y[start:end].min(axis=1)), axis=1)
+            bounding_box_max = np.stack((corners_x[start:end].max(axis=1), corners_y[start:end].max(axis=1)), axis=1)
+            self.add_bounding_boxes(np.arange(start, end), bounding_box_min, bounding_box_max)
+
+    def get_cells(self, xy):
+        """
+        Explanation: Get the (clipped) cell column and row of points.
+        ---------------
+        Input:
+            xy : np.ndarray (n, 2) - the points
+        ---------------
+        Output:
+            np.ndarray (n, 2) of integers - the column and row of the cell of each point
+        """
+        cells = np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, self.shape - 1)
+
+    def add_bounding_boxes(self, triangle_ids, bounding_box_min, bounding_box_max):
+        """
+        Explanation: Store the triangles in all cells their bounding box overlaps.
+        ---------------
+        Input:
+            triangle_ids : np.ndarray (n,) - the ids of the triangles
+            bounding_box_min : np.ndarray (n, 2) - the minimum x, y of each triangle
+            bounding_box_max : np.ndarray (n, 2) - the maximum x, y of each triangle
+        ---------------
+        Output:
+            void (fills self.cell_triangles)
+        """
+        cell_min = self.get_cells(bounding_box_min)
+        cell_max = self.get_cells(bounding_box_max)
+        n_x = cell_max[:, 0] - cell_min[:, 0] + 1
+        n_y = cell_max[:, 1] - cell_min[:, 1] + 1
+        counts = n_x * n_y
+
+        # expand every triangle into one entry per overlapped cell
+        triangle_index = np.repeat(np.arange(len(triangle_ids)), counts)
+        first_entry = np.cumsum(counts) - counts
+        entry = np.arange(len(triangle_index)) - first_entry[triangle_index]
+        cell_x = cell_min[triangle_index, 0] + entry % n_x[triangle_index]
+        cell_y = cell_min[triangle_index, 1] + entry // n_x[triangle_index]
+
+        self.cell_triangles[cell_y * self.shape[0] + cell_x] = triangle_ids[triangle_index]
+
+    def get_start_triangles(self, xy):
+        """
+        Explanation: Get a triangle close to each point to start a walk from.
+        ---------------
+        Input:
+            xy : np.ndarray (n, 2) - the points
+        ---------------
+        Output:
+            np.ndarray (n,) - a triangle that overlaps the cell of each point, -1 if the cell is empty
+        """
+        cells = self.get_cells(np.asarray(xy, dtype=np.float64)[:, :2])
+        return self.cell_triangles[cells[:, 1] * self.shape[0] + cells[:, 0]].astype(np.int64)
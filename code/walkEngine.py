@@ -0,0 +1,209 @@
+import numpy as np
+
+# tolerance of the point in triangle test, the same as GroundTin.point_in_triangle
+POINT_IN_TRIANGLE_TOLERANCE = 10 ** (-4)
+# the neighbour across the edges (v0, v1), (v1, v2) and (v2, v0) of a triangle -> [v0, v1, v2, n0, n1, n2]
+EDGE_NEIGHBOURS = (5, 3, 4)
+# if (twice) the area between the segment and both edge vertices is smaller than this, the edge is crossed half way
+COLLINEAR_AREA = 0.1
+
+
+def walk_segment(vts, trs, tr, origin, destination):
+    """
+    Explanation: Walks from a triangle along the segment origin -> destination, until the triangle containing the destination.
+    This is the walk of CrossSection.get_cross_section fused into one loop over the raw vertex and triangle arrays:
+    the side tests of the exit edge are also used to compute where the edge is crossed, and nothing but floats
+    and integers is created per step.
+    ---------------
+    Input:
+        vts : np.ndarray (n, 3) - the vertices of the tin
+        trs : np.ndarray (m, 6) - the triangles of the tin, [v0, v1, v2, n0, n1, n2]
+        tr : integer - the triangle that contains the origin
+        origin : (x, y(, z)) - the point to walk from
+        destination : (x, y(, z)) - the point to walk to
+    ---------------
+    Output:
+        crossing_points : np.ndarray (k, 3) - the points where the segment crosses the triangle edges, in order
+        edge_parameters : np.ndarray (k,) - where each edge is crossed, 0 at its first vertex and 1 at its second
+        triangles : np.ndarray (k + 1,) - the triangles the segment passes through, the last one contains the destination
+        edges : np.ndarray (k,) - the edge (0, 1 or 2) through which each triangle is left
+    """
+    origin_x, origin_y = float(origin[0]), float(origin[1])
+    destination_x, destination_y = float(destination[0]), float(destination[1])
+    e = POINT_IN_TRIANGLE_TOLERANCE
+
+    crossing_points = []
+    edge_parameters = []
+    triangles = [tr]
+    edges = []
+
+    while True:
+        v0, v1, v2 = trs.item(tr, 0), trs.item(tr, 1), trs.item(tr, 2)
+        x0, y0, z0 = vts.item(v0, 0), vts.item(v0, 1), vts.item(v0, 2)
+        x1, y1, z1 = vts.item(v1, 0), vts.item(v1, 1), vts.item(v1, 2)
+        x2, y2, z2 = vts.item(v2, 0), vts.item(v2, 1), vts.item(v2, 2)
+
+        # stop in the triangle that contains the destination (same side tests as GroundTin.point_in_triangle)
+        if (((x0 - destination_x) * (y1 - destination_y)) - ((x1 - destination_x) * (y0 - destination_y)) >= -e and
+                ((x1 - destination_x) * (y2 - destination_y)) - ((x2 - destination_x) * (y1 - destination_y)) >= -e and
+                ((x2 - destination_x) * (y0 - destination_y)) - ((x0 - destination_x) * (y2 - destination_y)) >= -e):
+            break
+
+        # the side of each vertex relative to the segment
+        side_0 = ((origin_x - x0) * (destination_y - y0)) - ((destination_x - x0) * (origin_y - y0))
+        side_1 = ((origin_x - x1) * (destination_y - y1)) - ((destination_x - x1) * (origin_y - y1))
+        side_2 = ((origin_x - x2) * (destination_y - y2)) - ((destination_x - x2) * (origin_y - y2))
+
+        # the segment leaves the triangle through the edge that goes from its right to its left
+        if side_0 <= 0 and side_1 > 0:
+            edge = 0
+            side_right, side_left = side_0, side_1
+            right_x, right_y, right_z, left_x, left_y, left_z = x0, y0, z0, x1, y1, z1
+        elif side_1 <= 0 and side_2 > 0:
+            edge = 1
+            side_right, side_left = side_1, side_2
+            right_x, right_y, right_z, left_x, left_y, left_z = x1, y1, z1, x2, y2, z2
+        elif side_2 <= 0 and side_0 > 0:
+            edge = 2
+            side_right, side_left = side_2, side_0
+            right_x, right_y, right_z, left_x, left_y, left_z = x2, y2, z2, x0, y0, z0
+        else:
+            raise RuntimeError("the walk from {} to {} can not leave triangle {}".format((origin_x, origin_y), (destination_x, destination_y), tr))
+
+        # the area ratio of both vertices gives where the edge is crossed, see GroundTin.intersection_point
+        area_right = abs(side_right)
+        area_left = abs(side_left)
+        if (area_left + area_right) < COLLINEAR_AREA:
+            part_right = 0.5
+        else:
+            part_right = area_right / (area_left + area_right)
+
+        crossing_points.append((right_x + (left_x - right_x) * part_right,
+                                right_y + (left_y - right_y) * part_right,
+                                right_z + (left_z - right_z) * part_right))
+        edge_parameters.append(part_right)
+        edges.append(edge)
+
+        # Make sure that we have not gotten of the TIN
+        if trs.item(tr, EDGE_NEIGHBOURS[edge]) == -1:
+            raise RuntimeError("the walk from {} to {} leaves the tin at triangle {}".format((origin_x, origin_y), (destination_x, destination_y), tr))
+        tr = trs.item(tr, EDGE_NEIGHBOURS[edge])
+        triangles.append(tr)
+
+    return (np.array(crossing_points, dtype=np.float64).reshape(-1, 3), np.array(edge_parameters, dtype=np.float64),
+            np.array(triangles, dtype=np.int64), np.array(edges, dtype=np.int64))
+
+
+def walk_fan(vts, trs, tr, origin, destinations):
+    """
+    Explanation: Walks from one triangle along all segments origin -> destination at the same time, like a fan of rays from a receiver.
+    Every step moves all rays that have not reached their destination into their next triangle: the vertices of the current
+    triangles are gathered once per step and the side tests of all rays are done together with numpy.
+    The arithmetic is the same as walk_segment, so every ray gives exactly the same result as walking it on its own.
+    ---------------
+    Input:
+        vts : np.ndarray (n, 3) - the vertices of the tin
+        trs : np.ndarray (m, 6) - the triangles of the tin, [v0, v1, v2, n0, n1, n2]
+        tr : integer - the triangle that contains the origin
+        origin : (x, y(, z)) - the point all rays start from
+        destinations : np.ndarray (r, 2) - the point every ray walks to
+    ---------------
+    Output:
+        list - the walk of every ray, (crossing_points, edge_parameters, triangles, edges) as returned by walk_segment
+    """
+    origin_x, origin_y = float(origin[0]), float(origin[1])
+    destinations = np.asarray(destinations, dtype=np.float64)
+    n_rays = len(destinations)
+    e = POINT_IN_TRIANGLE_TOLERANCE
+    edge_neighbours = np.array(EDGE_NEIGHBOURS)
+
+    # the rays that are still walking, with their triangle and destination
+    active = np.arange(n_rays)
+    current = np.full(n_rays, tr, dtype=np.int64)
+    destination_x = destinations[:, 0].copy()
+    destination_y = destinations[:, 1].copy()
+
+    # every step adds the crossings of the rays that moved on, they are grouped per ray at the end
+    step_rays = []
+    step_points = []
+    step_parameters = []
+    step_triangles = []
+    step_edges = []
+
+    while active.size > 0:
+        triangle_vertices = trs[current, :3]
+        x = vts[triangle_vertices, 0]
+        y = vts[triangle_vertices, 1]
+        dx = destination_x[:, None]
+        dy = destination_y[:, None]
+
+        # stop in the triangle that contains the destination (same side tests as GroundTin.point_in_triangle)
+        x_next = np.roll(x, -1, axis=1)
+        y_next = np.roll(y, -1, axis=1)
+        inside = ((((x - dx) * (y_next - dy)) - ((x_next - dx) * (y - dy))) >= -e).all(axis=1)
+        if inside.any():
+            walking = ~inside
+            active, current, triangle_vertices = active[walking], current[walking], triangle_vertices[walking]
+            destination_x, destination_y = destination_x[walking], destination_y[walking]
+            x, y = x[walking], y[walking]
+            if active.size == 0:
+                break
+            dx = destination_x[:, None]
+            dy = destination_y[:, None]
+
+        # the side of each vertex relative to the segment
+        sides = ((origin_x - x) * (dy - y)) - ((dx - x) * (origin_y - y))
+        sides_next = np.roll(sides, -1, axis=1)
+
+        # the segment leaves the triangle through the first edge that goes from its right to its left
+        exits = (sides <= 0) & (sides_next > 0)
+        if not exits.any(axis=1).all():
+            stuck = np.argmin(exits.any(axis=1))
+            raise RuntimeError("the walk from {} to {} can not leave triangle {}".format(
+                (origin_x, origin_y), (float(destination_x[stuck]), float(destination_y[stuck])), int(current[stuck])))
+        edge = np.argmax(exits, axis=1)
+        right = edge[:, None]
+        left = ((edge + 1) % 3)[:, None]
+
+        # the area ratio of both vertices gives where the edge is crossed, see GroundTin.intersection_point
+        area_right = np.abs(np.take_along_axis(sides, right, axis=1)[:, 0])
+        area_left = np.abs(np.take_along_axis(sides, left, axis=1)[:, 0])
+        area = area_left + area_right
+        with np.errstate(divide="ignore", invalid="ignore"):
+            part_right = np.where(area < COLLINEAR_AREA, 0.5, area_right / area)
+
+        right_vertices = vts[np.take_along_axis(triangle_vertices, right, axis=1)[:, 0]]
+        left_vertices = vts[np.take_along_axis(triangle_vertices, left, axis=1)[:, 0]]
+
+        step_rays.append(active)
+        step_points.append(right_vertices + (left_vertices - right_vertices) * part_right[:, None])
+        step_parameters.append(part_right)
+        step_edges.append(edge)
+
+        next_triangles = trs[current, edge_neighbours[edge]]
+        # Make sure that we have not gotten of the TIN
+        if (next_triangles == -1).any():
+            outside = np.argmax(next_triangles == -1)
+            raise RuntimeError("the walk from {} to {} leaves the tin at triangle {}".format(
+                (origin_x, origin_y), (float(destination_x[outside]), float(destination_y[outside])), int(current[outside])))
+        current = next_triangles
+        step_triangles.append(current)
+
+    if len(step_rays) == 0:
+        return [(np.zeros((0, 3)), np.zeros(0), np.array([tr], dtype=np.int64), np.zeros(0, dtype=np.int64)) for i in range(n_rays)]
+
+    # group the crossings per ray, in the order they were walked
+    rays = np.concatenate(step_rays)
+    order = np.argsort(rays, kind="stable")
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(rays, minlength=n_rays))))
+    points = np.concatenate(step_points)[order]
+    parameters = np.concatenate(step_parameters)[order]
+    triangles = np.concatenate(step_triangles)[order]
+    edges = np.concatenate(step_edges)[order]
+
+    walks = []
+    for i in range(n_rays):
+        start, end = bounds[i], bounds[i + 1]
+        walks.append((points[start:end], parameters[start:end],
+                      np.concatenate(([tr], triangles[start:end])).astype(np.int64), edges[start:end].astype(np.int64)))
+    return walks
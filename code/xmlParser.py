@@ -1,14 +1,20 @@
-import bisect
 import misc
 import numpy as np
 import xml.etree.cElementTree as ET
 
 class XmlParser:
     
-    def __init__(self, path, ext, mat):
-        self.vts = np.array(path)
-        self.mat = mat
-        self.ext = ext
+    def __init__(self, cross_section):
+        # the vertices are copied, they are changed by normalize_path
+        self.vts = np.array(cross_section.vertices, dtype=np.float64)
+        self.mat = cross_section.material_codes
+
+        # the extension record, the source is the first vertex, the receiver the last and the wall is optional (-1)
+        self.source_height = cross_section.source_height
+        self.source_length = cross_section.source_length
+        self.receiver_height = cross_section.receiver_height
+        self.wall_index = cross_section.wall_index
+        self.wall_height = cross_section.wall_height
 
     def normalize_path(self):
         """
@@ -50,19 +56,17 @@ class XmlParser:
         p_start = self.vts[start]
         p_end = self.vts[end]
         line_length = ((p_end[2] - p_start[2]) ** 2 + (p_end[0] - p_start[0]) ** 2) ** 0.5
-        offsets = []
+        points = self.vts[start + 1:end]
 
-        for id in range(start+1, end):
-            # do side test (return lenght of line x perpendicualr distace) so devide it by the length and voila
-            diff = abs(misc.side_test((p_start[0], p_start[2]), (p_end[0], p_end[2]), (self.vts[id,0], self.vts[id,2]))) / line_length
-            offsets.append(diff)
-
-        return np.array(offsets)
+        # side test of all points at once (misc.side_test in the x, z plane gives the lenght of line x perpendicualr distace), so devide it by the length
+        sides = ((p_start[0] - points[:, 0]) * (p_end[2] - points[:, 2])) - ((p_end[0] - points[:, 0]) * (p_start[2] - points[:, 2]))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.abs(sides) / line_length
 
     def douglas_Peucker(self, threshold):
         """
         Explination:
-            simplifies the path using douglas peucker algorithm
+            simplifies the path using douglas peucker algorithm, the segments that still have to be checked are kept on a stack
         ---------------
         Input: 
             Threshold: the minimal perpendicular distance between a line and a point for the point to be imported.
@@ -71,50 +75,45 @@ class XmlParser:
             void (updates self.vts)
         """
         # === create initial path ===
-        # initalize simple path with all points that have an extension (source, receiver, barrier, etc)
-        path_simple = []
-        assert(len(self.ext) > 1)
-        for key in self.ext:
-            bisect.insort(path_simple, key)
-
-        # maintain the line material, insert every points where the material changes
-        for i in range(len(self.mat)-1):
-            if(self.mat[i] != self.mat[i+1]):
-                if i not in self.ext:
-                    bisect.insort(path_simple, i)
+        # initalize simple path with all points that have an extension (source, receiver, wall)
+        assert(len(self.vts) > 1)
+        keep = np.zeros(len(self.vts), dtype=bool)
+        keep[[0, len(self.vts) - 1]] = True
+        if self.wall_index != -1:
+            keep[self.wall_index] = True
 
-        # == insert relevant points ===
-        i = 0
-        while(i < len(path_simple) - 1):
-            start = path_simple[i]
-            end = path_simple[i+1]
+        # maintain the line material, keep every points where the material changes
+        keep[np.nonzero(self.mat[:-1] != self.mat[1:])[0]] = True
 
+        # == insert relevant points ===
+        path_simple = np.nonzero(keep)[0].tolist()
+        segments = list(zip(path_simple[:-1], path_simple[1:]))
+        while segments:
+            start, end = segments.pop()
             if(end - start < 2):
-                i += 1 # go to bext segment
                 continue
 
             # Get the offset between the line from start to end, and the points in between
             offsets = self.get_offsets_perpendicular(start, end)
-            
+
             # get the id of the highest offset
-            id_max = np.argmax(offsets)
+            id_max = int(np.argmax(offsets))
 
-            # Check if the offset is above the treshold, if so, add the point to the list
+            # Check if the offset is above the treshold, if so, keep the point and check both new segments
             if(offsets[id_max] > threshold):
                 # Make sure to get the right id, id_max starts at 0, but 0 is already 1 further than the start point.
-                path_simple.insert(i+1, id_max + start + 1)
-            else:
-                i += 1
-        
-        # === post-processing; update extension dictionary, materials and vertices ===
-        # Update the extensions with the new positions in the list.
-        for id, id_old in enumerate(path_simple):
-            if id_old in self.ext and id != id_old:
-                # Create a new key, with the correct id, and assign is het value of the old id that is popped.
-                self.ext[id] = self.ext.pop(id_old)
+                id_max += start + 1
+                keep[id_max] = True
+                segments.append((start, id_max))
+                segments.append((id_max, end))
 
-        self.mat = [self.mat[id] for id in path_simple]
-        self.vts = np.array([self.vts[id] for id in path_simple])
+        # === post-processing; update the wall extension, materials and vertices ===
+        # The source and receiver stay the first and last point, the wall gets its new position in the list.
+        if self.wall_index != -1:
+            self.wall_index = int(np.count_nonzero(keep[:self.wall_index]))
+
+        self.mat = self.mat[keep]
+        self.vts = self.vts[keep]
 
     def write_xml(self, filename, Lw, validate):
         """
@@ -151,32 +150,36 @@ class XmlParser:
         # create the path
         path = ET.SubElement(root, "path")
 
-        for id in range(len(self.vts)):
+        for id, (x, y, z) in enumerate(self.vts.tolist()):
             # create a control point
             cp = ET.Element("cp")
 
             # insert the pos (position)
             pos = ET.SubElement(cp, "pos")
-            ET.SubElement(pos, "x").text = "{:.2f}".format(self.vts[id,0])
-            ET.SubElement(pos, "y").text = "{:.2f}".format(self.vts[id,1])
-            ET.SubElement(pos, "z").text = "{:.2f}".format(self.vts[id,2])
+            ET.SubElement(pos, "x").text = "{:.2f}".format(x)
+            ET.SubElement(pos, "y").text = "{:.2f}".format(y)
+            ET.SubElement(pos, "z").text = "{:.2f}".format(z)
             
             # Insert the material
-            ET.SubElement(cp, "mat", id=self.mat[id])
+            ET.SubElement(cp, "mat", id=misc.MATERIAL_NAMES[self.mat[id]])
 
             # append the created control point to the path
             path.append(cp)
 
-        for id, val in self.ext.items():
-            # set the first point as receiver
+        # the source is the first point, the receiver the last one, and there is a wall if the path is reflected
+        extensions = [(0, "source"), (len(self.vts) - 1, "receiver")]
+        if self.wall_index != -1:
+            extensions.append((self.wall_index, "wall"))
+
+        for id, ext_name in extensions:
             ext = ET.Element("ext")
-            ext_type = ET.SubElement(ext, val[0])
+            ext_type = ET.SubElement(ext, ext_name)
 
             # if its a source, this comes before the height
-            if(val[0] == "source"):
-                ET.SubElement(ext_type, "h").text = "{:.2f}".format(val[1])
+            if(ext_name == "source"):
+                ET.SubElement(ext_type, "h").text = "{:.2f}".format(self.source_height)
                 # Compute the right noise level based on the source line length
-                power_levels = Lw['power'] + 10 * np.log10(val[2])
+                power_levels = Lw['power'] + 10 * np.log10(self.source_length)
                 power_levels_str = ""
                 for dB in power_levels:
                     power_levels_str += " {:.1f}".format(dB)
@@ -187,14 +190,14 @@ class XmlParser:
                     frequencyWeighting=Lw['frequencyWeighting']
                 ).text = power_levels_str
 
-            # If the extension type is wall or edge (refelction or diffraction, store the height and the material)
-            elif (val[0] == "wall" or val[0] == "edge"):
-                ET.SubElement(ext_type, "h").text = "{:.2f}".format(val[1])
-                ET.SubElement(ext_type, "mat", id=val[2])
+            # If the extension type is wall (refelction), store the height and the material
+            elif (ext_name == "wall"):
+                ET.SubElement(ext_type, "h").text = "{:.2f}".format(self.wall_height)
+                ET.SubElement(ext_type, "mat", id=misc.MATERIAL_NAMES[misc.MATERIAL_A0])
             
             # currently only when the extension is receiver, only store the relative height above ground.
             else:
-                ET.SubElement(ext_type, "h").text = "{:.2f}".format(val[1])
+                ET.SubElement(ext_type, "h").text = "{:.2f}".format(self.receiver_height)
 
             # add this extension to the right path element (control point)
             path[id].append(ext)
@@ -1,13 +1,32 @@
+import os
+
+from queue import Queue
+from threading import Thread
+from time import perf_counter
 from xmlParser import XmlParser
 
+# the number of receivers that can be computed ahead of the xml writer
+XML_QUEUE_SIZE = 16
+
 class XmlParserManager:
 
-    def __init__(self):
-        self.prepared_paths = {}
+    def __init__(self, simplify_threshold=None, metrics=None):
+        # the paths are simplified with Douglas Peucker before they are written if this is set, see XmlParser.douglas_Peucker
+        self.simplify_threshold = simplify_threshold
+        # gets the time of writing the xml files and the number of files, optional
+        self.metrics = metrics
+
+        # the receivers are numbered over all calls of write_xml_files, so batches of receivers can be written one by one
+        self.receiver_count = 0
+        # the number and the number of paths of every receiver that is written, by receiver
+        self.receivers = {}
+        # receivers that keep the number and get the paths of an earlier run (see main --incremental), they do not get the next number
+        self.receiver_numbers = {}
 
     def write_xml_files(self, cross_sections_manager, Lw, output_folder):
         """
         Explination: prepare cross sections for writing to xml, compute the noise level per section and then write them to xml.
+        The receivers are numbered on from the previous call, write_receiver_dict writes the numbers of all receivers.
         ---------------
         Input:
             cross_section_maanger (dictionary) - holds all the cross sections per receiver
@@ -16,40 +35,131 @@ class XmlParserManager:
         ---------------
         Output: void (writes the xml files)
         """
-
-        j = 0
-        receivers = ""
-
         # Loop over each list of cross_sections per receiver.
         for receiver, cross_sections in cross_sections_manager.cross_sections.items():
-            # save the receiver, so the order is saved, later written to seperate file with all receivers.
-            receivers += '{} {:.2f} {:.2f}\n'.format(j, receiver[0], receiver[1])
+            self.write_receiver_xml_files(receiver, cross_sections, Lw, output_folder)
+
+    def write_receiver_xml_files(self, receiver, cross_sections, Lw, output_folder):
+        """
+        Explination: write the cross sections of one receiver to xml, the receiver gets the next number (or the number it keeps in receiver_numbers).
+        The paths of an earlier run of the receiver that are not overwritten are removed.
+        ---------------
+        Input:
+            receiver (tuple) - the coordinates of the receiver
+            cross_sections (list) - the cross sections of the receiver
+            Lw (dictionary) - dictionary holding the default noise values, type of source etc.
+            output_folder (list) - the path to write the files to, split up into map items ("outut/", "xml/")
+        ---------------
+        Output: void (writes the xml files)
+        """
+        watch = perf_counter()
+        j, previous_path_count = self.receiver_numbers.get(receiver, (None, 0))
+        if j is None:
+            j = self.receiver_count
+            self.receiver_count += 1
+        # save the receiver, so the order is saved, later written to seperate file with all receivers.
+        self.receivers[receiver] = (j, len(cross_sections))
+
+        # Loop over each cross_section
+        for i, cross_section in enumerate(cross_sections):
+            # Create an xml instance, it reads the arrays and extension record of the cross section
+            xml = XmlParser(cross_section)
+            # Makes it local, lift its such that z is also positive, and path is in positive direction
+            xml.normalize_path()
+
+            # Optionally, simplify the path (using Douglas Peucker algorithm)
+            if self.simplify_threshold is not None:
+                xml.douglas_Peucker(self.simplify_threshold)
+
+            # write the xml to the output file
+            output_file_path = "{}/path_{}_{}.xml".format(output_folder[1], j, i)
+            xml.write_xml(output_file_path, Lw, False)
 
-            # for optional continuous processing, store the prepared path in this class.
-            self.prepared_paths[receiver] = []
+        self.remove_receiver_xml_files(j, previous_path_count, output_folder, len(cross_sections))
 
-            # Loop over each cross_section
-            for i, cross_section in enumerate(cross_sections):
-                extension = cross_section.extension
-                path = cross_section.vertices
-                material = cross_section.materials
+        if self.metrics is not None:
+            self.metrics.count("xml_files_written", len(cross_sections))
+            self.metrics.add_time("xml_write", watch)
+
+    def write_xml_stream(self, receiver_cross_sections, Lw, output_folder):
+        """
+        Explination: write the cross sections of receivers to xml while they are being computed.
+        The receivers are taken from the iterable in this thread and written in a second thread, at most XML_QUEUE_SIZE
+        receivers wait to be written. Nothing is kept after a receiver is written, apart from its line in the receiver dict.
+        ---------------
+        Input:
+            receiver_cross_sections (iterable) - (receiver, list of cross sections) per receiver, like a generator
+            Lw (dictionary) - dictionary holding the default noise values, type of source etc.
+            output_folder (list) - the path to write the files to, split up into map items ("outut/", "xml/")
+        ---------------
+        Output: void (writes the xml files)
+        """
+        queue = Queue(XML_QUEUE_SIZE)
+        errors = []
+        writer = Thread(target=self.write_queue, args=(queue, Lw, output_folder, errors))
+        writer.start()
 
-                # Create an xml instance
-                xml = XmlParser(path, extension, material)
-                # Makes it local, lift its such that z is also positive, and path is in positive direction
-                xml.normalize_path()
+        try:
+            for receiver, cross_sections in receiver_cross_sections:
+                queue.put((receiver, cross_sections))
+        finally:
+            # the writer stops at None, also when computing the cross sections failed
+            queue.put(None)
+            writer.join()
 
-                # Optionally, simplify the path (using Douglas Peucker algorithm) (Currently not used)
-                #xml.douglas_Peucker(0.1)
+        if errors:
+            raise errors[0]
 
-                # write the xml to the output file
-                output_file_path = "{}/path_{}_{}.xml".format(output_folder[1], j, i)
-                xml.write_xml(output_file_path, Lw, False)
-                self.prepared_paths[receiver].append(xml)
+    def write_queue(self, queue, Lw, output_folder, errors):
+        """
+        Explination: write the receivers from a queue to xml until None is taken from it, used by write_xml_stream.
+        After an error the queue is still emptied, so the thread that fills it does not wait forever.
+        ---------------
+        Input:
+            queue (Queue) - (receiver, list of cross sections) per receiver, ending with None
+            Lw (dictionary) - dictionary holding the default noise values, type of source etc.
+            output_folder (list) - the path to write the files to, split up into map items ("outut/", "xml/")
+            errors (list) - gets the error of the writer, if any
+        ---------------
+        Output: void (writes the xml files)
+        """
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            if errors:
+                continue
+            try:
+                self.write_receiver_xml_files(item[0], item[1], Lw, output_folder)
+            except Exception as error:
+                errors.append(error)
 
-            j += 1
-        
-        # write the receivers to a text file so the receiver location can be retrieved after analyzing the xml file.
-        with open('{}/receiver_dict.txt'.format(output_folder[0]), 'w') as f:
-            f.write(receivers)
+    def write_receiver_dict(self, output_folder):
+        """
+        Explination: write the receivers to a text file so the receiver location can be retrieved after analyzing the xml file.
+        ---------------
+        Input:
+            output_folder (string) - the folder to write the receiver_dict.txt file to
+        ---------------
+        Output: void (writes the receiver_dict.txt file)
+        """
+        numbered_receivers = sorted((j, receiver) for receiver, (j, path_count) in self.receivers.items())
+        with open('{}/receiver_dict.txt'.format(output_folder), 'w') as f:
+            f.write("".join('{} {:.2f} {:.2f}\n'.format(j, receiver[0], receiver[1]) for j, receiver in numbered_receivers))
 
+    def remove_receiver_xml_files(self, number, path_count, output_folder, first_path=0):
+        """
+        Explination: remove the xml files of a receiver of an earlier run, the ones it does not have anymore or all of them when it is gone.
+        ---------------
+        Input:
+            number (integer) - the number of the receiver
+            path_count (integer) - the number of xml files of the receiver
+            output_folder (list) - the path of the files, split up into map items ("outut/", "xml/")
+            first_path (integer) - the first path to remove, the paths before it are kept
+        ---------------
+        Output: void (removes the xml files)
+        """
+        for i in range(first_path, path_count):
+            output_file_path = "{}/path_{}_{}.xml".format(output_folder[1], number, i)
+            if os.path.exists(output_file_path):
+                os.remove(output_file_path)